@@ -12,6 +12,8 @@ if SRC_DIR not in sys.path:
     sys.path.insert(0, SRC_DIR)
 
 from product_categories import ProductCategoryStore
+from db_statements import has_item_name_index, item_name_match, order_item_match
+from money import from_cents, sum_money, to_cents
 from server_utils import run_dashboard_app
 
 RECATEGORIZABLE_CATCHALL_CATEGORIES = (
@@ -31,6 +33,13 @@ def get_db():
     conn.row_factory = sqlite3.Row
     return conn
 
+def item_name_fts():
+    conn = get_db()
+    try:
+        return has_item_name_index(conn)
+    finally:
+        conn.close()
+
 def safe_float(val, default=0.0):
     if val is None:
         return default
@@ -187,10 +196,7 @@ def get_orders():
                oh.amount_tendered, oh.change_given
         FROM order_history oh
         LEFT JOIN order_items oi ON oh.order_id = oi.order_id
-        LEFT JOIN items it ON (
-            (oi.item_id IS NOT NULL AND oi.item_id != "" AND it.item_id = oi.item_id)
-            OR ((oi.item_id IS NULL OR oi.item_id = "") AND oi.barcode IS NOT NULL AND oi.barcode != "" AND it.barcode = oi.barcode)
-        )
+        LEFT JOIN items it ON it.item_id = oi.item_key
         WHERE 1=1
     """
     params = []
@@ -214,8 +220,9 @@ def get_orders():
         query += " AND LOWER(it.product_category) = LOWER(?)"
         params.append(category)
     if keyword:
-        query += " AND (LOWER(oi.name) LIKE ? OR LOWER(oh.items) LIKE ?)"
-        params.extend([f"%{keyword}%", f"%{keyword}%"])
+        item_match, item_params = order_item_match(keyword, fts=has_item_name_index(conn))
+        query += f" AND {item_match}"
+        params.extend(item_params)
     
     query += " ORDER BY oh.timestamp DESC"
     
@@ -269,10 +276,7 @@ def get_order_items():
         SELECT oi.*, oh.payment_method, it.product_category AS resolved_product_category
         FROM order_items oi
         LEFT JOIN order_history oh ON oi.order_id = oh.order_id
-        LEFT JOIN items it ON (
-            (oi.item_id IS NOT NULL AND oi.item_id != "" AND it.item_id = oi.item_id)
-            OR ((oi.item_id IS NULL OR oi.item_id = "") AND oi.barcode IS NOT NULL AND oi.barcode != "" AND it.barcode = oi.barcode)
-        )
+        LEFT JOIN items it ON it.item_id = oi.item_key
         WHERE 1=1
     """
     params = []
@@ -284,8 +288,9 @@ def get_order_items():
         query += " AND oi.order_timestamp <= ?"
         params.append(end_date + " 23:59:59")
     if keyword:
-        query += " AND LOWER(oi.name) LIKE ?"
-        params.append(f"%{keyword}%")
+        name_match, name_param = item_name_match(keyword, fts=has_item_name_index(conn))
+        query += f" AND {name_match}"
+        params.append(name_param)
     if category:
         query += " AND LOWER(it.product_category) = LOWER(?)"
         params.append(category)
@@ -378,10 +383,7 @@ def get_uncategorized_items():
             SUM(COALESCE(oi.qty, 0)) AS total_qty,
             MAX(it.product_category) AS current_category
         FROM order_items oi
-        LEFT JOIN items it ON (
-            (oi.item_id IS NOT NULL AND oi.item_id != '' AND it.item_id = oi.item_id)
-            OR ((oi.item_id IS NULL OR oi.item_id = '') AND oi.barcode IS NOT NULL AND oi.barcode != '' AND it.barcode = oi.barcode)
-        )
+        LEFT JOIN items it ON it.item_id = oi.item_key
         WHERE oi.name IS NOT NULL
           AND oi.name != ''
           AND (
@@ -480,10 +482,7 @@ def get_summary_stats():
                oh.total_with_tax as order_total, it.product_category AS resolved_product_category
         FROM order_items oi
         LEFT JOIN order_history oh ON oi.order_id = oh.order_id
-        LEFT JOIN items it ON (
-            (oi.item_id IS NOT NULL AND oi.item_id != "" AND it.item_id = oi.item_id)
-            OR ((oi.item_id IS NULL OR oi.item_id = "") AND oi.barcode IS NOT NULL AND oi.barcode != "" AND it.barcode = oi.barcode)
-        )
+        LEFT JOIN items it ON it.item_id = oi.item_key
         WHERE 1=1
     """
     params_item = []
@@ -498,8 +497,9 @@ def get_summary_stats():
         item_query += " AND LOWER(oh.payment_method) = LOWER(?)"
         params_item.append(payment_method)
     if keyword:
-        item_query += " AND LOWER(oi.name) LIKE ?"
-        params_item.append(f"%{keyword}%")
+        name_match, name_param = item_name_match(keyword, fts=has_item_name_index(conn))
+        item_query += f" AND {name_match}"
+        params_item.append(name_param)
     if category:
         item_query += " AND LOWER(it.product_category) = LOWER(?)"
         params_item.append(category)
@@ -546,15 +546,16 @@ def get_summary_stats():
     
     # Calculate from order_items 
     total_orders = len(orders_seen)
-    total_subtotal = sum(i["line_subtotal"] for i in items)  # Pre-tax revenue from items
+    total_subtotal = sum_money(i["line_subtotal"] for i in items)  # Pre-tax revenue from items
     total_units = sum(i["qty"] for i in items)
     total_cost = sum(safe_float(i.get("line_cost")) for i in items if i.get("line_cost"))
     
     # Tax and discount come from order_history 
-    total_tax = sum(o["tax"] for o in orders_seen.values())
-    total_discount = sum(o["discount"] for o in orders_seen.values())
-    total_revenue = sum(o["total_with_tax"] for o in orders_seen.values())
-    revenue_less_tax = total_revenue - total_tax
+    # money is summed in cents so thousands of orders add up to the cent
+    total_tax = sum_money(o["tax"] for o in orders_seen.values())
+    total_discount = sum_money(o["discount"] for o in orders_seen.values())
+    total_revenue = sum_money(o["total_with_tax"] for o in orders_seen.values())
+    revenue_less_tax = from_cents(to_cents(total_revenue) - to_cents(total_tax))
     
     # Track cost data completeness (after backfill)
     items_with_cost = [i for i in items if i.get("unit_cost") is not None]
@@ -595,7 +596,10 @@ def get_summary_stats():
     for oid, o in orders_seen.items():
         pm = safe_str(o["payment_method"], "unknown").lower()
         payment_breakdown[pm]["count"] += 1
-        payment_breakdown[pm]["total"] += o["total_with_tax"]
+        payment_breakdown[pm]["total"] += to_cents(o["total_with_tax"])
+    
+    for pm in payment_breakdown.values():
+        pm["total"] = from_cents(pm["total"])
     
     category_breakdown = defaultdict(lambda: {"units": 0, "revenue": 0, "cost": 0})
     for i in items:
@@ -654,8 +658,9 @@ def get_timeseries():
         query += " AND LOWER(payment_method) = LOWER(?)"
         params.append(payment_method)
     if keyword:
-        query += " AND LOWER(items) LIKE ?"
-        params.append(f"%{keyword}%")
+        item_match, item_params = order_item_match(keyword, column="order_id", fts=has_item_name_index(conn))
+        query += f" AND {item_match}"
+        params.extend(item_params)
     
     query += " ORDER BY timestamp"
     cursor.execute(query, params)
@@ -664,7 +669,7 @@ def get_timeseries():
     if category:
         item_query = """
             SELECT DISTINCT oi.order_id FROM order_items oi
-            LEFT JOIN items it ON ((oi.item_id IS NOT NULL AND oi.item_id != '' AND it.item_id = oi.item_id) OR ((oi.item_id IS NULL OR oi.item_id = '') AND oi.barcode IS NOT NULL AND oi.barcode != '' AND it.barcode = oi.barcode))
+            LEFT JOIN items it ON it.item_id = oi.item_key
             WHERE LOWER(it.product_category) = LOWER(?)
         """
         cursor.execute(item_query, [category])
@@ -692,21 +697,22 @@ def get_timeseries():
         else:
             key = ts.strftime("%Y-%m-%d")
         
-        buckets[key]["revenue"] += safe_float(o["total_with_tax"])
+        # summed in cents, turned back into dollars below
+        buckets[key]["revenue"] += to_cents(safe_float(o["total_with_tax"]))
         buckets[key]["orders"] += 1
-        buckets[key]["tax"] += safe_float(o["tax"])
-        buckets[key]["discount"] += safe_float(o["discount"])
+        buckets[key]["tax"] += to_cents(safe_float(o["tax"]))
+        buckets[key]["discount"] += to_cents(safe_float(o["discount"]))
     
     sorted_keys = sorted(buckets.keys())
     result = []
     for k in sorted_keys:
         result.append({
             "period": k,
-            "revenue": round(buckets[k]["revenue"], 2),
+            "revenue": from_cents(buckets[k]["revenue"]),
             "orders": buckets[k]["orders"],
-            "tax": round(buckets[k]["tax"], 2),
-            "discount": round(buckets[k]["discount"], 2),
-            "avg_order": round(buckets[k]["revenue"] / buckets[k]["orders"], 2) if buckets[k]["orders"] else 0,
+            "tax": from_cents(buckets[k]["tax"]),
+            "discount": from_cents(buckets[k]["discount"]),
+            "avg_order": round(from_cents(buckets[k]["revenue"]) / buckets[k]["orders"], 2) if buckets[k]["orders"] else 0,
         })
     
     return jsonify(result)
@@ -727,7 +733,7 @@ def get_top_items():
     query = """
         SELECT oi.item_id, oi.barcode, oi.name, it.product_category AS resolved_product_category, oi.qty, oi.unit_price, oi.line_subtotal, oi.unit_cost, oi.line_cost, oi.order_id
         FROM order_items oi
-        LEFT JOIN items it ON ((oi.item_id IS NOT NULL AND oi.item_id != "" AND it.item_id = oi.item_id) OR ((oi.item_id IS NULL OR oi.item_id = "") AND oi.barcode IS NOT NULL AND oi.barcode != "" AND it.barcode = oi.barcode))
+        LEFT JOIN items it ON it.item_id = oi.item_key
         WHERE oi.name IS NOT NULL AND oi.name != ''
     """
     params = []
@@ -887,42 +893,92 @@ def get_hourly_breakdown():
 
 @app.route("/api/export/csv")
 def export_csv():
-    import csv
-    from io import StringIO
     from flask import Response
+    from csv_export import iter_csv_chunks, iter_cursor
     
     data_type = request.args.get("type", "orders")
+    start_date = request.args.get("start_date")
+    end_date = request.args.get("end_date")
+    keyword = request.args.get("keyword", "").strip()
+    category = request.args.get("category", "").strip()
+    payment_method = request.args.get("payment_method", "").strip()
     
-    conn = get_db()
-    cursor = conn.cursor()
-    
+    params = []
     if data_type == "items":
-        cursor.execute("""
-            SELECT oi.*, oh.payment_method
+        query = """
+            SELECT oi.*, oh.payment_method, it.product_category AS resolved_product_category
             FROM order_items oi
             LEFT JOIN order_history oh ON oi.order_id = oh.order_id
-            ORDER BY oi.order_timestamp DESC
-        """)
-        rows = cursor.fetchall()
+            LEFT JOIN items it ON it.item_id = oi.item_key
+            WHERE 1=1
+        """
+        if start_date:
+            query += " AND oi.order_timestamp >= ?"
+            params.append(start_date)
+        if end_date:
+            query += " AND oi.order_timestamp <= ?"
+            params.append(end_date + " 23:59:59")
+        if keyword:
+            name_match, name_param = item_name_match(keyword, fts=item_name_fts())
+            query += f" AND {name_match}"
+            params.append(name_param)
+        if category:
+            query += " AND LOWER(it.product_category) = LOWER(?)"
+            params.append(category)
+        if payment_method:
+            query += " AND LOWER(oh.payment_method) = LOWER(?)"
+            params.append(payment_method)
+        query += " ORDER BY oi.order_timestamp DESC"
         headers = ["id", "order_id", "item_id", "barcode", "name", "product_category",
                    "qty", "unit_price", "line_subtotal", "unit_cost", "line_cost",
                    "taxable", "is_rolling_papers", "papers_per_pack", "order_timestamp", "payment_method"]
+        columns = {"product_category": "resolved_product_category"}
     else:
-        cursor.execute("SELECT * FROM order_history ORDER BY timestamp DESC")
-        rows = cursor.fetchall()
+        # item filters go through subqueries rather than a join so each order
+        # comes out once without DISTINCT buffering the whole result
+        query = "SELECT oh.* FROM order_history oh WHERE 1=1"
+        if start_date:
+            query += " AND oh.timestamp >= ?"
+            params.append(start_date)
+        if end_date:
+            query += " AND oh.timestamp <= ?"
+            params.append(end_date + " 23:59:59")
+        if payment_method:
+            query += " AND LOWER(oh.payment_method) = LOWER(?)"
+            params.append(payment_method)
+        if category:
+            query += """ AND oh.order_id IN (
+                SELECT oi.order_id FROM order_items oi
+                JOIN items it ON it.item_id = oi.item_key
+                WHERE LOWER(it.product_category) = LOWER(?))"""
+            params.append(category)
+        if keyword:
+            item_match, item_params = order_item_match(keyword, fts=item_name_fts())
+            query += f" AND {item_match}"
+            params.extend(item_params)
+        query += " ORDER BY oh.timestamp DESC"
         headers = ["order_id", "items", "total", "tax", "discount", "total_with_tax",
                    "timestamp", "payment_method", "amount_tendered", "change_given"]
+        columns = {}
     
-    conn.close()
-    
-    output = StringIO()
-    writer = csv.writer(output)
-    writer.writerow(headers)
-    for row in rows:
-        writer.writerow([row[h] if h in row.keys() else "" for h in headers])
+    def generate():
+        # rows go out a chunk at a time as the cursor walks the result, so a
+        # full-history export never sits in memory
+        conn = get_db()
+        try:
+            cursor = conn.execute(query, params)
+            names = {d[0]: i for i, d in enumerate(cursor.description)}
+            picks = [names.get(columns.get(h, h)) for h in headers]
+            rows = (
+                ["" if i is None else row[i] for i in picks]
+                for row in iter_cursor(cursor)
+            )
+            yield from iter_csv_chunks(rows, headers)
+        finally:
+            conn.close()
     
     return Response(
-        output.getvalue(),
+        generate(),
         mimetype="text/csv",
         headers={"Content-Disposition": f"attachment; filename={data_type}_export.csv"}
     )
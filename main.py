@@ -33,6 +33,12 @@ class RigsPOS(MDApp):
         self.utilities.load_settings()
         self.utilities.resume_or_lock()
 
+    def on_stop(self):
+        try:
+            self.db_manager.close_connection()
+        except Exception as e:
+            logger.warning(f"[RigsPOS] on_stop: {e}")
+
     def build(self):
         self.utilities.instantiate_modules()
         self.utilities.register_fonts()
@@ -0,0 +1,578 @@
+import os
+import bisect
+import logging
+from array import array
+from collections import defaultdict
+from typing import Dict
+
+from item_catalog import COLUMNS as CATALOG_COLUMNS, row_key
+
+logger = logging.getLogger("rigs_pos")
+
+
+def _gen_variants(code: str):
+    yield code
+    if len(code) > 1:
+        yield code[1:]
+    if len(code) > 4:
+        yield code[:-4]
+        yield code[1:-4]
+
+
+def _as_row(item):
+    if isinstance(item, dict):
+        return tuple(item.get(column) for column in CATALOG_COLUMNS)
+    return item
+
+
+def _item_ean(item):
+    if isinstance(item, dict):
+        return item.get("ean_barcode")
+    return item[12] if len(item) > 12 else None
+
+
+class BarcodeCache:
+    """Scanner lookup tables: canonical barcode buckets plus a variant map.
+
+    ``main[canon]["items"]`` holds the item rows sharing a barcode and
+    ``variant`` maps every accepted scan form (leading digit dropped, check
+    suffix dropped, EAN) to its canonical barcode. Two reverse indexes,
+    item key -> canonical and canonical -> variants it registered, let
+    upsert and remove touch only the buckets and variants involved. When
+    several barcodes produce the same variant the most recently indexed one
+    wins, and the next owner takes over if it is removed.
+
+    With ``self_check`` on (or RIGS_BARCODE_CACHE_SELF_CHECK set) every
+    mutation is followed by check(), which logs any inconsistency.
+    """
+
+    def __init__(self, rows, self_check=None):
+        self.main = defaultdict(lambda: {"items": []})
+        self.variant: Dict[str, str] = {}
+        self._variant_owners: Dict[str, list] = {}
+        self._variants_of: Dict[str, set] = {}
+        self._canon_of_item: Dict[object, str] = {}
+        if self_check is None:
+            self_check = bool(os.environ.get("RIGS_BARCODE_CACHE_SELF_CHECK"))
+        self.self_check = self_check
+
+        for row in rows:
+            canon = str(row[0]).strip()
+            self.main[canon]["items"].append(row)
+            self._canon_of_item[self._item_key(row)] = canon
+
+        for canon in list(self.main):
+            self._reindex(canon)
+
+    _gen_variants = staticmethod(_gen_variants)
+
+    def _item_key(self, item):
+        return row_key(_as_row(item))
+
+    def _wanted_variants(self, canon):
+        data = self.main.get(canon)
+        if not data or not data["items"]:
+            return set()
+        wanted = set(self._gen_variants(canon))
+        for item in data["items"]:
+            ean_value = _item_ean(item)
+            if ean_value:
+                wanted.add(str(ean_value).strip())
+        return wanted
+
+    def _claim(self, variant, canon):
+        self._variant_owners.setdefault(variant, []).append(canon)
+        self.variant[variant] = canon
+
+    def _release(self, variant, canon):
+        owners = self._variant_owners.get(variant)
+        if not owners or canon not in owners:
+            return
+        owners.remove(canon)
+        if owners:
+            self.variant[variant] = owners[-1]
+        else:
+            del self._variant_owners[variant]
+            self.variant.pop(variant, None)
+
+    def _reindex(self, canon):
+        wanted = self._wanted_variants(canon)
+        current = self._variants_of.get(canon, set())
+        for v in current - wanted:
+            self._release(v, canon)
+        for v in wanted - current:
+            self._claim(v, canon)
+        if wanted:
+            self._variants_of[canon] = wanted
+            data = self.main[canon]
+            data["is_dupe"] = len(data["items"]) > 1
+        else:
+            self._variants_of.pop(canon, None)
+            self.main.pop(canon, None)
+
+    def remove(self, item_key):
+        canon = self._canon_of_item.pop(item_key, None)
+        if canon is None or canon not in self.main:
+            return False
+        data = self.main[canon]
+        data["items"] = [item for item in data["items"] if self._item_key(item) != item_key]
+        self._reindex(canon)
+        if self.self_check:
+            self.check()
+        return True
+
+    def upsert(self, item):
+        key = self._item_key(item)
+        canon = str(_as_row(item)[0]).strip()
+        if self._canon_of_item.get(key) == canon and canon in self.main:
+            # same barcode: swap the row in place so re-saving an item does
+            # not change which barcode wins a colliding variant
+            items = self.main[canon]["items"]
+            for i, existing in enumerate(items):
+                if self._item_key(existing) == key:
+                    items[i] = item
+                    break
+            self._reindex(canon)
+            if self.self_check:
+                self.check()
+            return
+        self.remove(key)
+        self.main[canon]["items"].append(item)
+        self._canon_of_item[key] = canon
+        self._reindex(canon)
+        if self.self_check:
+            self.check()
+
+    def check(self):
+        """Compare the incremental indexes against the buckets; returns a list of problems."""
+        problems = []
+        seen_items = {}
+        for canon, data in self.main.items():
+            if not data["items"]:
+                problems.append(f"empty bucket {canon}")
+            if data.get("is_dupe") != (len(data["items"]) > 1):
+                problems.append(f"stale is_dupe on {canon}")
+            for item in data["items"]:
+                seen_items[self._item_key(item)] = canon
+            if self._variants_of.get(canon) != self._wanted_variants(canon):
+                problems.append(f"variant set out of date for {canon}")
+        if seen_items != self._canon_of_item:
+            problems.append("item index does not match buckets")
+        for canon in self._variants_of:
+            if canon not in self.main:
+                problems.append(f"variants left behind by {canon}")
+        for v, canon in self.variant.items():
+            owners = self._variant_owners.get(v)
+            if not owners or owners[-1] != canon or v not in self._variants_of.get(canon, ()):
+                problems.append(f"variant {v} -> {canon} has no matching owner")
+        if len(self.variant) != len(self._variant_owners):
+            problems.append("variant owners out of step with variant map")
+        for problem in problems:
+            logger.error(f"[BarcodeCache] self-check: {problem}")
+        return problems
+
+
+# Digit strings up to 17 characters pack into one unsigned 64-bit key: the
+# length sits above bit 59 so "0123" and "123" stay distinct.
+_MAX_PACKED_DIGITS = 17
+
+
+def _packed_key(code):
+    if code.isascii() and code.isdigit() and len(code) <= _MAX_PACKED_DIGITS:
+        return (len(code) << 59) | int(code)
+    return None
+
+
+class _SortedKeys:
+    """Parallel sorted ``array`` columns mapping packed keys to bucket numbers.
+
+    Equal keys may repeat; entries for a key are kept in claim order and the
+    last one wins, mirroring the owner lists of the dict backend.
+    """
+
+    def __init__(self, pairs=()):
+        pairs = sorted(pairs, key=lambda pair: pair[0])  # stable: keeps claim order
+        self.keys = array("Q", (key for key, _ in pairs))
+        self.values = array("l", (value for _, value in pairs))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def get(self, key):
+        i = bisect.bisect_right(self.keys, key)
+        if i and self.keys[i - 1] == key:
+            return self.values[i - 1]
+        return None
+
+    def add(self, key, value):
+        i = bisect.bisect_right(self.keys, key)
+        self.keys.insert(i, key)
+        self.values.insert(i, value)
+
+    def discard(self, key, value):
+        lo = bisect.bisect_left(self.keys, key)
+        hi = bisect.bisect_right(self.keys, key, lo)
+        for i in range(hi - 1, lo - 1, -1):
+            if self.values[i] == value:
+                del self.keys[i]
+                del self.values[i]
+                return True
+        return False
+
+    def distinct(self):
+        keys = self.keys
+        return sum(1 for i in range(len(keys)) if i == 0 or keys[i] != keys[i - 1])
+
+    def has(self, key, value):
+        lo = bisect.bisect_left(self.keys, key)
+        hi = bisect.bisect_right(self.keys, key, lo)
+        return value in self.values[lo:hi]
+
+
+class _VariantView:
+    def __init__(self, cache):
+        self._cache = cache
+
+    def get(self, code, default=None):
+        bucket = self._cache._variant_bucket(code)
+        return default if bucket is None else self._cache._bucket_canon[bucket]
+
+    def __getitem__(self, code):
+        canon = self.get(code)
+        if canon is None:
+            raise KeyError(code)
+        return canon
+
+    def __contains__(self, code):
+        return self._cache._variant_bucket(code) is not None
+
+    def __len__(self):
+        return self._cache._variants.distinct() + len(self._cache._other_variants)
+
+
+class _MainView:
+    def __init__(self, cache):
+        self._cache = cache
+
+    def get(self, canon, default=None):
+        bucket = self._cache._canon_bucket(canon)
+        if bucket is None:
+            return default
+        items = self._cache._bucket_rows(bucket)
+        return {"items": items, "is_dupe": len(items) > 1}
+
+    def __getitem__(self, canon):
+        data = self.get(canon)
+        if data is None:
+            raise KeyError(canon)
+        return data
+
+    def __contains__(self, canon):
+        return self._cache._canon_bucket(canon) is not None
+
+    def __len__(self):
+        return len(self._cache._bucket_canon) - len(self._cache._free_buckets)
+
+    def keys(self):
+        return [canon for canon in self._cache._bucket_canon if canon is not None]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def items(self):
+        return [(canon, self[canon]) for canon in self.keys()]
+
+
+class CompactBarcodeCache:
+    """Drop-in BarcodeCache with variants held in sorted ``array`` columns.
+
+    Most barcodes are plain digits, so variant and canonical lookups go
+    through packed 64-bit keys and a binary search instead of per-variant
+    dict entries and strings; anything else falls back to small dicts.
+    Buckets store indexes into one shared list of item rows rather than
+    copies. ``main`` and ``variant`` are read-only views with the lookups
+    the scanner uses. Edits are O(log n) searches plus an array memmove.
+    """
+
+    def __init__(self, rows, self_check=None):
+        self._rows = []
+        self._free_rows = []
+        self._row_of_item: Dict[object, int] = {}
+        self._bucket_canon = []
+        self._bucket_items = []
+        self._free_buckets = []
+        self._canons = _SortedKeys()
+        self._other_canons: Dict[str, int] = {}
+        self._other_variants: Dict[str, list] = {}
+        if self_check is None:
+            self_check = bool(os.environ.get("RIGS_BARCODE_CACHE_SELF_CHECK"))
+        self.self_check = self_check
+
+        buckets = {}
+        for row in rows:
+            canon = str(_as_row(row)[0]).strip()
+            bucket = buckets.get(canon)
+            if bucket is None:
+                bucket = buckets[canon] = self._new_bucket(canon)
+            self._bucket_items[bucket].append(self._store_row(row))
+        canon_pairs = []
+        for canon, bucket in buckets.items():
+            key = _packed_key(canon)
+            if key is None:
+                self._other_canons[canon] = bucket
+            else:
+                canon_pairs.append((key, bucket))
+        self._canons = _SortedKeys(canon_pairs)
+        del buckets
+
+        variant_pairs = []
+        for bucket in range(len(self._bucket_canon)):
+            for v in self._wanted_variants(bucket):
+                key = _packed_key(v)
+                if key is None:
+                    self._other_variants.setdefault(v, []).append(bucket)
+                else:
+                    variant_pairs.append((key, bucket))
+        self._variants = _SortedKeys(variant_pairs)
+
+        self.main = _MainView(self)
+        self.variant = _VariantView(self)
+
+    _gen_variants = staticmethod(_gen_variants)
+
+    def _store_row(self, item):
+        if self._free_rows:
+            index = self._free_rows.pop()
+            self._rows[index] = item
+        else:
+            index = len(self._rows)
+            self._rows.append(item)
+        self._row_of_item[row_key(_as_row(item))] = index
+        return index
+
+    def _new_bucket(self, canon):
+        if self._free_buckets:
+            bucket = self._free_buckets.pop()
+            self._bucket_canon[bucket] = canon
+            self._bucket_items[bucket] = []
+        else:
+            bucket = len(self._bucket_canon)
+            self._bucket_canon.append(canon)
+            self._bucket_items.append([])
+        return bucket
+
+    def _canon_bucket(self, canon):
+        key = _packed_key(canon)
+        if key is None:
+            return self._other_canons.get(canon)
+        return self._canons.get(key)
+
+    def _variant_bucket(self, code):
+        key = _packed_key(code)
+        if key is None:
+            owners = self._other_variants.get(code)
+            return owners[-1] if owners else None
+        return self._variants.get(key)
+
+    def _bucket_rows(self, bucket):
+        return [self._rows[index] for index in self._bucket_items[bucket]]
+
+    def _wanted_variants(self, bucket):
+        items = self._bucket_items[bucket]
+        if not items:
+            return []
+        canon = self._bucket_canon[bucket]
+        wanted = list(dict.fromkeys(_gen_variants(canon)))
+        for index in items:
+            ean_value = _item_ean(self._rows[index])
+            if ean_value:
+                ean_value = str(ean_value).strip()
+                if ean_value not in wanted:
+                    wanted.append(ean_value)
+        return wanted
+
+    def _claim(self, variant, bucket):
+        key = _packed_key(variant)
+        if key is None:
+            self._other_variants.setdefault(variant, []).append(bucket)
+        else:
+            self._variants.add(key, bucket)
+
+    def _release(self, variant, bucket):
+        key = _packed_key(variant)
+        if key is None:
+            owners = self._other_variants.get(variant)
+            if owners and bucket in owners:
+                owners.remove(bucket)
+                if not owners:
+                    del self._other_variants[variant]
+        else:
+            self._variants.discard(key, bucket)
+
+    def _sync_variants(self, bucket, before):
+        after = self._wanted_variants(bucket)
+        for v in before:
+            if v not in after:
+                self._release(v, bucket)
+        for v in after:
+            if v not in before:
+                self._claim(v, bucket)
+
+    def remove(self, item_key):
+        index = self._row_of_item.pop(item_key, None)
+        if index is None:
+            return False
+        canon = str(_as_row(self._rows[index])[0]).strip()
+        bucket = self._canon_bucket(canon)
+        before = self._wanted_variants(bucket)
+        self._bucket_items[bucket].remove(index)
+        self._rows[index] = None
+        self._free_rows.append(index)
+        self._sync_variants(bucket, before)
+        if not self._bucket_items[bucket]:
+            key = _packed_key(canon)
+            if key is None:
+                del self._other_canons[canon]
+            else:
+                self._canons.discard(key, bucket)
+            self._bucket_canon[bucket] = None
+            self._free_buckets.append(bucket)
+        if self.self_check:
+            self.check()
+        return True
+
+    def upsert(self, item):
+        key = row_key(_as_row(item))
+        canon = str(_as_row(item)[0]).strip()
+        index = self._row_of_item.get(key)
+        if index is not None and str(_as_row(self._rows[index])[0]).strip() == canon:
+            # same barcode: swap the row in place, only an EAN change moves keys
+            bucket = self._canon_bucket(canon)
+            before = self._wanted_variants(bucket)
+            self._rows[index] = item
+            self._sync_variants(bucket, before)
+            if self.self_check:
+                self.check()
+            return
+        self.remove(key)
+        bucket = self._canon_bucket(canon)
+        if bucket is None:
+            bucket = self._new_bucket(canon)
+            key = _packed_key(canon)
+            if key is None:
+                self._other_canons[canon] = bucket
+            else:
+                self._canons.add(key, bucket)
+        before = self._wanted_variants(bucket)
+        self._bucket_items[bucket].append(self._store_row(item))
+        self._sync_variants(bucket, before)
+        if self.self_check:
+            self.check()
+
+    def check(self):
+        """Compare the key columns against the buckets; returns a list of problems."""
+        problems = []
+        expected_variants = 0
+        for bucket, canon in enumerate(self._bucket_canon):
+            if canon is None:
+                continue
+            if not self._bucket_items[bucket]:
+                problems.append(f"empty bucket {canon}")
+            if self._canon_bucket(canon) != bucket:
+                problems.append(f"canonical key for {canon} points elsewhere")
+            for index in self._bucket_items[bucket]:
+                row = self._rows[index]
+                if row is None or self._row_of_item.get(row_key(_as_row(row))) != index:
+                    problems.append(f"row {index} in {canon} is not indexed")
+            for v in self._wanted_variants(bucket):
+                expected_variants += 1
+                key = _packed_key(v)
+                if key is None:
+                    owned = bucket in self._other_variants.get(v, ())
+                else:
+                    owned = self._variants.has(key, bucket)
+                if not owned:
+                    problems.append(f"variant {v} missing for {canon}")
+        actual = len(self._variants) + sum(len(o) for o in self._other_variants.values())
+        if actual != expected_variants:
+            problems.append(f"{actual} variant entries, expected {expected_variants}")
+        if list(self._variants.keys) != sorted(self._variants.keys):
+            problems.append("variant keys out of order")
+        for problem in problems:
+            logger.error(f"[CompactBarcodeCache] self-check: {problem}")
+        return problems
+
+
+def make_barcode_cache(rows):
+    """Build the backend named by RIGS_BARCODE_CACHE_BACKEND ("dict" or "compact").
+
+    "compact" trades scan-path speed for memory. On 50,000 items
+    (``python barcode_cache.py``) it holds about 13 MiB against 71 MiB, some
+    5.5x less, but a scan lookup is 3 to 5x slower (about 3 us against
+    0.7 us) and an inventory edit 23 to 27x slower (about 320 us against
+    12 us). Keep the default unless the terminal is short of memory.
+    """
+    if os.environ.get("RIGS_BARCODE_CACHE_BACKEND", "dict").strip().lower() == "compact":
+        return CompactBarcodeCache(rows)
+    return BarcodeCache(rows)
+
+
+def _benchmark(count=50000, lookups=200000, seed=7):
+    import gc
+    import random
+    import time
+    import tracemalloc
+
+    rng = random.Random(seed)
+    rows = []
+    for i in range(count):
+        barcode = str(rng.randrange(10**11, 10**12))
+        ean = str(rng.randrange(10**12, 10**13)) if rng.random() < 0.1 else None
+        rows.append(
+            (barcode, f"item {i}", 9.99, 4.5, None, None, f"id-{i}", None, 1, 0, 0, None, ean)
+        )
+    probes = []
+    for _ in range(lookups):
+        code = rng.choice(rows)[0]
+        probes.append(rng.choice(list(_gen_variants(code))))
+
+    print(f"{count} items, {lookups} scans")
+    for backend in (BarcodeCache, CompactBarcodeCache):
+        gc.collect()
+        tracemalloc.start()
+        cache = backend(rows, self_check=False)
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del cache
+
+        gc.collect()
+        start = time.perf_counter()
+        cache = backend(rows, self_check=False)
+        build = time.perf_counter() - start
+
+        variant = cache.variant
+        start = time.perf_counter()
+        for code in probes:
+            variant.get(code)
+        scan = time.perf_counter() - start
+
+        # half re-saves of the same barcode, half barcode changes
+        edits = []
+        for i, row in enumerate(rows[:1000]):
+            if i % 2:
+                row = (str(rng.randrange(10**11, 10**12)),) + row[1:]
+            edits.append(row)
+        start = time.perf_counter()
+        for row in edits:
+            cache.upsert(row)
+        edit = time.perf_counter() - start
+
+        print(
+            f"{backend.__name__:>20}: {size / 2**20:7.1f} MiB  build {build * 1000:7.1f} ms  "
+            f"scan {scan / lookups * 1e6:5.2f} us  edit {edit / 1000 * 1e6:6.2f} us"
+        )
+        del cache
+
+
+if __name__ == "__main__":
+    _benchmark()
@@ -65,7 +65,7 @@ class ButtonHandler:
         self.pin_reset_timer = self.app.pin_reset_timer
 
     def clear_order(self):
-        self.app.order_layout.clear_widgets()
+        self.app.utilities.clear_order_display()
         self.app.order_manager.clear_order()
         self.app.utilities.update_financial_summary()
 
@@ -289,11 +289,15 @@ class ButtonHandler:
         ]
         item_ids = list(dict.fromkeys(item_ids))
 
-        self.app.db_manager.send_order_to_history_database(order_details)
+        if not self.app.db_manager.commit_order(order_details):
+            # nothing was written: keep the order, its saved copy and the
+            # payment popup so the sale can be finished again
+            self.app.popup_manager.show_order_commit_error()
+            return
         self.app.order_manager.clear_order()
         self.app.popup_manager.payment_popup.dismiss()
         self.app.utilities.update_financial_summary()
-        self.app.order_layout.clear_widgets()
+        self.app.utilities.clear_order_display()
         self.app.order_manager.delete_order_from_disk(order_details)
         self.app.popup_manager.show_missing_product_category_popup(item_ids)
 
@@ -0,0 +1,46 @@
+import csv
+import io
+
+
+def iter_cursor(cursor, size=500):
+    """Rows of an executed cursor, fetched ``size`` at a time."""
+    while True:
+        rows = cursor.fetchmany(size)
+        if not rows:
+            return
+        yield from rows
+
+
+def iter_csv_chunks(rows, headers, chunk_rows=500):
+    """CSV text for ``headers`` and then ``rows``, yielded ``chunk_rows`` rows at a time.
+
+    For streaming HTTP responses: memory stays at one chunk however many
+    rows there are.
+    """
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(headers)
+    pending = 0
+    for row in rows:
+        writer.writerow(row)
+        pending += 1
+        if pending >= chunk_rows:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate(0)
+            pending = 0
+    tail = buf.getvalue()
+    if tail:
+        yield tail
+
+
+def write_csv(path, rows, headers):
+    """Write ``headers`` and ``rows`` to ``path`` as they are produced; returns the row count."""
+    count = 0
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(headers)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
@@ -1,9 +1,18 @@
 import sqlite3
+import json
 from datetime import datetime
 import uuid
 import os
 import logging
 
+from db_connection import ConnectionPool
+from db_statements import StatementRegistry, FTS_MIN_TERM_LEN, fts_phrase, has_item_name_index
+from db_migrations import migrate, LATEST_VERSION
+from db_write_behind import WriteBehindQueue
+from item_catalog import ItemCatalog
+from money import from_cents, scale_cents, to_cents
+import db_sales_stats
+
 logger = logging.getLogger("rigs_pos")
 
 
@@ -22,20 +31,27 @@ class DatabaseManager:
 
             self.created_new_database = False
             self.ensure_database_exists()
+            self._pool = ConnectionPool(self.db_path)
+            self.statements = StatementRegistry()
+            self.item_name_fts = False
             self.ensure_tables_exist()
+            self.write_behind = WriteBehindQueue(
+                self._pool, self.statements, self.db_path + ".pending"
+            )
+            self.write_behind.replay_spill()
+            self.write_behind.start()
+            self.catalog = ItemCatalog(self.get_all_items())
             self.app = ref
             self._init = True
 
     def _get_connection(self):
-        return sqlite3.connect(self.db_path)
+        return self._pool.connection()
 
-    def _add_column_if_missing(self, conn, table_name, column_name, column_def):
-        cursor = conn.cursor()
-        cursor.execute(f"PRAGMA table_info({table_name})")
-        columns = [row[1] for row in cursor.fetchall()]
-        if column_name not in columns:
-            cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN {column_def}")
-            conn.commit()
+    def _release_connection(self, conn):
+        self._pool.release(conn)
+
+    def get_statement_stats(self):
+        return self.statements.stats()
 
     def ensure_database_exists(self):
         db_directory = os.path.dirname(self.db_path)
@@ -52,222 +68,20 @@ class DatabaseManager:
             logger.info("[DatabaseManager] Using existing database at %s", self.db_path)
 
     def ensure_tables_exist(self):
-        self.create_items_table()
-        self.create_order_history_table()
-        self.create_order_items_table()
-        self.create_modified_orders_table()
-        # self.create_dist_table()
-        self.create_payment_history_table()
-        self.create_attendance_log_table()
-
-    def create_payment_history_table(self):
-        conn = self._get_connection()
-        try:
-            cursor = conn.cursor()
-            cursor.execute(
-                """CREATE TABLE IF NOT EXISTS payments (
-                                timestamp TEXT,
-                                session_id TEXT,
-                                date TEXT,
-                                name TEXT,
-                                clock_in TEXT,
-                                clock_out TEXT,
-                                hours TEXT,
-                                minutes TEXT,
-                                cash BOOLEAN,
-                                dd BOOLEAN,
-                                notes TEXT
-                            )"""
-            )
-            conn.commit()
-        except sqlite3.Error as e:
-            logger.warn(f"[DatabaseManager]:\n{e}")
-        finally:
-            conn.close()
-
-    def create_attendance_log_table(self):
-        conn = self._get_connection()
-        try:
-            cursor = conn.cursor()
-            cursor.execute(
-                """CREATE TABLE IF NOT EXISTS attendance_log (
-                    session_id TEXT PRIMARY KEY,
-                    name TEXT,
-                    clock_in TIME,
-                    clock_out TIME
-                )"""
-            )
-            conn.commit()
-        except sqlite3.Error as e:
-            logger.warn(f"Error creating attendance log table: {e}")
-        finally:
-            conn.close()
-
-    def create_items_table(self):
         conn = self._get_connection()
         try:
-            cursor = conn.cursor()
-            cursor.execute(
-                """CREATE TABLE IF NOT EXISTS items (
-                                barcode TEXT,
-                                name TEXT,
-                                price REAL,
-                                cost REAL,
-                                sku TEXT,
-                                product_category TEXT,
-                                parent_barcode TEXT,
-                                item_id TEXT,
-                                taxable BOOLEAN DEFAULT TRUE,
-                                is_rolling_papers BOOLEAN NOT NULL DEFAULT FALSE,
-                                is_cigarette BOOLEAN NOT NULL DEFAULT FALSE,
-                                papers_per_pack INTEGER,
-                                ean_barcode TEXT,
-                                PRIMARY KEY (barcode, sku),
-                                FOREIGN KEY(parent_barcode) REFERENCES items(barcode)
-                            )"""
-            )
-            self._add_column_if_missing(
-                conn,
-                "items",
-                "is_cigarette",
-                "is_cigarette BOOLEAN NOT NULL DEFAULT FALSE",
-            )
-            self._add_column_if_missing(
-                conn,
-                "items",
-                "papers_per_pack",
-                "papers_per_pack INTEGER",
-            )
-            self._add_column_if_missing(
-                conn,
-                "items",
-                "product_category",
-                "product_category TEXT",
-            )
-            self._add_column_if_missing(
-                conn,
-                "items",
-                "ean_barcode",
-                "ean_barcode TEXT",
-            )
-            cursor.execute(
-                "CREATE INDEX IF NOT EXISTS idx_items_ean_barcode ON items(ean_barcode)"
-            )
-            conn.commit()
-        except sqlite3.Error as e:
-            logger.warn(f"[DatabaseManager]:\n{e}")
-        finally:
-            conn.close()
-
-    def create_order_history_table(self):
-        conn = self._get_connection()
-        try:
-            cursor = conn.cursor()
-            cursor.execute(
-                """CREATE TABLE IF NOT EXISTS order_history (
-                                order_id TEXT PRIMARY KEY,
-                                items TEXT,
-                                total REAL,
-                                tax REAL,
-                                discount REAL,
-                                total_with_tax REAL,
-                                payment_method TEXT,
-                                amount_tendered REAL,
-                                change_given REAL,
-                                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                            )"""
-            )
-            conn.commit()
-        except sqlite3.Error as e:
-            logger.warn(f"[DatabaseManager]:\n{e}")
-        finally:
-            conn.close()
-
-    def create_order_items_table(self):
-        conn = self._get_connection()
-        try:
-            cursor = conn.cursor()
-            cursor.execute(
-                """
-                CREATE TABLE IF NOT EXISTS order_items (
-                    id               INTEGER PRIMARY KEY AUTOINCREMENT,
-                    order_id         TEXT NOT NULL,
-                    item_id          TEXT,
-                    barcode          TEXT,
-                    name             TEXT NOT NULL,
-                    qty              REAL NOT NULL,
-                    unit_price       REAL NOT NULL,
-                    line_subtotal    REAL NOT NULL,
-                    unit_cost        REAL,
-                    line_cost        REAL,
-                    taxable          INTEGER,
-                    is_rolling_papers INTEGER,
-                    is_cigarette INTEGER,
-                    papers_per_pack  INTEGER,
-                    order_timestamp  TEXT,
-                    is_custom        INTEGER NOT NULL DEFAULT 0,
-                FOREIGN KEY(order_id) REFERENCES order_history(order_id)
+            applied = migrate(conn)
+            self.item_name_fts = has_item_name_index(conn)
+            if applied:
+                logger.info(
+                    "[DatabaseManager] Applied %d schema migrations, now at version %d",
+                    applied,
+                    LATEST_VERSION,
                 )
-                """
-            )
-            self._add_column_if_missing(
-                conn,
-                "order_items",
-                "is_cigarette",
-                "is_cigarette INTEGER",
-            )
-            self._add_column_if_missing(
-                conn,
-                "order_items",
-                "papers_per_pack",
-                "papers_per_pack INTEGER",
-            )
-            cursor.execute(
-                "CREATE INDEX IF NOT EXISTS idx_order_items_order_id ON order_items(order_id)"
-            )
-            cursor.execute(
-                "CREATE INDEX IF NOT EXISTS idx_order_items_name ON order_items(name)"
-            )
-            cursor.execute(
-                "CREATE INDEX IF NOT EXISTS idx_order_items_timestamp ON order_items(order_timestamp)"
-            )
-            cursor.execute(
-                "CREATE INDEX IF NOT EXISTS idx_order_items_is_custom ON order_items(is_custom)"
-            )
-            cursor.execute(
-                "CREATE INDEX IF NOT EXISTS idx_order_items_is_cigarette ON order_items(is_cigarette)"
-            )
-            conn.commit()
         except sqlite3.Error as e:
-            logger.warn(f"[DatabaseManager]:\n{e}")
+            logger.error(f"[DatabaseManager] schema migration failed:\n{e}")
         finally:
-            conn.close()
-
-    def create_modified_orders_table(self):
-        conn = self._get_connection()
-        try:
-            cursor = conn.cursor()
-            cursor.execute(
-                """CREATE TABLE IF NOT EXISTS modified_orders (
-                                order_id TEXT,
-                                items TEXT,
-                                total REAL,
-                                tax REAL,
-                                discount REAL,
-                                total_with_tax REAL,
-                                payment_method TEXT,
-                                amount_tendered REAL,
-                                change_given REAL,
-                                modification_type TEXT, -- 'deleted' or 'modified'
-                                timestamp TEXT
-                            )"""
-            )
-            conn.commit()
-        except sqlite3.Error as e:
-            logger.warn(f"[DatabaseManager]:\n{e}")
-        finally:
-            conn.close()
-
+            self._release_connection(conn)
 
     def add_item(
         self,
@@ -331,27 +145,12 @@ class DatabaseManager:
                 ),
             )
             conn.commit()
-            item_details = {
-                "barcode": barcode,
-                "name": name,
-                "price": price,
-                "cost": cost,
-                "sku": sku,
-                "product_category": product_category_value,
-                "item_id": str(item_id),
-                "parent_barcode": parent_barcode,
-                "taxable": taxable,
-                "is_rolling_papers": is_rolling_papers,
-                "is_cigarette": is_cigarette,
-                "papers_per_pack": papers_per_pack_value,
-                "ean_barcode": ean_value,
-            }
-            self.app.utilities.update_barcode_cache(item_details)
+            self._refresh_catalog_item(cursor, str(item_id))
         except sqlite3.IntegrityError as e:
             logger.warn(f"[DatabaseManager]:\n{e}")
-            conn.close()
+            self._release_connection(conn)
             return False
-        conn.close()
+        self._release_connection(conn)
         return True
 
     def update_item(
@@ -412,42 +211,29 @@ class DatabaseManager:
 
                 return False
             conn.commit()
-            item_details = {
-                "barcode": barcode,
-                "item_id": item_id,
-                "name": name,
-                "price": price,
-                "cost": cost,
-                "sku": sku,
-                "product_category": product_category_value,
-                "taxable": bool(taxable),
-                "is_rolling_papers": bool(is_rolling_papers),
-                "is_cigarette": bool(is_cigarette),
-                "papers_per_pack": papers_per_pack_value,
-                "ean_barcode": ean_value,
-            }
-            self.app.utilities.update_barcode_cache(item_details)
+            self._refresh_catalog_item(cursor, item_id)
         except Exception as e:
             logger.warn(f"[DatabaseManager]:\n{e}")
             return False
         finally:
-            conn.close()
+            self._release_connection(conn)
         return True
 
+    def _refresh_catalog_item(self, cursor, item_id):
+        # re-read rather than reuse the caller's arguments so the catalog holds
+        # exactly what SQLite stored (type affinity turns "4.99" into 4.99)
+        row = self.statements.fetchone(cursor, "item_row_by_item_id", (str(item_id),))
+        if row is not None:
+            self.catalog.upsert(row)
+
     def handle_duplicate_barcodes(self, barcode):
 
-        query = """
-                SELECT barcode, name, price, cost, sku, product_category, item_id, parent_barcode, taxable, is_rolling_papers, is_cigarette, papers_per_pack, ean_barcode
-                FROM items
-                WHERE barcode = ?
-               """
         items = []
 
         conn = self._get_connection()
         try:
             cursor = conn.cursor()
-            cursor.execute(query, (barcode,))
-            rows = cursor.fetchall()
+            rows = self.statements.fetchall(cursor, "items_by_barcode", (barcode,))
 
             for row in rows:
                 item_details = {
@@ -470,7 +256,7 @@ class DatabaseManager:
         except sqlite3.Error as e:
             logger.warn(f"Database error: {e}")
         finally:
-            conn.close()
+            self._release_connection(conn)
 
         return items
 
@@ -481,37 +267,16 @@ class DatabaseManager:
             conn = self._get_connection()
             cursor = conn.cursor()
 
-            sql = """
-                SELECT
-                    name,
-                    price,
-                    barcode,
-                    cost,
-                    sku,
-                    product_category,
-                    item_id,
-                    parent_barcode,
-                    taxable,
-                    is_rolling_papers,
-                    is_cigarette,
-                    papers_per_pack,
-                    ean_barcode
-                FROM items
-                WHERE {where_clause}
-                LIMIT 1
-            """
-
             row = None
             if item_id and str(item_id).strip():
-                cursor.execute(sql.format(where_clause="item_id = ?"), (str(item_id).strip(),))
-                row = cursor.fetchone()
+                row = self.statements.fetchone(
+                    cursor, "item_by_item_id", (str(item_id).strip(),)
+                )
             elif barcode and str(barcode).strip():
                 barcode_value = str(barcode).strip()
-                cursor.execute(sql.format(where_clause="barcode = ?"), (barcode_value,))
-                row = cursor.fetchone()
+                row = self.statements.fetchone(cursor, "item_by_barcode", (barcode_value,))
                 if not row and len(barcode_value) == 13:
-                    cursor.execute(sql.format(where_clause="ean_barcode = ?"), (barcode_value,))
-                    row = cursor.fetchone()
+                    row = self.statements.fetchone(cursor, "item_by_ean", (barcode_value,))
             else:
                 return None
             if not row:
@@ -538,7 +303,7 @@ class DatabaseManager:
             return None
         finally:
             if conn:
-                conn.close()
+                self._release_connection(conn)
 
     def delete_item_no_item_id(self, name):
         conn = self._get_connection()
@@ -552,12 +317,13 @@ class DatabaseManager:
                 return False
 
             conn.commit()
+            self.catalog.remove_by_name(name)
             return True
         except sqlite3.Error as e:
             logger.warn(f"[DatabaseManager]:\n{e}")
             return False
         finally:
-            conn.close()
+            self._release_connection(conn)
 
 
 
@@ -573,88 +339,35 @@ class DatabaseManager:
                 return False
 
             conn.commit()
+            self.catalog.remove(item_id)
             return True
         except sqlite3.Error as e:
             logger.warn(f"[DatabaseManager]:\n{e}")
             return False
         finally:
-            conn.close()
+            self._release_connection(conn)
 
-    def add_order_history(
-        self,
-        order_id,
-        total,
-        tax,
-        discount,
-        total_with_tax,
-        timestamp,
-        payment_method,
-        amount_tendered,
-        change_given,
-    ):
-        conn = self._get_connection()
-
-        try:
-            cursor = conn.cursor()
-
-            cursor.execute(
-                "INSERT INTO order_history (order_id, items, total, tax, discount, total_with_tax, timestamp, payment_method, amount_tendered, change_given) VALUES (?, NULL, ?, ?, ?, ?, ?, ?, ?, ?)",
-                (
-                    order_id,
-                    total,
-                    tax,
-                    discount,
-                    total_with_tax,
-                    timestamp,
-                    payment_method,
-                    amount_tendered,
-                    change_given,
-                ),
-            )
-            conn.commit()
-        except sqlite3.Error as e:
-            logger.warn(f"[DatabaseManager]:add_order_history\n{e}")
-            return False
-        finally:
-            conn.close()
-        return True
+    def _save_current_order_state(self, cursor, order_id, modification_type):
+        self.statements.execute(
+            cursor, "modified_order_snapshot", (modification_type, order_id)
+        )
 
-    def _save_current_order_state(self, order_id, modification_type):
+    def delete_order(self, order_id):
         conn = self._get_connection()
         try:
             cursor = conn.cursor()
-            cursor.execute(
-                "INSERT INTO modified_orders (order_id, items, total, tax, discount, total_with_tax, timestamp, payment_method, amount_tendered, change_given, modification_type, timestamp) "
-                "SELECT order_id, items, total, tax, discount, total_with_tax, timestamp, payment_method, amount_tendered, change_given, ?, CURRENT_TIMESTAMP "
-                "FROM order_history WHERE order_id = ?",
-                (modification_type, order_id),
-            )
+            self._save_current_order_state(cursor, order_id, "deleted")
+            self._unrecord_sales(cursor, order_id)
+            self.statements.execute(cursor, "order_history_delete", (order_id,))
             conn.commit()
         except sqlite3.Error as e:
+            conn.rollback()
             logger.warn(f"[DatabaseManager]:\n{e}")
             return False
         finally:
-            conn.close()
+            self._release_connection(conn)
         return True
 
-    def delete_order(self, order_id):
-        if self._save_current_order_state(order_id, "deleted"):
-            conn = self._get_connection()
-            try:
-                cursor = conn.cursor()
-                cursor.execute(
-                    "DELETE FROM order_history WHERE order_id = ?", (order_id,)
-                )
-                conn.commit()
-            except sqlite3.Error as e:
-                logger.warn(f"[DatabaseManager]:\n{e}")
-                return False
-            finally:
-                conn.close()
-            return True
-        else:
-            return False
-
     def _normalize_items_object_to_list(self, items_obj):
         if isinstance(items_obj, list):
             return items_obj
@@ -674,132 +387,124 @@ class DatabaseManager:
             f"Expected list or dict for items object, got {type(items_obj)}"
         )
 
-    def _insert_order_items_from_list(self, order_id, items_list, order_timestamp):
-        conn = self._get_connection()
-        try:
-            cursor = conn.cursor()
-            insert_sql = """
-                INSERT INTO order_items (
-                    order_id,
-                    item_id,
-                    barcode,
-                    name,
-                    qty,
-                    unit_price,
-                    line_subtotal,
-                    unit_cost,
-                    line_cost,
-                    taxable,
-                    is_rolling_papers,
-                    is_cigarette,
-                    papers_per_pack,
-                    order_timestamp
+    def _build_order_item_rows(self, order_id, items_list, order_timestamp):
+        rows = []
+        for item in items_list:
+            if not isinstance(item, dict):
+                raise TypeError(
+                    f"Expected dict item when inserting order_items, got {type(item)}"
                 )
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """
-            for item in items_list:
-                if not isinstance(item, dict):
-                    raise TypeError(
-                        f"Expected dict item when inserting order_items, got {type(item)}"
-                    )
 
-                name = item.get("name")
-                if not name:
-                    raise ValueError(
-                        f"Missing name in item when inserting order_items: {item}"
-                    )
+            name = item.get("name")
+            if not name:
+                raise ValueError(
+                    f"Missing name in item when inserting order_items: {item}"
+                )
 
-                if "quantity" in item:
-                    qty = float(item["quantity"])
-                elif "qty" in item:
-                    qty = float(item["qty"])
-                else:
-                    raise KeyError(
-                        f"Missing quantity/qty in item when inserting order_items: {item}"
-                    )
+            if "quantity" in item:
+                qty = float(item["quantity"])
+            elif "qty" in item:
+                qty = float(item["qty"])
+            else:
+                raise KeyError(
+                    f"Missing quantity/qty in item when inserting order_items: {item}"
+                )
 
-                if "price" in item:
-                    unit_price = float(item["price"])
-                elif "unit_price" in item:
-                    unit_price = float(item["unit_price"])
-                else:
-                    raise KeyError(
-                        f"Missing price/unit_price in item when inserting order_items: {item}"
-                    )
+            if "price" in item:
+                unit_price = float(item["price"])
+            elif "unit_price" in item:
+                unit_price = float(item["unit_price"])
+            else:
+                raise KeyError(
+                    f"Missing price/unit_price in item when inserting order_items: {item}"
+                )
 
-                line_subtotal = qty * unit_price
+            line_subtotal = from_cents(scale_cents(to_cents(unit_price), qty))
 
-                unit_cost = item.get("cost", item.get("unit_cost"))
-                line_cost = None
-                if unit_cost is not None:
-                    unit_cost = float(unit_cost)
-                    line_cost = qty * unit_cost
+            unit_cost = item.get("cost", item.get("unit_cost"))
+            line_cost = None
+            if unit_cost is not None:
+                unit_cost = float(unit_cost)
+                line_cost = qty * unit_cost
 
-                taxable = item.get("taxable")
-                if taxable is not None:
-                    taxable = int(bool(taxable))
+            taxable = item.get("taxable")
+            if taxable is not None:
+                taxable = int(bool(taxable))
 
-                is_rolling = item.get("is_rolling_papers")
-                if is_rolling is not None:
-                    is_rolling = int(bool(is_rolling))
+            is_rolling = item.get("is_rolling_papers")
+            if is_rolling is not None:
+                is_rolling = int(bool(is_rolling))
 
-                is_cigarette = item.get("is_cigarette")
-                if is_cigarette is not None:
-                    is_cigarette = int(bool(is_cigarette))
+            is_cigarette = item.get("is_cigarette")
+            if is_cigarette is not None:
+                is_cigarette = int(bool(is_cigarette))
 
-                papers_per_pack = item.get("papers_per_pack")
+            papers_per_pack = item.get("papers_per_pack")
 
-                cursor.execute(
-                    insert_sql,
-                    (
-                        order_id,
-                        item.get("item_id"),
-                        item.get("barcode"),
-                        name,
-                        qty,
-                        unit_price,
-                        line_subtotal,
-                        unit_cost,
-                        line_cost,
-                        taxable,
-                        is_rolling,
-                        is_cigarette,
-                        papers_per_pack,
-                        order_timestamp,
-                    ),
+            rows.append(
+                (
+                    order_id,
+                    item.get("item_id"),
+                    item.get("barcode"),
+                    name,
+                    qty,
+                    unit_price,
+                    line_subtotal,
+                    unit_cost,
+                    line_cost,
+                    taxable,
+                    is_rolling,
+                    is_cigarette,
+                    papers_per_pack,
+                    order_timestamp,
                 )
+            )
+        return rows
 
-            conn.commit()
-        finally:
-            conn.close()
+    def _insert_order_items(self, cursor, rows):
+        self.statements.executemany(cursor, "order_item_insert", rows)
+        # (name, item_id, qty, order_timestamp) of each row
+        sales = [(row[3], row[1], row[4], row[13]) for row in rows]
+        self.statements.executemany(
+            cursor, "item_sales_stats_apply", db_sales_stats.sales_deltas(sales)
+        )
 
-    def _rewrite_order_items_for_order(self, order_id, items_obj):
-        conn = self._get_connection()
-        try:
-            cursor = conn.cursor()
-            cursor.execute("DELETE FROM order_items WHERE order_id = ?", (order_id,))
-            conn.commit()
-        finally:
-            conn.close()
+    def _unrecord_sales(self, cursor, order_id):
+        sales = self.statements.fetchall(cursor, "order_item_sales_for_order", (order_id,))
+        if sales:
+            self.statements.executemany(
+                cursor, "item_sales_stats_apply", db_sales_stats.sales_deltas(sales, sign=-1)
+            )
+            self.statements.execute(cursor, "item_sales_stats_prune")
 
+    def _rewrite_order_items_for_order(self, order_id, items_obj):
         items_list = self._normalize_items_object_to_list(items_obj)
 
-        conn2 = self._get_connection()
+        conn = self._get_connection()
         try:
-            cursor2 = conn2.cursor()
-            cursor2.execute(
+            cursor = conn.cursor()
+            cursor.execute(
                 "SELECT timestamp FROM order_history WHERE order_id = ?", (order_id,)
             )
-            row = cursor2.fetchone()
+            row = cursor.fetchone()
             if row is None:
                 raise ValueError(
                     f"Order {order_id} not found in order_history when rewriting order_items"
                 )
             order_timestamp = row[0]
-        finally:
-            conn2.close()
+            rows = self._build_order_item_rows(order_id, items_list, order_timestamp)
 
-        self._insert_order_items_from_list(order_id, items_list, order_timestamp)
+            # the old lines come out of the sales stats before they are deleted,
+            # all in the same transaction as the new lines going in
+            self._unrecord_sales(cursor, order_id)
+            cursor.execute("DELETE FROM order_items WHERE order_id = ?", (order_id,))
+            self._insert_order_items(cursor, rows)
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        finally:
+            self._release_connection(conn)
 
     def update_order_items(self, order_id, items_obj):
         self._rewrite_order_items_for_order(order_id, items_obj)
@@ -810,102 +515,115 @@ class DatabaseManager:
         conn = self._get_connection()
         cursor = conn.cursor()
 
-        query = """
-        SELECT
-            order_id,
-            items,
-            total,
-            tax,
-            discount,
-            total_with_tax,
-            timestamp,
-            payment_method,
-            amount_tendered,
-            change_given
-        FROM
-            order_history
-        WHERE
-            order_id = ?
-        """
+        order = self.statements.fetchone(cursor, "order_by_id", (order_id,))
+
+        self._release_connection(conn)
+
+        return order
+
+    def get_order_by_short_id(self, short_id):
+        """Look up an order by its receipt barcode, in get_order_history_page's row shape."""
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        try:
+            return self.statements.fetchone(
+                cursor, "order_summary_by_short_id", (str(short_id).strip(),)
+            )
+        except sqlite3.Error as e:
+            logger.warn(f"[DatabaseManager] get_order_by_short_id:\n{e}")
+            return None
+        finally:
+            self._release_connection(conn)
+
+    def _timestamp_bound(self, value):
+        if not isinstance(value, datetime):
+            value = datetime.combine(value, datetime.min.time())
+        return value.isoformat(" ")
+
+    def _order_totals(self, row):
+        # the sums come back in integer cents
+        count, total, tax, total_with_tax, tendered, change = row
+        return {
+            "count": count,
+            "total": from_cents(total),
+            "tax": from_cents(tax),
+            "total_with_tax": from_cents(total_with_tax),
+            "amount_tendered": from_cents(tendered),
+            "change_given": from_cents(change),
+            "cash": from_cents(tendered - change),
+        }
+
+    def get_order_totals_between(self, start, end):
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        try:
+            row = self.statements.fetchone(
+                cursor,
+                "order_totals_between",
+                (self._timestamp_bound(start), self._timestamp_bound(end)),
+            )
+            return self._order_totals(row)
+        except sqlite3.Error as e:
+            logger.warn(f"[DatabaseManager] get_order_totals_between:\n{e}")
+            return None
+        finally:
+            self._release_connection(conn)
 
-        cursor.execute(query, (order_id,))
+    def _item_search(self, statement, term):
+        # the full-text statement, or its _scan twin for terms too short to
+        # have trigrams or when this database has no full-text index
+        term = term.lower()
+        if self.item_name_fts and len(term) >= FTS_MIN_TERM_LEN:
+            return statement, fts_phrase(term)
+        return statement + "_scan", term
 
-        order = cursor.fetchone()
+    def get_order_totals_with_item(self, term):
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        try:
+            name, param = self._item_search("order_totals_with_item", term)
+            row = self.statements.fetchone(cursor, name, (param,))
+            return self._order_totals(row)
+        except sqlite3.Error as e:
+            logger.warn(f"[DatabaseManager] get_order_totals_with_item:\n{e}")
+            return None
+        finally:
+            self._release_connection(conn)
 
-        conn.close()
+    def get_order_history_page(self, after=None, limit=100, start=None, end=None, term=None):
+        """One page of orders, newest first, in the order summary row shape.
 
-        return order
+        ``after`` is ``(timestamp, order_id)`` of the last row of the previous
+        page; the next key is ``(row[6], row[0])`` of this page's last row.
+        ``start``/``end`` bound the timestamp (dates or datetimes, end
+        exclusive); ``term`` instead restricts to orders with a matching item.
+        """
+        if after is None:
+            after = (self._timestamp_bound(end) if end is not None else "\uffff", "")
+        if term:
+            name, param = self._item_search("order_history_page_with_item", term)
+            params = (param, after[0], after[1], limit)
+        else:
+            lower = self._timestamp_bound(start) if start is not None else ""
+            name = "order_history_page"
+            params = (lower, after[0], after[1], limit)
 
-    def get_order_history(self):
         conn = self._get_connection()
         cursor = conn.cursor()
-        cursor.execute(
-            """
-            SELECT
-                oh.order_id,
-                COALESCE(item_summary.item_names, '') AS item_names,
-                oh.total,
-                oh.tax,
-                oh.discount,
-                oh.total_with_tax,
-                oh.timestamp,
-                oh.payment_method,
-                oh.amount_tendered,
-                oh.change_given
-            FROM order_history oh
-            LEFT JOIN (
-                SELECT order_id, GROUP_CONCAT(name, ', ') AS item_names
-                FROM order_items
-                GROUP BY order_id
-            ) AS item_summary ON oh.order_id = item_summary.order_id
-            """
-        )
-        order_history = cursor.fetchall()
-        conn.close()
-        return order_history
+        try:
+            return self.statements.fetchall(cursor, name, params)
+        except sqlite3.Error as e:
+            logger.warn(f"[DatabaseManager] get_order_history_page:\n{e}")
+            return []
+        finally:
+            self._release_connection(conn)
 
     def get_order_items(self, order_id):
         conn = self._get_connection()
-        conn.row_factory = sqlite3.Row
         try:
             cursor = conn.cursor()
-            cursor.execute(
-                """
-                SELECT
-                    oi.id,
-                    oi.order_id,
-                    oi.item_id,
-                    oi.barcode,
-                    oi.name,
-                    COALESCE(it.product_category, '') AS product_category,
-                    oi.qty,
-                    oi.unit_price,
-                    oi.line_subtotal,
-                    oi.unit_cost,
-                    oi.line_cost,
-                    oi.taxable,
-                    oi.is_rolling_papers,
-                    oi.is_cigarette,
-                    oi.papers_per_pack,
-                    oi.order_timestamp,
-                    oi.is_custom
-                FROM order_items oi
-                LEFT JOIN items it ON (
-                    (oi.item_id IS NOT NULL AND oi.item_id != '' AND it.item_id = oi.item_id)
-                    OR (
-                        (oi.item_id IS NULL OR oi.item_id = '')
-                        AND oi.barcode IS NOT NULL
-                        AND oi.barcode != ''
-                        AND it.barcode = oi.barcode
-                    )
-                )
-                WHERE oi.order_id = ?
-                ORDER BY oi.id
-                """,
-                (order_id,),
-            )
-
-            rows = cursor.fetchall()
+            cursor.row_factory = sqlite3.Row
+            rows = self.statements.fetchall(cursor, "order_items_for_order", (order_id,))
             return [
                 {
                     "id": row["id"],
@@ -929,7 +647,7 @@ class DatabaseManager:
                 for row in rows
             ]
         finally:
-            conn.close()
+            self._release_connection(conn)
 
 
     def _maybe_bool(self, value):
@@ -939,36 +657,122 @@ class DatabaseManager:
 
 
 
-    def send_order_to_history_database(self, order_details):
-        tax = order_details.total_with_tax - order_details.total
-        timestamp = datetime.now()
+    def commit_order(self, order, timestamp=None):
+        """Write the order_history row and every order_items row atomically.
 
-        items_for_db = [
-            item_details.to_dict()
-            for item_details in order_details.items.values()
-        ]
+        Both inserts share one transaction, and the commit runs with
+        synchronous=FULL so this only returns once the WAL has been synced.
+        """
+        timestamp = timestamp or datetime.now()
+        tax = from_cents(order.total_with_tax_cents - order.total_cents)
+        items_for_db = [item_details.to_dict() for item_details in order.items.values()]
 
-        success = self.add_order_history(
-            order_details.order_id,
-            order_details.total,
-            tax,
-            order_details.total_discount,
-            order_details.total_with_tax,
-            timestamp,
-            order_details.payment_method,
-            order_details.amount_tendered,
-            order_details.change_given,
-        )
+        try:
+            rows = self._build_order_item_rows(order.order_id, items_for_db, timestamp)
+        except (TypeError, ValueError, KeyError) as e:
+            logger.error(f"[DatabaseManager] commit_order bad item for order_id={order.order_id}\n{e}")
+            return False
 
-        if not success:
-            logger.error(
-                f"[DatabaseManager] send_order_to_history_database failed to insert order_history for order_id={order_details['order_id']}"
+        conn = self._get_connection()
+        try:
+            conn.execute("PRAGMA synchronous=FULL")
+            cursor = conn.cursor()
+            self.statements.execute(
+                cursor,
+                "order_history_insert",
+                (
+                    order.order_id,
+                    order.total,
+                    tax,
+                    order.total_discount,
+                    order.total_with_tax,
+                    timestamp,
+                    order.payment_method,
+                    order.amount_tendered,
+                    order.change_given,
+                ),
             )
-            return
+            self._insert_order_items(cursor, rows)
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            logger.error(f"[DatabaseManager] commit_order failed for order_id={order.order_id}\n{e}")
+            return False
+        finally:
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._release_connection(conn)
+        return True
 
-        self._insert_order_items_from_list(
-            order_details.order_id, items_for_db, timestamp
-        )
+    def save_parked_order(self, order_id, payload, item_names, saved_at=None):
+        """Store a parked order, replacing any earlier save of the same order_id.
+
+        One statement in one transaction, committed with synchronous=FULL: a
+        power cut leaves either the previous save or this one, never half.
+        """
+        conn = self._get_connection()
+        try:
+            conn.execute("PRAGMA synchronous=FULL")
+            cursor = conn.cursor()
+            self.statements.execute(
+                cursor,
+                "saved_order_upsert",
+                (
+                    order_id,
+                    json.dumps(item_names),
+                    json.dumps(payload),
+                    saved_at or datetime.now(),
+                ),
+            )
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            logger.error(f"[DatabaseManager] save_parked_order failed for order_id={order_id}\n{e}")
+            return False
+        finally:
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._release_connection(conn)
+        return True
+
+    def get_parked_order(self, order_id):
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        try:
+            row = self.statements.fetchone(cursor, "saved_order_get", (order_id,))
+        except sqlite3.Error as e:
+            logger.warn(f"[DatabaseManager]:\n{e}")
+            row = None
+        finally:
+            self._release_connection(conn)
+        return json.loads(row[0]) if row else None
+
+    def delete_parked_order(self, order_id):
+        conn = self._get_connection()
+        try:
+            cursor = conn.cursor()
+            self.statements.execute(cursor, "saved_order_delete", (order_id,))
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            logger.warn(f"[DatabaseManager]:\n{e}")
+            return False
+        finally:
+            self._release_connection(conn)
+        return True
+
+    def list_parked_orders(self, limit=None):
+        """Parked orders oldest first, as {"order_id", "items"} with the item names."""
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        try:
+            rows = self.statements.fetchall(
+                cursor, "saved_order_list", (-1 if limit is None else limit,)
+            )
+        except sqlite3.Error as e:
+            logger.warn(f"[DatabaseManager]:\n{e}")
+            rows = []
+        finally:
+            self._release_connection(conn)
+        return [{"order_id": order_id, "items": json.loads(names)} for order_id, names in rows]
 
     def add_item_to_database(
         self,
@@ -998,32 +802,30 @@ class DatabaseManager:
                 logger.warn(f"[DatabaseManager] add_item_to_database:\n{e}")
 
     def get_all_items(self):
+        self.write_behind.flush()
         conn = self._get_connection()
         cursor = conn.cursor()
         try:
-            cursor.execute(
-                "SELECT barcode, name, price, cost, sku, product_category, item_id, parent_barcode, taxable, is_rolling_papers, is_cigarette, papers_per_pack, ean_barcode FROM items"
-            )
-            items = cursor.fetchall()
+            items = self.statements.fetchall(cursor, "all_items")
         except sqlite3.Error as e:
             logger.warn(f"[DatabaseManager]:\n{e}")
             items = []
         finally:
-            conn.close()
+            self._release_connection(conn)
 
         return items
 
     def barcode_exists(self, barcode):
         conn = self._get_connection()
         cursor = conn.cursor()
-        cursor.execute("SELECT 1 FROM items WHERE barcode = ?", (barcode,))
-        exists = cursor.fetchone() is not None
-        conn.close()
+        exists = self.statements.fetchone(cursor, "barcode_exists", (barcode,)) is not None
+        self._release_connection(conn)
         return exists
 
     def get_items_missing_product_category(self, item_ids):
         if not item_ids:
             return []
+        self.write_behind.flush()
         conn = self._get_connection()
         try:
             cursor = conn.cursor()
@@ -1052,36 +854,24 @@ class DatabaseManager:
             logger.warn(f"[DatabaseManager]:\n{e}")
             return []
         finally:
-            conn.close()
+            self._release_connection(conn)
 
     def update_item_product_category(self, item_id, product_category):
         if not item_id:
             return False
-        conn = self._get_connection()
-        try:
-            cursor = conn.cursor()
-            product_category_value = (
-                product_category if product_category not in (None, "") else None
-            )
-            cursor.execute(
-                "UPDATE items SET product_category=? WHERE item_id=?",
-                (product_category_value, item_id),
-            )
-            if cursor.rowcount == 0:
-                return False
-            conn.commit()
-            return True
-        except sqlite3.Error as e:
-            logger.warn(f"[DatabaseManager]:\n{e}")
-            return False
-        finally:
-            conn.close()
-
+        product_category_value = (
+            product_category if product_category not in (None, "") else None
+        )
+        self.catalog.update_fields(item_id, product_category=product_category_value)
+        return self.write_behind.enqueue(
+            "item_category_update", (product_category_value, item_id)
+        )
 
     def close_connection(self):
-        conn = self._get_connection()
-        if conn:
-            conn.close()
+        self.write_behind.stop()
+        # after the final flush, so the queued writes are counted too
+        self.statements.log_stats()
+        self._pool.close_all()
 
     def add_session_to_payment_history(
         self,
@@ -1096,36 +886,25 @@ class DatabaseManager:
         dd,
         notes,
     ):
-        conn = self._get_connection()
-        timestamp = datetime.now()
-        try:
-            cursor = conn.cursor()
-
-            cursor.execute(
-                "INSERT INTO payments (timestamp, session_id, date, name, clock_in, clock_out, hours, minutes, cash, dd, notes) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
-                (
-                    timestamp,
-                    session_id,
-                    date,
-                    name,
-                    clock_in,
-                    clock_out,
-                    hours,
-                    minutes,
-                    cash,
-                    dd,
-                    notes,
-                ),
-            )
-            conn.commit()
-        except sqlite3.Error as e:
-            logger.warn(f"[DatabaseManager]:\n{e}")
-            return False
-        finally:
-            conn.close()
-        return True
+        return self.write_behind.enqueue(
+            "payment_insert",
+            (
+                str(datetime.now()),
+                session_id,
+                date,
+                name,
+                clock_in,
+                clock_out,
+                hours,
+                minutes,
+                cash,
+                dd,
+                notes,
+            ),
+        )
 
     def get_sessions(self, session_id=None, name=None):
+        self.write_behind.flush()
         conn = self._get_connection()
         try:
             cursor = conn.cursor()
@@ -1144,20 +923,10 @@ class DatabaseManager:
             logger.warn(f"[DatabaseManager]:\n{e}")
             return None
         finally:
-            conn.close()
+            self._release_connection(conn)
 
     def delete_attendance_log_entry(self, session_id):
-        conn = self._get_connection()
-        try:
-            cursor = conn.cursor()
-            cursor.execute(
-                "DELETE FROM attendance_log WHERE session_id = ?", (session_id,)
-            )
-            conn.commit()
-        except sqlite3.Error as e:
-            logger.warn(f"[DatabaseManager]:\n{e}")
-        finally:
-            conn.close()
+        self.write_behind.enqueue("attendance_delete", (session_id,))
 
     def insert_attendance_log_entry(
         self, name, session_id, clock_in_time, clock_out_time=None
@@ -1167,21 +936,12 @@ class DatabaseManager:
                 f"Discarding admin time entry:\nSession ID: {session_id}, Clock-in: {clock_in_time}"
             )
             return
-        conn = self._get_connection()
-        try:
-            cursor = conn.cursor()
-            cursor.execute(
-                """INSERT INTO attendance_log (name, session_id, clock_in, clock_out)
-                VALUES (?, ?, ?, ?)""",
-                (name, session_id, clock_in_time, clock_out_time),
-            )
-            conn.commit()
-        except sqlite3.Error as e:
-            logger.warn(f"[DatabaseManager]:\n{e}")
-        finally:
-            conn.close()
+        self.write_behind.enqueue(
+            "attendance_insert", (name, session_id, clock_in_time, clock_out_time)
+        )
 
     def retrieve_attendence_log_entries(self):  # debug
+        self.write_behind.flush()
         conn = self._get_connection()
         try:
             cursor = conn.cursor()
@@ -1192,44 +952,48 @@ class DatabaseManager:
         except sqlite3.Error as e:
             logger.warn(f"[DatabaseManager]:\n{e}")
         finally:
-            conn.close()
+            self._release_connection(conn)
 
     def update_attendance_log_entry(self, session_id, clock_out_time):
-        conn = self._get_connection()
-        try:
-            cursor = conn.cursor()
-            cursor.execute(
-                """UPDATE attendance_log
-                SET clock_out = ?
-                WHERE session_id = ?""",
-                (clock_out_time, session_id),
-            )
-            conn.commit()
-        except sqlite3.Error as e:
-            logger.warn(f"[DatabaseManager]:\n{e}")
-        finally:
-            conn.close()
+        self.write_behind.enqueue(
+            "attendance_clock_out_update", (clock_out_time, session_id)
+        )
 
+    def get_item_popularity_by_name(self, decayed=True) -> dict[str, float]:
+        """Units sold per item name, from the maintained item_sales_stats table.
 
-    def get_item_popularity_by_name(self) -> dict[str, float]:
+        With ``decayed`` each sale counts half as much every
+        db_sales_stats.HALF_LIFE_DAYS, so recent best-sellers rank first;
+        otherwise this is the plain all-time quantity.
+        """
         conn = self._get_connection()
         cursor = conn.cursor()
         try:
-            cursor.execute(
-                """
-                SELECT name, COALESCE(SUM(qty), 0)
-                FROM order_items
-                GROUP BY name
-                """
-            )
+            factor = db_sales_stats.decay_factor()
             out: dict[str, float] = {}
-            for name, qty in cursor.fetchall():
+            for name, qty, score in self.statements.fetchall(cursor, "item_popularity_by_name"):
                 if name is None:
                     continue
-                out[str(name)] = float(qty or 0.0)
+                value = (score or 0.0) * factor if decayed else (qty or 0.0)
+                out[str(name)] = max(0.0, float(value))
             return out
         except sqlite3.Error as e:
             logger.warn(f"[DatabaseManager.get_item_popularity_by_name]:\n{e}")
             return {}
         finally:
-            conn.close()
+            self._release_connection(conn)
+
+    def rebuild_item_sales_stats(self):
+        """Recompute item_sales_stats from order history, e.g. after editing the database by hand."""
+        conn = self._get_connection()
+        try:
+            cursor = conn.cursor()
+            count = db_sales_stats.rebuild(cursor)
+            conn.commit()
+            return count
+        except sqlite3.Error as e:
+            conn.rollback()
+            logger.error(f"[DatabaseManager] rebuild_item_sales_stats failed\n{e}")
+            return None
+        finally:
+            self._release_connection(conn)
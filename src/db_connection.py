@@ -0,0 +1,74 @@
+import sqlite3
+import threading
+import logging
+
+logger = logging.getLogger("rigs_pos")
+
+
+class ConnectionPool:
+    """Hands out one long-lived sqlite3 connection per thread.
+
+    Connections are opened lazily the first time a thread asks for one and the
+    tuning pragmas are applied exactly once at that point. WAL journaling lets
+    the analytics servers read ``inventory.db`` while the register is writing.
+    """
+
+    PRAGMAS = (
+        "PRAGMA journal_mode=WAL",
+        "PRAGMA synchronous=NORMAL",
+        "PRAGMA temp_store=MEMORY",
+        "PRAGMA cache_size=-16000",  # KiB, ~16 MB page cache
+        "PRAGMA mmap_size=134217728",  # 128 MB
+    )
+
+    def __init__(self, db_path, timeout=5.0, cached_statements=256):
+        self.db_path = db_path
+        self.timeout = timeout
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+
+    def _open(self):
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.timeout,
+            cached_statements=self.cached_statements,
+            check_same_thread=False,
+        )
+        cursor = conn.cursor()
+        for pragma in self.PRAGMAS:
+            try:
+                cursor.execute(pragma)
+            except sqlite3.Error as e:
+                logger.warning(f"[ConnectionPool] {pragma} failed: {e}")
+        cursor.close()
+        with self._lock:
+            self._connections.append(conn)
+        return conn
+
+    def connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._open()
+            self._local.conn = conn
+        return conn
+
+    def release(self, conn):
+        # Equivalent of the old per-call close(): anything the caller did not
+        # commit is discarded, but the connection itself stays open.
+        if conn is not None and conn.in_transaction:
+            conn.rollback()
+
+    def close_all(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                if conn.in_transaction:
+                    conn.rollback()
+                conn.execute("PRAGMA optimize")
+                conn.close()
+            except sqlite3.Error as e:
+                logger.warning(f"[ConnectionPool] close_all: {e}")
+        self._local = threading.local()
@@ -0,0 +1,441 @@
+import sqlite3
+import logging
+
+from db_statements import ORDER_ITEM_KEY_SQL
+import db_sales_stats
+
+logger = logging.getLogger("rigs_pos")
+
+
+def _columns(cursor, table_name):
+    cursor.execute(f"PRAGMA table_info({table_name})")
+    return {row[1] for row in cursor.fetchall()}
+
+
+def _add_column_if_missing(cursor, table_name, column_name, column_def):
+    # Terminals that predate schema_version may already have any of the
+    # columns the old ad-hoc upgrades added, so column additions stay guarded.
+    if column_name in _columns(cursor, table_name):
+        return False
+    cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN {column_def}")
+    return True
+
+
+def _baseline(cursor):
+    cursor.execute(
+        """CREATE TABLE IF NOT EXISTS items (
+                        barcode TEXT,
+                        name TEXT,
+                        price REAL,
+                        cost REAL,
+                        sku TEXT,
+                        product_category TEXT,
+                        parent_barcode TEXT,
+                        item_id TEXT,
+                        taxable BOOLEAN DEFAULT TRUE,
+                        is_rolling_papers BOOLEAN NOT NULL DEFAULT FALSE,
+                        is_cigarette BOOLEAN NOT NULL DEFAULT FALSE,
+                        papers_per_pack INTEGER,
+                        ean_barcode TEXT,
+                        PRIMARY KEY (barcode, sku),
+                        FOREIGN KEY(parent_barcode) REFERENCES items(barcode)
+                    )"""
+    )
+    _add_column_if_missing(
+        cursor, "items", "is_cigarette", "is_cigarette BOOLEAN NOT NULL DEFAULT FALSE"
+    )
+    _add_column_if_missing(cursor, "items", "papers_per_pack", "papers_per_pack INTEGER")
+    _add_column_if_missing(cursor, "items", "product_category", "product_category TEXT")
+    _add_column_if_missing(cursor, "items", "ean_barcode", "ean_barcode TEXT")
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_items_ean_barcode ON items(ean_barcode)"
+    )
+
+    cursor.execute(
+        """CREATE TABLE IF NOT EXISTS order_history (
+                        order_id TEXT PRIMARY KEY,
+                        items TEXT,
+                        total REAL,
+                        tax REAL,
+                        discount REAL,
+                        total_with_tax REAL,
+                        payment_method TEXT,
+                        amount_tendered REAL,
+                        change_given REAL,
+                        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )"""
+    )
+
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS order_items (
+            id               INTEGER PRIMARY KEY AUTOINCREMENT,
+            order_id         TEXT NOT NULL,
+            item_id          TEXT,
+            barcode          TEXT,
+            name             TEXT NOT NULL,
+            qty              REAL NOT NULL,
+            unit_price       REAL NOT NULL,
+            line_subtotal    REAL NOT NULL,
+            unit_cost        REAL,
+            line_cost        REAL,
+            taxable          INTEGER,
+            is_rolling_papers INTEGER,
+            is_cigarette INTEGER,
+            papers_per_pack  INTEGER,
+            order_timestamp  TEXT,
+            is_custom        INTEGER NOT NULL DEFAULT 0,
+        FOREIGN KEY(order_id) REFERENCES order_history(order_id)
+        )
+        """
+    )
+    _add_column_if_missing(cursor, "order_items", "is_cigarette", "is_cigarette INTEGER")
+    _add_column_if_missing(
+        cursor, "order_items", "papers_per_pack", "papers_per_pack INTEGER"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_order_items_order_id ON order_items(order_id)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_order_items_name ON order_items(name)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_order_items_timestamp ON order_items(order_timestamp)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_order_items_is_custom ON order_items(is_custom)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_order_items_is_cigarette ON order_items(is_cigarette)"
+    )
+
+    cursor.execute(
+        """CREATE TABLE IF NOT EXISTS modified_orders (
+                        order_id TEXT,
+                        items TEXT,
+                        total REAL,
+                        tax REAL,
+                        discount REAL,
+                        total_with_tax REAL,
+                        payment_method TEXT,
+                        amount_tendered REAL,
+                        change_given REAL,
+                        modification_type TEXT, -- 'deleted' or 'modified'
+                        timestamp TEXT
+                    )"""
+    )
+
+    cursor.execute(
+        """CREATE TABLE IF NOT EXISTS payments (
+                        timestamp TEXT,
+                        session_id TEXT,
+                        date TEXT,
+                        name TEXT,
+                        clock_in TEXT,
+                        clock_out TEXT,
+                        hours TEXT,
+                        minutes TEXT,
+                        cash BOOLEAN,
+                        dd BOOLEAN,
+                        notes TEXT
+                    )"""
+    )
+
+    cursor.execute(
+        """CREATE TABLE IF NOT EXISTS attendance_log (
+            session_id TEXT PRIMARY KEY,
+            name TEXT,
+            clock_in TIME,
+            clock_out TIME
+        )"""
+    )
+
+
+def _write_behind_state(cursor):
+    cursor.execute(
+        """CREATE TABLE IF NOT EXISTS write_behind_state (
+                        id INTEGER PRIMARY KEY,
+                        last_seq INTEGER NOT NULL DEFAULT 0
+                    )"""
+    )
+
+
+def _order_item_key(cursor):
+    key_added = _add_column_if_missing(cursor, "order_items", "item_key", "item_key TEXT")
+    cursor.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_order_items_item_key
+        AFTER INSERT ON order_items
+        WHEN NEW.item_key IS NULL
+        BEGIN
+            UPDATE order_items
+            SET item_key = {ORDER_ITEM_KEY_SQL.format(row="NEW")}
+            WHERE id = NEW.id;
+        END
+        """
+    )
+    if key_added:
+        cursor.execute(
+            f"""
+            UPDATE order_items
+            SET item_key = {ORDER_ITEM_KEY_SQL.format(row="order_items")}
+            WHERE item_key IS NULL
+            """
+        )
+        logger.info(
+            "[SchemaMigrations] Resolved item keys for %d order item rows",
+            cursor.rowcount,
+        )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_order_items_item_key ON order_items(item_key)"
+    )
+    # covers the order_items.item_key join, which only reads the category
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_items_item_id_category ON items(item_id, product_category)"
+    )
+
+
+def _order_history_indexes(cursor):
+    short_id_added = _add_column_if_missing(
+        cursor, "order_history", "short_id", "short_id TEXT"
+    )
+    # short_id is what the receipt barcode encodes: the first 13 characters
+    # of the order_id
+    cursor.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_order_history_short_id
+        AFTER INSERT ON order_history
+        WHEN NEW.short_id IS NULL
+        BEGIN
+            UPDATE order_history
+            SET short_id = substr(NEW.order_id, 1, 13)
+            WHERE order_id = NEW.order_id;
+        END
+        """
+    )
+    if short_id_added:
+        cursor.execute(
+            "UPDATE order_history SET short_id = substr(order_id, 1, 13) WHERE short_id IS NULL"
+        )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_order_history_short_id ON order_history(short_id)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_order_history_timestamp ON order_history(timestamp)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_order_history_payment_method ON order_history(payment_method, timestamp)"
+    )
+
+
+def _item_sales_stats(cursor):
+    db_sales_stats.create_table(cursor)
+    db_sales_stats.rebuild(cursor)
+
+
+def _order_history_keyset_index(cursor):
+    # History pages are keyed on (timestamp, order_id). The composite index
+    # leads with timestamp, so it serves every plain timestamp range too and
+    # step 4's idx_order_history_timestamp would only be a second copy of
+    # the column to maintain on each order insert. It is dropped here
+    # because step 4 has shipped and stays as it is; on a new database it
+    # was built over an empty table, so creating and dropping it cost nothing.
+    indexes = {row[1] for row in cursor.execute("PRAGMA index_list(order_history)")}
+    if "idx_order_history_timestamp_order_id" not in indexes:
+        cursor.execute(
+            "CREATE INDEX idx_order_history_timestamp_order_id "
+            "ON order_history(timestamp, order_id)"
+        )
+    if "idx_order_history_timestamp" in indexes:
+        cursor.execute("DROP INDEX idx_order_history_timestamp")
+
+
+def _trigram_supported(cursor):
+    try:
+        cursor.execute("CREATE VIRTUAL TABLE temp.trigram_probe USING fts5(x, tokenize='trigram')")
+    except sqlite3.OperationalError:
+        return False
+    cursor.execute("DROP TABLE temp.trigram_probe")
+    return True
+
+
+def _order_items_fts(cursor):
+    # SQLite builds without FTS5 or its trigram tokenizer (older than 3.34)
+    # skip the index; item search then scans names instead, see
+    # db_statements.has_item_name_index
+    if not _trigram_supported(cursor):
+        logger.warning(
+            "[SchemaMigrations] SQLite %s has no FTS5 trigram tokenizer, "
+            "item name search will scan order_items",
+            sqlite3.sqlite_version,
+        )
+        return
+    # external-content table: the index holds only trigrams, order_items
+    # keeps the names
+    cursor.execute(
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS order_items_fts USING fts5(
+            name,
+            content='order_items',
+            content_rowid='id',
+            tokenize='trigram'
+        )
+        """
+    )
+    cursor.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_order_items_fts_insert
+        AFTER INSERT ON order_items
+        BEGIN
+            INSERT INTO order_items_fts (rowid, name) VALUES (NEW.id, NEW.name);
+        END
+        """
+    )
+    cursor.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_order_items_fts_delete
+        AFTER DELETE ON order_items
+        BEGIN
+            INSERT INTO order_items_fts (order_items_fts, rowid, name)
+            VALUES ('delete', OLD.id, OLD.name);
+        END
+        """
+    )
+    cursor.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_order_items_fts_update
+        AFTER UPDATE OF name ON order_items
+        BEGIN
+            INSERT INTO order_items_fts (order_items_fts, rowid, name)
+            VALUES ('delete', OLD.id, OLD.name);
+            INSERT INTO order_items_fts (rowid, name) VALUES (NEW.id, NEW.name);
+        END
+        """
+    )
+    cursor.execute("INSERT INTO order_items_fts (order_items_fts) VALUES ('rebuild')")
+
+
+# Money columns stay REAL dollars, which every reader of the database
+# expects, but after this step each holds the double closest to a whole
+# number of cents, as the integer-cent order engine now writes them. Costs
+# are left alone: per-unit costs from split cartons are legitimately
+# fractions of a cent.
+_MONEY_COLUMNS = (
+    ("order_history", ("total", "tax", "discount", "total_with_tax", "amount_tendered", "change_given")),
+    ("modified_orders", ("total", "tax", "discount", "total_with_tax", "amount_tendered", "change_given")),
+    ("order_items", ("unit_price", "line_subtotal")),
+)
+
+
+def _money_to_cents(cursor):
+    for table, columns in _MONEY_COLUMNS:
+        existing = _columns(cursor, table)
+        for column in columns:
+            if column not in existing:
+                continue
+            cursor.execute(
+                f"UPDATE {table} SET {column} = ROUND({column} * 100) / 100.0 "
+                f"WHERE typeof({column}) = 'real' AND {column} != ROUND({column} * 100) / 100.0"
+            )
+
+
+def _saved_orders(cursor):
+    # parked orders: the whole order as JSON, plus the item names the clock
+    # screen lists so listing never parses a payload
+    cursor.execute(
+        """CREATE TABLE IF NOT EXISTS saved_orders (
+                        order_id TEXT PRIMARY KEY,
+                        item_names TEXT NOT NULL,
+                        payload TEXT NOT NULL,
+                        saved_at TEXT NOT NULL
+                    )"""
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_saved_orders_saved_at ON saved_orders(saved_at, order_id)"
+    )
+
+
+def _order_history_legacy_items_index(cursor):
+    # only orders from before order_items have items JSON; the legacy branch
+    # of an item search reads just those
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_order_history_legacy_items "
+        "ON order_history(order_id) WHERE items IS NOT NULL"
+    )
+
+
+# Append only. A step's version number is recorded once it has run, so
+# editing or reordering released steps would leave terminals out of sync.
+MIGRATIONS = (
+    (1, "baseline schema", _baseline),
+    (2, "write-behind state", _write_behind_state),
+    (3, "order_items.item_key", _order_item_key),
+    (4, "order_history short_id and indexes", _order_history_indexes),
+    (5, "item_sales_stats popularity table", _item_sales_stats),
+    (6, "order_history keyset index", _order_history_keyset_index),
+    (7, "order_items name full-text index", _order_items_fts),
+    (8, "money columns rounded to whole cents", _money_to_cents),
+    (9, "saved_orders table for parked orders", _saved_orders),
+    (10, "order_history legacy items index", _order_history_legacy_items_index),
+)
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(conn):
+    try:
+        row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    except sqlite3.OperationalError:
+        return 0
+    return row[0] or 0
+
+
+def migrate(conn, migrations=MIGRATIONS):
+    """Bring the database up to the latest schema version.
+
+    Costs a single query when the schema is already current. Otherwise each
+    pending step runs and is recorded in its own IMMEDIATE transaction, so a
+    failing step rolls back alone and leaves every step before it applied,
+    and two terminals starting at once cannot both apply the same step.
+    Returns the number of steps applied; a failing step's error is re-raised.
+    """
+    latest = migrations[-1][0] if migrations else 0
+    if schema_version(conn) >= latest:
+        return 0
+
+    cursor = conn.cursor()
+    cursor.execute(
+        """CREATE TABLE IF NOT EXISTS schema_version (
+                        version INTEGER PRIMARY KEY,
+                        description TEXT,
+                        applied_at TEXT DEFAULT CURRENT_TIMESTAMP
+                    )"""
+    )
+    conn.commit()
+
+    applied = 0
+    for version, description, step in migrations:
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            # re-read under the write lock in case another process just migrated
+            if version <= schema_version(conn):
+                conn.rollback()
+                continue
+            logger.info("[SchemaMigrations] applying %d: %s", version, description)
+            step(cursor)
+            cursor.execute(
+                "INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                (version, description),
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            logger.error(
+                "[SchemaMigrations] step %d (%s) failed, schema left at version %d",
+                version,
+                description,
+                schema_version(conn),
+            )
+            raise
+        applied += 1
+    return applied
@@ -0,0 +1,118 @@
+from datetime import datetime
+import logging
+
+from db_statements import ITEM_SALES_STATS_APPLY_SQL
+
+logger = logging.getLogger("rigs_pos")
+
+# A sale counts half as much toward an item's popularity every HALF_LIFE_DAYS.
+HALF_LIFE_DAYS = 60.0
+
+# Scores are stored relative to a fixed landmark instead of being decayed in
+# place: a sale at time t adds 2 ** ((t - landmark) / half_life), and reading
+# multiplies by 2 ** (-(now - landmark) / half_life). Nothing has to be
+# rewritten as time passes, and deleting an order subtracts exactly what
+# committing it added. Doubles overflow about 1000 half-lives after the
+# landmark, which at 60 days is well past the life of this database.
+_LANDMARK = datetime(2020, 1, 1)
+
+
+def _as_datetime(value):
+    if isinstance(value, datetime):
+        return value
+    if value in (None, ""):
+        return None
+    try:
+        return datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+
+
+def _days_since_landmark(when):
+    return (when - _LANDMARK).total_seconds() / 86400.0
+
+
+def sale_weight(timestamp):
+    """Stored score of one unit sold at ``timestamp``."""
+    when = _as_datetime(timestamp)
+    if when is None:
+        # unreadable timestamps still have to weigh the same on the way out
+        # as on the way in, so they sit at the landmark
+        return 1.0
+    return 2.0 ** (_days_since_landmark(when) / HALF_LIFE_DAYS)
+
+
+def decay_factor(now=None):
+    """Multiplier turning stored scores into units sold, decayed to ``now``."""
+    return 2.0 ** (-_days_since_landmark(now or datetime.now()) / HALF_LIFE_DAYS)
+
+
+def sales_deltas(sales, sign=1):
+    """item_sales_stats_apply parameters for ``(name, item_id, qty, timestamp)`` sales.
+
+    Sales of the same name are folded into one row. ``sign=-1`` produces the
+    deltas that undo the same sales.
+    """
+    totals = {}
+    for name, item_id, qty, timestamp in sales:
+        if not name:
+            continue
+        qty = float(qty or 0.0)
+        entry = totals.get(name)
+        if entry is None:
+            entry = totals[name] = [None, 0.0, 0.0, None]
+        if item_id not in (None, ""):
+            entry[0] = str(item_id)
+        entry[1] += sign * qty
+        entry[2] += sign * qty * sale_weight(timestamp)
+        if sign > 0 and timestamp is not None:
+            sold = str(timestamp)
+            if entry[3] is None or sold > entry[3]:
+                entry[3] = sold
+    return [
+        (name, item_id if sign > 0 else None, qty, score, last_sold)
+        for name, (item_id, qty, score, last_sold) in totals.items()
+    ]
+
+
+def create_table(cursor):
+    cursor.execute(
+        """CREATE TABLE IF NOT EXISTS item_sales_stats (
+                        name TEXT PRIMARY KEY,
+                        item_id TEXT,
+                        qty_total REAL NOT NULL DEFAULT 0,
+                        score REAL NOT NULL DEFAULT 0,
+                        last_sold TEXT
+                    )"""
+    )
+
+
+def rebuild(cursor):
+    """Recompute item_sales_stats from every order still in order_history."""
+    cursor.execute("DELETE FROM item_sales_stats")
+    cursor.execute(
+        """
+        SELECT oi.name, oi.item_key, oi.qty, oi.order_timestamp
+        FROM order_items oi
+        WHERE oi.order_id IN (SELECT order_id FROM order_history)
+        ORDER BY oi.id
+        """
+    )
+    deltas = sales_deltas(cursor.fetchall())
+    cursor.executemany(ITEM_SALES_STATS_APPLY_SQL, deltas)
+    logger.info("[SalesStats] rebuilt popularity for %d item names", len(deltas))
+    return len(deltas)
+
+
+if __name__ == "__main__":
+    import sqlite3
+    import sys
+
+    logging.basicConfig(level=logging.INFO)
+    db_path = sys.argv[1] if len(sys.argv) > 1 else "db/inventory.db"
+    conn = sqlite3.connect(db_path)
+    try:
+        rebuild(conn.cursor())
+        conn.commit()
+    finally:
+        conn.close()
@@ -0,0 +1,378 @@
+import threading
+import time
+import logging
+
+logger = logging.getLogger("rigs_pos")
+
+ITEM_DETAIL_COLUMNS = """
+    name,
+    price,
+    barcode,
+    cost,
+    sku,
+    product_category,
+    item_id,
+    parent_barcode,
+    taxable,
+    is_rolling_papers,
+    is_cigarette,
+    papers_per_pack,
+    ean_barcode
+"""
+
+ITEM_ROW_COLUMNS = (
+    "barcode, name, price, cost, sku, product_category, item_id, parent_barcode, "
+    "taxable, is_rolling_papers, is_cigarette, papers_per_pack, ean_barcode"
+)
+
+ORDER_ITEM_INSERT_SQL = """
+    INSERT INTO order_items (
+        order_id,
+        item_id,
+        barcode,
+        name,
+        qty,
+        unit_price,
+        line_subtotal,
+        unit_cost,
+        line_cost,
+        taxable,
+        is_rolling_papers,
+        is_cigarette,
+        papers_per_pack,
+        order_timestamp
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+# The items.item_id an order_items row refers to: its own item_id when it has
+# one, otherwise whatever item carried its barcode when the row was written.
+# Stored in order_items.item_key so joins to items are a plain indexed lookup.
+ORDER_ITEM_KEY_SQL = """
+    CASE
+        WHEN {row}.item_id IS NOT NULL AND {row}.item_id != '' THEN {row}.item_id
+        WHEN {row}.barcode IS NOT NULL AND {row}.barcode != '' THEN (
+            SELECT it.item_id FROM items it WHERE it.barcode = {row}.barcode LIMIT 1
+        )
+    END
+"""
+
+# Orders in the row shape HistoryView and OrderDetailsPopup expect, with the
+# item names summarised per order. Callers append a WHERE on oh.
+ORDER_SUMMARY_COLUMNS = """
+    SELECT
+        oh.order_id,
+        COALESCE(
+            (SELECT GROUP_CONCAT(oi.name, ', ') FROM order_items oi WHERE oi.order_id = oh.order_id),
+            ''
+        ) AS item_names,
+        oh.total,
+        oh.tax,
+        oh.discount,
+        oh.total_with_tax,
+        oh.timestamp,
+        oh.payment_method,
+        oh.amount_tendered,
+        oh.change_given
+"""
+ORDER_SUMMARY_SELECT = ORDER_SUMMARY_COLUMNS + "FROM order_history oh\n"
+
+
+def cents_sum(column):
+    """SQL summing a REAL dollar column as integer cents, so long ranges add up exactly."""
+    return f"COALESCE(SUM(CAST(ROUND({column} * 100) AS INTEGER)), 0)"
+
+
+# count, total, tax, total_with_tax, amount_tendered, change_given, in cents
+ORDER_TOTALS_SELECT = f"""
+    SELECT
+        COUNT(*),
+        {cents_sum("oh.total")},
+        {cents_sum("oh.tax")},
+        {cents_sum("oh.total_with_tax")},
+        {cents_sum("oh.amount_tendered")},
+        {cents_sum("oh.change_given")}
+    FROM order_history oh
+"""
+
+# timestamps are stored as ISO text, so a half-open string range is a range
+# scan on the timestamp index
+ORDER_TIMESTAMP_RANGE_SQL = "oh.timestamp >= ? AND oh.timestamp < ?"
+
+# Keyset page, newest first: rows strictly before the (timestamp, order_id)
+# of the last row already shown. Seeks straight into
+# idx_order_history_timestamp_order_id however deep the page is.
+ORDER_PAGE_SQL = """
+    (oh.timestamp, oh.order_id) < (?, ?)
+    ORDER BY oh.timestamp DESC, oh.order_id DESC
+    LIMIT ?
+"""
+
+
+def _order_summary_page(where):
+    # the page is cut in a subquery so the item names are only summarised
+    # for the rows actually returned, however many match
+    return (
+        ORDER_SUMMARY_COLUMNS
+        + f"FROM (SELECT * FROM order_history oh WHERE {where} AND {ORDER_PAGE_SQL}) oh\n"
+        + "ORDER BY oh.timestamp DESC, oh.order_id DESC"
+    )
+
+# Item-name search goes through order_items_fts, a trigram FTS5 index kept
+# in step with order_items by triggers. Trigrams cannot match terms shorter
+# than three characters, so those fall back to scanning names, as does every
+# search on a database whose SQLite had no trigram tokenizer to build the
+# index with.
+FTS_MIN_TERM_LEN = 3
+
+ITEM_NAME_FTS_SQL = "{alias}.id IN (SELECT rowid FROM order_items_fts WHERE order_items_fts MATCH ?)"
+ITEM_NAME_SCAN_SQL = "instr(lower({alias}.name), ?) > 0"
+
+
+def has_item_name_index(conn):
+    """Whether the schema migrations could build order_items_fts on this database."""
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'order_items_fts'"
+    ).fetchone()
+    return row is not None
+
+
+def item_name_match(term, alias="oi", fts=True):
+    """``(condition, param)`` matching order_items rows whose name contains ``term``.
+
+    Case-insensitive substring match, like the LOWER(name) LIKE '%term%'
+    filters it replaces. Used by the history view and the analytics server;
+    pass ``fts=False`` where has_item_name_index is false.
+    """
+    term = term.lower()
+    if fts and len(term) >= FTS_MIN_TERM_LEN:
+        return ITEM_NAME_FTS_SQL.format(alias=alias), fts_phrase(term)
+    return ITEM_NAME_SCAN_SQL.format(alias=alias), term
+
+
+# Orders written before order_items existed only carry the items JSON in
+# order_history.items. They are matched in their own UNION branch, limited to
+# orders with no order_items rows and read off a partial index, so the JSON
+# LIKE never turns the indexed name match into a scan of every order.
+LEGACY_ITEMS_MATCH_SQL = (
+    "SELECT legacy.order_id FROM order_history legacy "
+    "WHERE legacy.items IS NOT NULL AND LOWER(legacy.items) LIKE ? "
+    "AND NOT EXISTS (SELECT 1 FROM order_items x WHERE x.order_id = legacy.order_id)"
+)
+
+
+def order_item_match(term, column="oh.order_id", fts=True):
+    """``(condition, params)`` matching orders with an item whose name contains ``term``."""
+    name_match, name_param = item_name_match(term, fts=fts)
+    condition = (
+        f"{column} IN (SELECT oi.order_id FROM order_items oi WHERE {name_match} "
+        f"UNION {LEGACY_ITEMS_MATCH_SQL})"
+    )
+    return condition, [name_param, f"%{term.lower()}%"]
+
+
+def fts_phrase(term):
+    # a quoted phrase, so FTS5 query syntax in the term is taken literally
+    return '"' + term.lower().replace('"', '""') + '"'
+
+
+ORDER_HAS_ITEM_SQL = (
+    "oh.order_id IN (SELECT oi.order_id FROM order_items oi WHERE "
+    + ITEM_NAME_FTS_SQL.format(alias="oi")
+    + ")"
+)
+ORDER_HAS_ITEM_SCAN_SQL = (
+    "EXISTS (SELECT 1 FROM order_items oi WHERE oi.order_id = oh.order_id AND "
+    + ITEM_NAME_SCAN_SQL.format(alias="oi")
+    + ")"
+)
+
+# Adds a (possibly negative) delta to one item_sales_stats row; removing an
+# order applies the same deltas with the sign flipped.
+ITEM_SALES_STATS_APPLY_SQL = """
+    INSERT INTO item_sales_stats (name, item_id, qty_total, score, last_sold)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(name) DO UPDATE SET
+        item_id = COALESCE(excluded.item_id, item_id),
+        qty_total = qty_total + excluded.qty_total,
+        score = score + excluded.score,
+        last_sold = CASE
+            WHEN excluded.last_sold > COALESCE(last_sold, '') THEN excluded.last_sold
+            ELSE last_sold
+        END
+"""
+
+# Every string here is final: sqlite3's per-connection statement cache is keyed
+# on the exact SQL text, so building these with format() at call time would
+# miss the cache on every call.
+STATEMENTS = {
+    "item_by_item_id": f"SELECT {ITEM_DETAIL_COLUMNS} FROM items WHERE item_id = ? LIMIT 1",
+    "item_by_barcode": f"SELECT {ITEM_DETAIL_COLUMNS} FROM items WHERE barcode = ? LIMIT 1",
+    "item_by_ean": f"SELECT {ITEM_DETAIL_COLUMNS} FROM items WHERE ean_barcode = ? LIMIT 1",
+    "items_by_barcode": f"SELECT {ITEM_ROW_COLUMNS} FROM items WHERE barcode = ?",
+    "item_row_by_item_id": f"SELECT {ITEM_ROW_COLUMNS} FROM items WHERE item_id = ? LIMIT 1",
+    "all_items": f"SELECT {ITEM_ROW_COLUMNS} FROM items",
+    "barcode_exists": "SELECT 1 FROM items WHERE barcode = ?",
+    "order_history_insert": (
+        "INSERT INTO order_history (order_id, items, total, tax, discount, total_with_tax, "
+        "timestamp, payment_method, amount_tendered, change_given) "
+        "VALUES (?, NULL, ?, ?, ?, ?, ?, ?, ?, ?)"
+    ),
+    "order_item_insert": ORDER_ITEM_INSERT_SQL,
+    "order_items_for_order": """
+        SELECT
+            oi.id,
+            oi.order_id,
+            oi.item_id,
+            oi.barcode,
+            oi.name,
+            COALESCE(it.product_category, '') AS product_category,
+            oi.qty,
+            oi.unit_price,
+            oi.line_subtotal,
+            oi.unit_cost,
+            oi.line_cost,
+            oi.taxable,
+            oi.is_rolling_papers,
+            oi.is_cigarette,
+            oi.papers_per_pack,
+            oi.order_timestamp,
+            oi.is_custom
+        FROM order_items oi
+        LEFT JOIN items it ON it.item_id = oi.item_key
+        WHERE oi.order_id = ?
+        ORDER BY oi.id
+    """,
+    "order_by_id": """
+        SELECT
+            order_id,
+            items,
+            total,
+            tax,
+            discount,
+            total_with_tax,
+            timestamp,
+            payment_method,
+            amount_tendered,
+            change_given
+        FROM order_history
+        WHERE order_id = ?
+    """,
+    "order_summary_by_short_id": ORDER_SUMMARY_SELECT + "WHERE oh.short_id = ? LIMIT 1",
+    "order_history_page": _order_summary_page("oh.timestamp >= ?"),
+    "order_totals_between": ORDER_TOTALS_SELECT + f"WHERE {ORDER_TIMESTAMP_RANGE_SQL}",
+    "order_history_page_with_item": _order_summary_page(ORDER_HAS_ITEM_SQL),
+    "order_history_page_with_item_scan": _order_summary_page(ORDER_HAS_ITEM_SCAN_SQL),
+    "order_totals_with_item": ORDER_TOTALS_SELECT + f"WHERE {ORDER_HAS_ITEM_SQL}",
+    "order_totals_with_item_scan": ORDER_TOTALS_SELECT + f"WHERE {ORDER_HAS_ITEM_SCAN_SQL}",
+    "item_popularity_by_name": "SELECT name, qty_total, score FROM item_sales_stats",
+    "item_sales_stats_apply": ITEM_SALES_STATS_APPLY_SQL,
+    "item_sales_stats_prune": "DELETE FROM item_sales_stats WHERE abs(qty_total) < 1e-9",
+    "order_item_sales_for_order": (
+        "SELECT name, item_key, qty, order_timestamp FROM order_items WHERE order_id = ?"
+    ),
+    "saved_order_upsert": (
+        "INSERT OR REPLACE INTO saved_orders (order_id, item_names, payload, saved_at) "
+        "VALUES (?, ?, ?, ?)"
+    ),
+    "saved_order_get": "SELECT payload FROM saved_orders WHERE order_id = ?",
+    "saved_order_delete": "DELETE FROM saved_orders WHERE order_id = ?",
+    "saved_order_list": (
+        "SELECT order_id, item_names FROM saved_orders ORDER BY saved_at, order_id LIMIT ?"
+    ),
+    "item_category_update": "UPDATE items SET product_category = ? WHERE item_id = ?",
+    "attendance_insert": (
+        "INSERT INTO attendance_log (name, session_id, clock_in, clock_out) VALUES (?, ?, ?, ?)"
+    ),
+    "attendance_clock_out_update": "UPDATE attendance_log SET clock_out = ? WHERE session_id = ?",
+    "attendance_delete": "DELETE FROM attendance_log WHERE session_id = ?",
+    "payment_insert": (
+        "INSERT INTO payments (timestamp, session_id, date, name, clock_in, clock_out, "
+        "hours, minutes, cash, dd, notes) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+    ),
+    "modified_order_snapshot": (
+        "INSERT INTO modified_orders (order_id, items, total, tax, discount, total_with_tax, "
+        "timestamp, payment_method, amount_tendered, change_given, modification_type) "
+        "SELECT order_id, items, total, tax, discount, total_with_tax, timestamp, "
+        "payment_method, amount_tendered, change_given, ? "
+        "FROM order_history WHERE order_id = ?"
+    ),
+    "order_history_delete": "DELETE FROM order_history WHERE order_id = ?",
+}
+
+
+class StatementRegistry:
+    """Named SQL statements plus per-statement call counts and latency.
+
+    Timings cover execute and, for the fetch helpers, the fetch as well, since
+    SQLite does most of the work of a SELECT while rows are being stepped.
+    """
+
+    def __init__(self, statements=None):
+        self._sql = dict(STATEMENTS if statements is None else statements)
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._seconds = {}
+
+    def sql(self, name):
+        return self._sql[name]
+
+    def _record(self, name, elapsed):
+        with self._lock:
+            self._calls[name] = self._calls.get(name, 0) + 1
+            self._seconds[name] = self._seconds.get(name, 0.0) + elapsed
+
+    def execute(self, cursor, name, params=()):
+        start = time.perf_counter()
+        cursor.execute(self._sql[name], params)
+        self._record(name, time.perf_counter() - start)
+        return cursor
+
+    def executemany(self, cursor, name, seq_of_params):
+        start = time.perf_counter()
+        cursor.executemany(self._sql[name], seq_of_params)
+        self._record(name, time.perf_counter() - start)
+        return cursor
+
+    def fetchone(self, cursor, name, params=()):
+        start = time.perf_counter()
+        cursor.execute(self._sql[name], params)
+        row = cursor.fetchone()
+        self._record(name, time.perf_counter() - start)
+        return row
+
+    def fetchall(self, cursor, name, params=()):
+        start = time.perf_counter()
+        cursor.execute(self._sql[name], params)
+        rows = cursor.fetchall()
+        self._record(name, time.perf_counter() - start)
+        return rows
+
+    def stats(self):
+        """Return {name: {calls, total_ms, avg_ms}}, most expensive first."""
+        with self._lock:
+            snapshot = [(name, self._calls[name], self._seconds[name]) for name in self._calls]
+        snapshot.sort(key=lambda entry: entry[2], reverse=True)
+        return {
+            name: {
+                "calls": calls,
+                "total_ms": seconds * 1000.0,
+                "avg_ms": (seconds * 1000.0) / calls if calls else 0.0,
+            }
+            for name, calls, seconds in snapshot
+        }
+
+    def reset_stats(self):
+        with self._lock:
+            self._calls.clear()
+            self._seconds.clear()
+
+    def log_stats(self):
+        for name, entry in self.stats().items():
+            logger.info(
+                "[StatementRegistry] %s: %d calls, %.2f ms total, %.3f ms avg",
+                name,
+                entry["calls"],
+                entry["total_ms"],
+                entry["avg_ms"],
+            )
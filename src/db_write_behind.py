@@ -0,0 +1,244 @@
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import logging
+
+logger = logging.getLogger("rigs_pos")
+
+_STOP = object()
+
+
+class WriteBehindQueue:
+    """Applies non-critical writes on a background thread.
+
+    Callers enqueue ``(statement_name, params)`` pairs naming entries in the
+    StatementRegistry. A worker thread drains the queue and commits whatever
+    has accumulated in one transaction. Every job is appended to a spill file
+    before it is queued, and each batch records the highest sequence number it
+    applied in ``write_behind_state`` inside the same transaction, so a replay
+    after a crash only re-applies jobs that never made it into the database.
+    """
+
+    def __init__(
+        self,
+        pool,
+        statements,
+        spill_path,
+        maxsize=1000,
+        max_batch=200,
+        linger=0.05,
+    ):
+        self.pool = pool
+        self.statements = statements
+        self.spill_path = spill_path
+        self.max_batch = max_batch
+        self.linger = linger
+
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._spill_lock = threading.Lock()
+        self._pending_lock = threading.Condition()
+        self._pending = 0
+        self._last_seq = 0
+        self._seeded = False
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(
+            target=self._run, name="db-write-behind", daemon=True
+        )
+        self._thread.start()
+
+    def _seed_seq(self, spilled=()):
+        # Sequence numbers are a counter carried on from the highest one the
+        # database has applied (and any still in the spill file), never wall
+        # time: a clock stepping back between runs must not hand out numbers
+        # that replay_spill would take for already applied.
+        conn = self.pool.connection()
+        try:
+            applied = self._read_applied_seq(conn)
+        except sqlite3.Error as e:
+            logger.error(f"[WriteBehindQueue] could not read applied sequence: {e}")
+            applied = 0
+        finally:
+            self.pool.release(conn)
+        self._last_seq = max(self._last_seq, applied, *spilled)
+        self._seeded = True
+        return applied
+
+    def _next_seq(self):
+        if not self._seeded:
+            self._seed_seq()
+        self._last_seq += 1
+        return self._last_seq
+
+    def enqueue(self, statement_name, params=()):
+        params = list(params)
+        with self._spill_lock:
+            seq = self._next_seq()
+            self._append_spill(seq, statement_name, params)
+            with self._pending_lock:
+                self._pending += 1
+        # blocks only when the worker is maxsize writes behind, which keeps
+        # writes in order instead of dropping or reordering them
+        self._queue.put((seq, statement_name, params))
+        return True
+
+    def _append_spill(self, seq, statement_name, params):
+        line = json.dumps({"seq": seq, "stmt": statement_name, "params": params})
+        try:
+            with open(self.spill_path, "a", encoding="utf-8") as spill:
+                spill.write(line + "\n")
+                spill.flush()
+                os.fsync(spill.fileno())
+        except (OSError, TypeError, ValueError) as e:
+            logger.error(f"[WriteBehindQueue] could not spill {statement_name}: {e}")
+
+    def _truncate_spill_if_idle(self):
+        with self._spill_lock:
+            with self._pending_lock:
+                if self._pending:
+                    return
+            try:
+                with open(self.spill_path, "w", encoding="utf-8"):
+                    pass
+            except OSError as e:
+                logger.warning(f"[WriteBehindQueue] could not truncate spill file: {e}")
+
+    def _mark_done(self, count):
+        with self._pending_lock:
+            self._pending -= count
+            if self._pending <= 0:
+                self._pending = 0
+                self._pending_lock.notify_all()
+
+    def _read_applied_seq(self, conn):
+        row = conn.execute(
+            "SELECT last_seq FROM write_behind_state WHERE id = 1"
+        ).fetchone()
+        return row[0] if row else 0
+
+    def _apply_jobs(self, conn, jobs):
+        cursor = conn.cursor()
+        for _, statement_name, params in jobs:
+            self.statements.execute(cursor, statement_name, params)
+        cursor.execute(
+            "INSERT INTO write_behind_state (id, last_seq) VALUES (1, ?) "
+            "ON CONFLICT(id) DO UPDATE SET last_seq = MAX(last_seq, excluded.last_seq)",
+            (max(seq for seq, _, _ in jobs),),
+        )
+
+    def _apply_batch(self, jobs):
+        conn = self.pool.connection()
+        try:
+            self._apply_jobs(conn, jobs)
+            conn.commit()
+            return
+        except sqlite3.Error as e:
+            conn.rollback()
+            if len(jobs) == 1:
+                logger.error(f"[WriteBehindQueue] dropping {jobs[0][1]}: {e}")
+                return
+            logger.warning(f"[WriteBehindQueue] batch failed, retrying jobs one by one: {e}")
+
+        for job in jobs:
+            try:
+                self._apply_jobs(conn, [job])
+                conn.commit()
+            except sqlite3.Error as e:
+                conn.rollback()
+                logger.error(f"[WriteBehindQueue] dropping {job[1]}: {e}")
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is _STOP:
+                break
+
+            batch = [job]
+            stop = False
+            deadline = time.monotonic() + self.linger
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    nxt = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if nxt is _STOP:
+                    stop = True
+                    break
+                batch.append(nxt)
+
+            try:
+                self._apply_batch(batch)
+            except Exception as e:
+                logger.error(f"[WriteBehindQueue] unexpected error applying batch: {e}")
+            self._mark_done(len(batch))
+            self._truncate_spill_if_idle()
+
+            if stop:
+                break
+
+    def flush(self, timeout=5.0):
+        """Block until every write queued so far has been committed."""
+        with self._pending_lock:
+            if not self._pending:
+                return True
+            if self._thread is None or not self._thread.is_alive():
+                return False
+            return self._pending_lock.wait_for(lambda: self._pending == 0, timeout)
+
+    def replay_spill(self):
+        """Re-apply spilled jobs that a crash kept out of the database.
+
+        Also seeds the sequence counter, so it runs before the first enqueue.
+        """
+        if not os.path.exists(self.spill_path):
+            with self._spill_lock:
+                self._seed_seq()
+            return 0
+
+        jobs = []
+        try:
+            with open(self.spill_path, "r", encoding="utf-8") as spill:
+                for line in spill:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        entry = json.loads(line)
+                        jobs.append((int(entry["seq"]), entry["stmt"], entry["params"]))
+                    except (ValueError, KeyError, TypeError):
+                        # a torn final line from the crash itself
+                        logger.warning("[WriteBehindQueue] skipping unreadable spill line")
+        except OSError as e:
+            logger.error(f"[WriteBehindQueue] could not read spill file: {e}")
+            with self._spill_lock:
+                self._seed_seq()
+            return 0
+
+        with self._spill_lock:
+            applied_seq = self._seed_seq([job[0] for job in jobs])
+
+        jobs = [job for job in jobs if job[0] > applied_seq]
+        if jobs:
+            logger.warning("[WriteBehindQueue] replaying %d spilled writes", len(jobs))
+            self._apply_batch(jobs)
+        self._truncate_spill_if_idle()
+        return len(jobs)
+
+    def stop(self, timeout=10.0):
+        """Drain the queue and stop the worker; used on application exit."""
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.error("[WriteBehindQueue] worker did not finish before shutdown")
+        self._thread = None
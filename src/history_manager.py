@@ -1,5 +1,4 @@
-from datetime import datetime, timedelta
-import csv
+from datetime import date, datetime, timedelta
 
 from kivy.app import App
 from kivy.clock import Clock
@@ -24,12 +23,17 @@ from kivymd.uix.boxlayout import MDBoxLayout
 from kivymd.uix.pickers import MDDatePicker
 
 
+from csv_export import write_csv
 from database_manager import DatabaseManager
 from order_manager import LineItem, Order
+from row_models import OrderRow
 import logging
 
 logger = logging.getLogger("rigs_pos")
 
+HISTORY_PAGE_SIZE = 100
+EXPORT_PAGE_SIZE = 1000
+
 
 class MarkupLabel(MDLabel):
     def __init__(self, **kwargs):
@@ -95,7 +99,13 @@ class HistoryRow(RecycleDataViewBehavior, BoxLayout):
         add_bottom_divider(self)
 
     def refresh_view_attrs(self, rv, index, data):
-        return super().refresh_view_attrs(rv, index, data)
+        hv = rv.row_context
+        order = data.order
+        self.history_view = hv
+        self.order_id = str(order[0])
+        self.items = hv.format_items(order[1])
+        self.total_with_tax = hv.format_money(order[5])
+        self.timestamp = hv.format_date(order[6])
 
     def _open_details(self):
         hv = self.history_view
@@ -123,9 +133,15 @@ class HistoryView(BoxLayout):
         self.app = App.get_running_app()
         self.receipt_printer = getattr(self.app, "receipt_printer", None)
         self.db_manager = DatabaseManager("db/inventory.db", self)
-        self.order_history = []
         self.current_filter = "today"
         self.rv_data = []
+        self.totals = None
+        self._page_filter = None
+        self._next_key = None
+        self._has_more = False
+        self._next_page_trigger = Clock.create_trigger(self.load_next_page)
+        self.num_days = None
+        self.date_range = None
 
         self._build_totals_bar()
         self.add_widget(self.totals_layout)
@@ -141,12 +157,7 @@ class HistoryView(BoxLayout):
     def display_order_details_from_barcode_scan(self, barcode):
         try:
             barcode_str = str(barcode).strip()
-            order_history = self.app.db_manager.get_order_history()
-
-            specific_order = next(
-                (order for order in order_history if str(order[0][:13]) == barcode_str),
-                None,
-            )
+            specific_order = self.app.db_manager.get_order_by_short_id(barcode_str)
 
             if specific_order:
                 popup = OrderDetailsPopup(specific_order, self.receipt_printer)
@@ -225,56 +236,22 @@ class HistoryView(BoxLayout):
         lm.bind(minimum_height=lm.setter("height"))
         self.rv.add_widget(lm)  # attach layout manager first
         self.rv.viewclass = HistoryRow  # then set viewclass
-
-    def show_reporting_popup(self, order_history):
-        self.order_history = order_history or []
-        try:
-            self.rv_data = [
-                {
-                    "order_id": str(order[0]),
-                    "items": self.format_items(order[1]),
-                    "total": self.format_money(order[2]),
-                    "tax": self.format_money(order[3]),
-                    "discount": self.format_money(order[4]),
-                    "total_with_tax": self.format_money(order[5]),
-                    "timestamp": self.format_date(order[6]),
-                    "payment_method": order[7],
-                    "amount_tendered": self.format_money(order[8]),
-                    "change_given": self.format_money(order[9]),
-                    "history_view": self,
-                }
-                for order in reversed(self.order_history)
-            ]
-            self.rv.data = self.rv_data
-        except Exception as e:
-            logger.warning(f"[HistoryManager] show_reporting_popup\n{e}")
+        self.rv.row_context = self
+        self.rv.bind(scroll_y=self._on_history_scroll)
 
     def update_rv_data(self, filtered_history, num_days=None, date_range=None):
         try:
-            self.rv_data = [
-                {
-                    "order_id": str(order[0]),
-                    "items": self.format_items(order[1]),
-                    "total": self.format_money(order[2]),
-                    "tax": self.format_money(order[3]),
-                    "discount": self.format_money(order[4]),
-                    "total_with_tax": self.format_money(order[5]),
-                    "timestamp": self.format_date(order[6]),
-                    "payment_method": order[7],
-                    "amount_tendered": self.format_money(order[8]),
-                    "change_given": self.format_money(order[9]),
-                    "history_view": self,
-                    "num_days": num_days,
-                    "date_range": date_range,
-                }
-                for order in reversed(filtered_history)
-            ]
+            # rows are formatted by HistoryRow as they scroll into view
+            self.num_days = num_days
+            self.date_range = date_range
+            self.rv_data = [OrderRow(order) for order in filtered_history]
             self.rv.data = self.rv_data
         except Exception as e:
             logger.warning(f"[HistoryManager]: update_rv_data \n{e}")
 
     def update_totals(self):
-        if not self.rv_data:
+        totals = self.totals
+        if not totals or not totals["count"]:
             # reset labels cleanly
             self.average_label.text = ""
             self.total_amount_label.text = (
@@ -286,18 +263,18 @@ class HistoryView(BoxLayout):
             self.current_filter_label.text = f"Current Filter: {self.current_filter}"
             return
 
-        f = lambda key: sum(float(o.get(key, 0) or 0) for o in self.rv_data)
-        total_amount = f("total")
-        total_tax = f("tax")
-        total_with_tax = f("total_with_tax")
-        total_tendered = f("amount_tendered")
-        total_change = f("change_given")
-        total_cash = total_tendered - total_change
+        total_amount = totals["total"]
+        total_tax = totals["tax"]
+        total_with_tax = totals["total_with_tax"]
+        total_tendered = totals["amount_tendered"]
+        total_change = totals["change_given"]
+        total_cash = totals["cash"]
 
         if self.current_filter == "custom_range":
-            first = self.rv_data[0].get("date_range", [None])[0]
-            last = self.rv_data[0].get("date_range", [None])[-1]
-            num_days = self.rv_data[0].get("num_days") or 0
+            date_range = self.date_range or [None]
+            first = date_range[0]
+            last = date_range[-1]
+            num_days = self.num_days or 0
             avg_txt = ""
             if num_days:
                 avg_txt = f"Av: {float(total_with_tax) / num_days:.2f}"
@@ -315,48 +292,93 @@ class HistoryView(BoxLayout):
         self.total_amount_label.text = f"[size=20]Total: {total_amount:.2f} + {total_tax:.2f} tax = \n[b]${total_with_tax:.2f}[/b][/size]"
         self.total_cash_label.text = f"[size=20]Cash: {total_tendered:.2f} - {total_change:.2f} change = \n[b]${total_cash:.2f}[/b][/size]"
 
-    def is_today(self, dtobj):
-        return dtobj.date() == datetime.today().date()
-
-    def is_yesterday(self, dtobj):
-        return dtobj.date() == (datetime.today() - timedelta(days=1)).date()
-
-    def is_this_week(self, dtobj):
-        today = datetime.today()
-        start = today - timedelta(days=today.weekday())
-        end = start + timedelta(days=6)
-        return start.date() <= dtobj.date() <= end.date()
-
-    def is_this_month(self, dtobj):
-        today = datetime.today()
-        return dtobj.month == today.month and dtobj.year == today.year
+    def _fetch_page(self, after, limit):
+        if self._page_filter is None:
+            return []
+        return self.db_manager.get_order_history_page(
+            after=after, limit=limit, **self._page_filter
+        )
 
-    def _parse_dt(self, s):
-        return datetime.strptime(s, "%Y-%m-%d %H:%M:%S.%f")
+    def _show_first_page(self, page_filter, num_days=None, date_range=None):
+        # later pages are fetched as the list is scrolled towards its end
+        self._page_filter = page_filter
+        rows = self._fetch_page(None, HISTORY_PAGE_SIZE)
+        self._has_more = len(rows) == HISTORY_PAGE_SIZE
+        self._next_key = (rows[-1][6], rows[-1][0]) if rows else None
+        self.update_rv_data(rows, num_days=num_days, date_range=date_range)
+        self.rv.scroll_y = 1
+
+    def load_next_page(self, *_):
+        if not self._has_more:
+            return
+        rows = self._fetch_page(self._next_key, HISTORY_PAGE_SIZE)
+        self._has_more = len(rows) == HISTORY_PAGE_SIZE
+        if not rows:
+            return
+        self._next_key = (rows[-1][6], rows[-1][0])
+        page = [OrderRow(order) for order in rows]
+        self._keep_scroll_offset()
+        self.rv_data.extend(page)
+        self.rv.data.extend(page)
+
+    def _on_history_scroll(self, rv, scroll_y):
+        if self._has_more and scroll_y <= 0.1:
+            self._next_page_trigger()
+
+    def _keep_scroll_offset(self):
+        # appended rows grow the content; hold the rows on screen in place
+        # rather than letting the unchanged scroll_y fraction jump
+        lm = self.rv.layout_manager
+        if lm is None:
+            return
+        offset = (1 - self.rv.scroll_y) * max(0, lm.height - self.rv.height)
+
+        def restore(*_):
+            lm.unbind(height=restore)
+            scrollable = lm.height - self.rv.height
+            if scrollable > 0:
+                self.rv.scroll_y = max(0.0, 1 - offset / scrollable)
+
+        lm.bind(height=restore)
+
+    def iter_filtered_orders(self):
+        """Every order matching the current filter, newest first, a page at a time."""
+        after = None
+        while True:
+            rows = self._fetch_page(after, EXPORT_PAGE_SIZE)
+            yield from rows
+            if len(rows) < EXPORT_PAGE_SIZE:
+                return
+            after = (rows[-1][6], rows[-1][0])
+
+    def _load_range(self, start, end, num_days=None, date_range=None):
+        # the totals are a range scan on the timestamp index and the rows a
+        # single page, so the cost does not grow with the whole history
+        self.totals = self.db_manager.get_order_totals_between(start, end)
+        self._show_first_page(
+            {"start": start, "end": end}, num_days=num_days, date_range=date_range
+        )
+        self.update_totals()
 
     def filter_today(self):
         self.current_filter = "today"
-        fh = [o for o in self.order_history if self.is_today(self._parse_dt(o[6]))]
-        self.update_rv_data(fh)
-        self.update_totals()
+        today = date.today()
+        self._load_range(today, today + timedelta(days=1))
 
     def filter_yesterday(self):
         self.current_filter = "yesterday"
-        fh = [o for o in self.order_history if self.is_yesterday(self._parse_dt(o[6]))]
-        self.update_rv_data(fh)
-        self.update_totals()
+        today = date.today()
+        self._load_range(today - timedelta(days=1), today)
 
     def filter_this_week(self):
         self.current_filter = "this_week"
-        fh = [o for o in self.order_history if self.is_this_week(self._parse_dt(o[6]))]
-        self.update_rv_data(fh)
-        self.update_totals()
+        start = date.today() - timedelta(days=date.today().weekday())
+        self._load_range(start, start + timedelta(days=7))
 
     def filter_this_month(self):
         self.current_filter = "this_month"
-        fh = [o for o in self.order_history if self.is_this_month(self._parse_dt(o[6]))]
-        self.update_rv_data(fh)
-        self.update_totals()
+        start = date.today().replace(day=1)
+        self._load_range(start, (start + timedelta(days=32)).replace(day=1))
 
     def on_search_text_changed(self, instance, value):
         value = (value or "").strip()
@@ -367,13 +389,8 @@ class HistoryView(BoxLayout):
             self.filter_today()
 
     def search_order_by_item_name(self, term):
-        term = term.lower()
-        results = []
-        for order in self.order_history:
-            item_names = (order[1] or "").lower()
-            if term in item_names:
-                results.append(order)
-        self.update_rv_data(results)
+        self.totals = self.db_manager.get_order_totals_with_item(term)
+        self._show_first_page({"term": term})
         self.update_totals()
 
     def show_specific_day_popup(self):
@@ -383,10 +400,7 @@ class HistoryView(BoxLayout):
 
     def on_specific_day_selected(self, instance, value, date_range):
         self.current_filter = "specific_day"
-        target = value
-        fh = [o for o in self.order_history if self._parse_dt(o[6]).date() == target]
-        self.update_rv_data(fh)
-        self.update_totals()
+        self._load_range(value, value + timedelta(days=1))
 
     def show_custom_range_popup(self):
         picker = MDDatePicker(mode="range", min_year=2024)
@@ -395,16 +409,28 @@ class HistoryView(BoxLayout):
 
     def on_custom_range_selected(self, instance, value, date_range):
         self.current_filter = "custom_range"
-        date_set = set(date_range or [])
-        num_days = len(date_set)
-        fh = [o for o in self.order_history if self._parse_dt(o[6]).date() in date_set]
-        self.update_rv_data(fh, num_days=num_days, date_range=date_range or [])
-        self.update_totals()
+        date_range = date_range or []
+        if not date_range:
+            self.totals = None
+            self._page_filter = None
+            self._has_more = False
+            self.update_rv_data([], num_days=0, date_range=[])
+            self.update_totals()
+            return
+        # the picker returns every day of the (contiguous) range
+        num_days = len(set(date_range))
+        start, end = min(date_range), max(date_range)
+        self._load_range(
+            start, end + timedelta(days=1), num_days=num_days, date_range=date_range
+        )
 
-    def display_order_details(self, order_id):
+    def _displayed_order(self, order_id):
         oid = str(order_id)
+        return next((row.order for row in self.rv_data if str(row.order[0]) == oid), None)
+
+    def display_order_details(self, order_id):
         try:
-            specific = next((o for o in self.order_history if str(o[0]) == oid), None)
+            specific = self._displayed_order(order_id)
         except Exception as e:
             logger.warning(f"[HistoryManager] display_order_details\n{e}")
             specific = None
@@ -417,9 +443,7 @@ class HistoryView(BoxLayout):
                 logger.warning(e)
 
     def show_order_details(self, order_id):
-        specific = next(
-            (o for o in self.order_history if str(o[0]) == str(order_id)), None
-        )
+        specific = self._displayed_order(order_id)
         if specific:
             self.clear_widgets()
             try:
@@ -458,25 +482,23 @@ class HistoryView(BoxLayout):
 
     def export_history(self, *_):
         filename = self.get_export_filename()
-        rows = self.prepare_csv_data()
-        with open(filename, "w", newline="", encoding="utf-8") as f:
-            w = csv.writer(f)
-            w.writerow(
-                [
-                    "Order ID",
-                    "Items",
-                    "Total",
-                    "Tax",
-                    "Discount",
-                    "Total with Tax",
-                    "Timestamp",
-                    "Payment Method",
-                    "Amount Tendered",
-                    "Change Given",
-                ]
-            )
-            w.writerows(rows)
-        logger.info(f"[HistoryManager] Exported {len(rows)} rows to {filename}")
+        count = write_csv(
+            filename,
+            self.iter_csv_rows(),
+            [
+                "Order ID",
+                "Items",
+                "Total",
+                "Tax",
+                "Discount",
+                "Total with Tax",
+                "Timestamp",
+                "Payment Method",
+                "Amount Tendered",
+                "Change Given",
+            ],
+        )
+        logger.info(f"[HistoryManager] Exported {count} rows to {filename}")
 
     def get_export_filename(self):
         today = datetime.now().strftime("%Y-%m-%d")
@@ -493,22 +515,21 @@ class HistoryView(BoxLayout):
             return f"Order_History_Specific_Day_{today}.csv"
         return f"Order_History_All_{today}.csv"
 
-    def prepare_csv_data(self):
-        return [
-            [
-                o.get("order_id"),
-                o.get("items"),
-                o.get("total"),
-                o.get("tax"),
-                o.get("discount"),
-                o.get("total_with_tax"),
-                o.get("timestamp"),
-                o.get("payment_method"),
-                o.get("amount_tendered"),
-                o.get("change_given"),
+    def iter_csv_rows(self):
+        # rows are formatted and written one export page at a time
+        for order in self.iter_filtered_orders():
+            yield [
+                str(order[0]),
+                self.format_items(order[1]),
+                self.format_money(order[2]),
+                self.format_money(order[3]),
+                self.format_money(order[4]),
+                self.format_money(order[5]),
+                self.format_date(order[6]),
+                order[7],
+                self.format_money(order[8]),
+                self.format_money(order[9]),
             ]
-            for o in self.rv_data
-        ]
 
 
 class HistoryPopup(Popup):
@@ -530,8 +551,6 @@ class HistoryPopup(Popup):
         )  # keep a single view to preserve filters between opens
 
     def show_hist_reporting_popup(self, instance=None):
-        order_history = self.db_manager.get_order_history()
-        self.history_view.show_reporting_popup(order_history)
         self.history_view.filter_today()
         self.content = self.history_view
         self.size_hint = (0.9, 0.9)
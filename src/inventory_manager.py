@@ -1,6 +1,5 @@
 import re
 import unicodedata
-from math import log1p
 
 from kivy.app import App
 from kivy.clock import Clock
@@ -19,6 +18,10 @@ from kivymd.uix.button import MDRaisedButton, MDFlatButton
 from kivymd.toast import toast
 
 from database_manager import DatabaseManager
+from item_catalog import RELOADED, row_key
+from search_index import SearchIndex
+from search_worker import get_search_worker
+from row_models import ItemRow
 import logging
 
 logger = logging.getLogger("rigs_pos")
@@ -122,16 +125,19 @@ class InventoryRow(RecycleDataViewBehavior, BoxLayout):
         self._bg_color_instr.rgba = self.bg_color
 
     def refresh_view_attrs(self, rv, index, data):
-        res = super().refresh_view_attrs(rv, index, data)
+        item = data.item
+        self.barcode = str(item[0])
+        self.name = item[1] or ""
+        self.price = str(item[2])
         self.row_index = index
         self.bg_color = [1, 1, 1, 1] if (index % 2 == 0) else [0.96, 0.96, 0.96, 1]
 
         self._on_name(self, self.name)
         self._on_price(self, self.price)
 
-        if "order_manager" in data and data["order_manager"] is not None:
-            self.order_manager = data["order_manager"]
-        return res
+        context = getattr(rv, "row_context", None)
+        if context is not None:
+            self.order_manager = context.order_manager
 
     def _on_name(self, *_):
         name = self.name or ""
@@ -355,10 +361,14 @@ class InventoryView(BoxLayout):
         self.app = self.order_manager.app
 
         self.full_inventory = []
-        self._search_cache = []
+        # the index and popularity map are only touched on the search worker
+        self._search = get_search_worker().channel("inventory")
+        self._search_index = SearchIndex(limit=200, fuzzy=True)
         self._popularity_norm = {}
 
         self._filter_ev = None
+        self._inventory_stale = False
+        self._refilter_trigger = Clock.create_trigger(self._refilter, 0.05)
         self._last_query_norm = ""
 
         top = BoxLayout(size_hint_y=None, height=dp(32), spacing=5)
@@ -378,30 +388,54 @@ class InventoryView(BoxLayout):
         self.rv.add_widget(layout)
 
         self.rv.viewclass = InventoryRow
+        self.rv.row_context = self
         self.add_widget(self.rv)
 
         self.refresh_from_app_cache()
+        self.app.db_manager.catalog.subscribe(self._on_catalog_change)
 
     def refresh_from_app_cache(self):
         self.full_inventory = list(self.app.inventory_cache or [])
+        items = self.full_inventory
+        self._search.call(lambda: self._rebuild_index(items))
+        self._apply_filter_now(self._last_query_norm)
 
+    def _rebuild_index(self, items):
         pop_raw = self.app.db_manager.get_item_popularity_by_name()
         self._popularity_norm = {normalize_name(k): float(v) for k, v in pop_raw.items()}
 
-        self._search_cache = []
-        for item in self.full_inventory:
-            name = "" if item[1] is None else str(item[1])
-            n_name = normalize_name(name)
-            tokens = n_name.split()
-            sold = float(self._popularity_norm.get(n_name, 0.0))
-            self._search_cache.append(
-                {"item": item, "name": name, "n_name": n_name, "tokens": tokens, "sold": sold}
-            )
-
+        self._search_index.clear()
+        for item in items:
+            self._search_index.add(row_key(item), self._search_entry(item))
+
+    def _search_entry(self, item):
+        name = "" if item[1] is None else str(item[1])
+        n_name = normalize_name(name)
+        tokens = n_name.split()
+        sold = float(self._popularity_norm.get(n_name, 0.0))
+        return {"item": item, "name": name, "n_name": n_name, "tokens": tokens, "sold": sold}
+
+    def _on_catalog_change(self, event, row, previous):
+        if event == RELOADED:
+            self.refresh_from_app_cache()
+            return
+        self._search.call(lambda: self._patch_index(row, previous))
+        self._inventory_stale = True
+        self._refilter_trigger()
+
+    def _refilter(self, dt):
+        if self._inventory_stale:
+            # once per batch of catalog events; the snapshot is shared with
+            # Utilities.update_inventory_cache and never mutated
+            self._inventory_stale = False
+            self.full_inventory = self.app.db_manager.catalog.rows()
         self._apply_filter_now(self._last_query_norm)
 
-    def _generate_data(self, items):
-        return [{"barcode": str(item[0]), "name": item[1], "price": str(item[2])} for item in items]
+    def _patch_index(self, row, previous):
+        if row is None:
+            self._search_index.remove(row_key(previous))
+        else:
+            self._search_index.add(row_key(row), self._search_entry(row))
 
     def _on_search_text(self, _, text):
         self._last_query_norm = normalize_name(text or "")
@@ -411,72 +445,21 @@ class InventoryView(BoxLayout):
 
     def _apply_filter_now(self, query_norm: str):
         if not query_norm:
-            data = self._generate_data(self.full_inventory)
-            for d in data:
-                d["order_manager"] = self.order_manager
-            self.rv.data = data
-            return
-
-        q_tokens = query_norm.split()
-
-        if len(q_tokens) == 1 and len(query_norm) <= 2:
-            q = q_tokens[0]
-            hits = []
-            for r in self._search_cache:
-                if any(t.startswith(q) for t in r["tokens"]):
-                    hits.append((r["sold"], r["name"], r["item"]))
-            hits.sort(key=lambda x: (-x[0], x[1]))
-            filtered = [it for _, _, it in hits[:200]]
-            data = self._generate_data(filtered)
-            for d in data:
-                d["order_manager"] = self.order_manager
-            self.rv.data = data
+            items = self.full_inventory
+            self._search.submit(lambda: self._row_data(items), self._set_rv_data)
             return
 
-        scored = []
-        for r in self._search_cache:
-            m = self._match_prefixes(r["tokens"], q_tokens)
-            if m is None:
-                continue
-
-            quality = 0.0
-            for q, (i, tok) in zip(q_tokens, m):
-                completion = len(q) / max(1, len(tok))
-                quality += 100.0 * completion - 2.0 * i
-
-            if r["n_name"].startswith(query_norm):
-                quality += 15.0
-
-            final = quality * 1000.0 + 2500.0 * log1p(r["sold"])
-            scored.append((final, r["sold"], r["name"], r["item"]))
+        self._search.submit(
+            lambda: self._row_data(self._search_index.search(query_norm)),
+            self._set_rv_data,
+        )
 
-        scored.sort(key=lambda x: (-x[0], -x[1], x[2]))
+    def _row_data(self, items):
+        return [ItemRow(item) for item in items]
 
-        filtered = [it for _, _, _, it in scored[:200]]
-        data = self._generate_data(filtered)
-        for d in data:
-            d["order_manager"] = self.order_manager
+    def _set_rv_data(self, data):
         self.rv.data = data
 
-    def _match_prefixes(self, tokens, q_tokens):
-        used = set()
-        matches = []
-        for q in q_tokens:
-            best_i = None
-            best_tok = None
-            for i, tok in enumerate(tokens):
-                if i in used:
-                    continue
-                if tok.startswith(q):
-                    if best_i is None or i < best_i or (i == best_i and len(tok) < len(best_tok)):
-                        best_i = i
-                        best_tok = tok
-            if best_i is None:
-                return None
-            used.add(best_i)
-            matches.append((best_i, best_tok))
-        return matches
-
 
 class InventoryManagementView(BoxLayout):
     barcode = StringProperty()
@@ -495,8 +478,10 @@ class InventoryManagementView(BoxLayout):
 
         self.app = App.get_running_app()
         self.database_manager = DatabaseManager("db/inventory.db", None)
+        # the filter table and last-filter state belong to the search worker
+        self._search = get_search_worker().channel("inventory_manager")
         self.inventory_view = InventoryView(self.app.order_manager)
-        self.full_inventory = self.database_manager.get_all_items()
+        self.show_inventory_for_manager(self.database_manager.catalog.rows())
 
         bar = BoxLayout(size_hint_y=None, height=dp(48), spacing=5)
         self.inv_search_input = TextInput(
@@ -540,10 +525,11 @@ class InventoryManagementView(BoxLayout):
 
     def handle_scanned_barcode(self, barcode):
         barcode = barcode.strip()
-        items = self.database_manager.get_all_items()
-        if any(item[0] == barcode for item in items):
+        catalog = self.database_manager.catalog
+        if catalog.by_barcode(barcode):
             Clock.schedule_once(lambda dt: self.update_search_input(barcode), 0.1)
             return
+        items = catalog.rows()
         for item in items:
             if (
                 item[0][1:] == barcode
@@ -563,10 +549,27 @@ class InventoryManagementView(BoxLayout):
 
     def show_inventory_for_manager(self, inventory_items):
         self.full_inventory = inventory_items
+        self._search.call(lambda: self._reset_filter(inventory_items))
+
+    def _reset_filter(self, inventory_items):
+        self._filter_source = inventory_items
+        self._filter_rows = None
+        self._last_filter = None
+
+    def _filter_table(self):
+        if self._filter_rows is None:
+            rows = []
+            barcodes = {}
+            for pos, item in enumerate(self._filter_source):
+                rows.append((pos, (item[1] or "").lower(), item))
+                barcodes.setdefault(str(item[0]).lower(), []).append((pos, item))
+            self._filter_rows = rows
+            self._filter_barcodes = barcodes
+        return self._filter_rows
 
     def refresh_inventory(self, query=None):
         query = self.inv_search_input.text
-        updated_inventory = self.database_manager.get_all_items()
+        updated_inventory = self.database_manager.catalog.rows()
         self.show_inventory_for_manager(updated_inventory)
         Clock.schedule_once(
             lambda dt: self.filter_inventory(query if query else None), 0.1
@@ -598,8 +601,6 @@ class InventoryManagementView(BoxLayout):
                     product_category=product_category,
                 )
                 self.product_category = product_category or ""
-                self.app.utilities.update_inventory_cache()
-                self.inventory_view.refresh_from_app_cache()
                 self.refresh_label_inventory_for_dual_pane_mode()
             except Exception as e:
                 logger.warning(e)
@@ -609,7 +610,9 @@ class InventoryManagementView(BoxLayout):
             self.app.popup_manager.view_container.remove_widget(
                 self.app.popup_manager.label_printing_view
             )
-            inventory = self.app.inventory_cache
+            # runs straight after a save, before the deferred inventory_cache
+            # refresh
+            inventory = self.app.db_manager.catalog.rows()
             self.app.popup_manager.label_printing_view.show_inventory_for_label_printing(
                 inventory
             )
@@ -656,17 +659,34 @@ class InventoryManagementView(BoxLayout):
         ]
 
     def filter_inventory(self, query):
+        self._search.submit(
+            lambda: self._generate_data_for_rv(self._filtered_items(query)),
+            self._set_rv_data,
+        )
+
+    def _set_rv_data(self, data):
+        self.rv.data = data
+
+    def _filtered_items(self, query):
         if query:
             query = query.lower()
-            filtered = []
-            for item in self.full_inventory:
-                barcode = str(item[0]).lower()
-                name = (item[1] or "").lower()
-                if query == barcode or query in name:
-                    filtered.append(item)
+            rows = self._filter_table()
+            last = self._last_filter
+            if last is not None and query.startswith(last[0]):
+                # a name containing the longer query contains the shorter one
+                rows = last[1]
+            name_hits = [row for row in rows if query in row[1]]
+            self._last_filter = (query, name_hits)
+            filtered = [item for _, _, item in name_hits]
+            barcode_hits = self._filter_barcodes.get(query)
+            if barcode_hits:
+                hits = {pos: item for pos, _, item in name_hits}
+                hits.update(barcode_hits)
+                filtered = [hits[pos] for pos in sorted(hits)]
         else:
-            filtered = self.full_inventory
-        self.rv.data = self._generate_data_for_rv(filtered)
+            self._last_filter = None
+            filtered = self._filter_source
+        return filtered
 
     def _on_search_text(self, _, text):
         self.filter_inventory(text)
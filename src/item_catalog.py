@@ -0,0 +1,181 @@
+import threading
+import weakref
+import logging
+
+from db_statements import ITEM_ROW_COLUMNS
+
+logger = logging.getLogger("rigs_pos")
+
+# Row layout shared with DatabaseManager.get_all_items
+COLUMNS = tuple(column.strip() for column in ITEM_ROW_COLUMNS.split(","))
+BARCODE, NAME, PRICE, COST, SKU, PRODUCT_CATEGORY, ITEM_ID = range(7)
+EAN_BARCODE = 12
+
+ADDED = "added"
+UPDATED = "updated"
+REMOVED = "removed"
+RELOADED = "reloaded"
+
+
+def row_key(row):
+    """Identity of an items row: its item_id, or (barcode, sku) for legacy rows without one."""
+    item_id = row[ITEM_ID]
+    if item_id not in (None, ""):
+        return str(item_id)
+    return (row[BARCODE], row[SKU])
+
+
+def _clean(value):
+    return str(value).strip() if value not in (None, "") else None
+
+
+class ItemCatalog:
+    """In-process copy of the items table, kept in step with DatabaseManager writes.
+
+    Rows are stored exactly as get_all_items returns them. Lookups by item_id,
+    barcode and EAN are dict hits; barcode and EAN map to lists because the
+    table allows several items per barcode. Subscribers are called with
+    ``(event, row, previous)`` after every change and are held weakly when they
+    are bound methods, so short-lived views do not need to unsubscribe.
+    """
+
+    def __init__(self, rows=()):
+        self._lock = threading.RLock()
+        self._subscribers = []
+        self._load(rows)
+
+    def _load(self, rows):
+        with self._lock:
+            self._rows = {}
+            self._by_barcode = {}
+            self._by_ean = {}
+            self._snapshot = None
+            for row in rows:
+                self._insert(tuple(row))
+
+    def _index(self, mapping, value, key):
+        if value is not None:
+            mapping.setdefault(value, []).append(key)
+
+    def _unindex(self, mapping, value, key):
+        keys = mapping.get(value)
+        if not keys:
+            return
+        try:
+            keys.remove(key)
+        except ValueError:
+            return
+        if not keys:
+            del mapping[value]
+
+    def _insert(self, row):
+        key = row_key(row)
+        self._rows[key] = row
+        self._index(self._by_barcode, _clean(row[BARCODE]), key)
+        self._index(self._by_ean, _clean(row[EAN_BARCODE]), key)
+        return key
+
+    def _discard(self, key):
+        row = self._rows.pop(key, None)
+        if row is not None:
+            self._unindex(self._by_barcode, _clean(row[BARCODE]), key)
+            self._unindex(self._by_ean, _clean(row[EAN_BARCODE]), key)
+        return row
+
+    def __len__(self):
+        return len(self._rows)
+
+    def rows(self):
+        """All rows in load/insert order. The list is shared; do not mutate it."""
+        with self._lock:
+            if self._snapshot is None:
+                self._snapshot = list(self._rows.values())
+            return self._snapshot
+
+    def get(self, item_id):
+        return self._rows.get(str(item_id)) if item_id not in (None, "") else None
+
+    def by_barcode(self, barcode):
+        keys = self._by_barcode.get(_clean(barcode), ())
+        return [self._rows[key] for key in keys]
+
+    def by_ean(self, ean):
+        keys = self._by_ean.get(_clean(ean), ())
+        return [self._rows[key] for key in keys]
+
+    def reload(self, rows):
+        self._load(rows)
+        self._publish(RELOADED, None, None)
+
+    def upsert(self, row):
+        row = tuple(row)
+        key = row_key(row)
+        with self._lock:
+            previous = self._rows.get(key)
+            if previous is not None:
+                # unindex only, so an edited item keeps its place in rows()
+                self._unindex(self._by_barcode, _clean(previous[BARCODE]), key)
+                self._unindex(self._by_ean, _clean(previous[EAN_BARCODE]), key)
+            self._insert(row)
+            self._snapshot = None
+        self._publish(UPDATED if previous is not None else ADDED, row, previous)
+
+    def update_fields(self, item_id, **fields):
+        row = self.get(item_id)
+        if row is None:
+            return False
+        values = list(row)
+        for column, value in fields.items():
+            values[COLUMNS.index(column)] = value
+        self.upsert(values)
+        return True
+
+    def remove(self, item_id):
+        with self._lock:
+            row = self._discard(str(item_id))
+            if row is None:
+                return False
+            self._snapshot = None
+        self._publish(REMOVED, None, row)
+        return True
+
+    def remove_by_name(self, name):
+        with self._lock:
+            doomed = [key for key, row in self._rows.items() if row[NAME] == name]
+            removed = [self._discard(key) for key in doomed]
+            if removed:
+                self._snapshot = None
+        for row in removed:
+            self._publish(REMOVED, None, row)
+        return len(removed)
+
+    def subscribe(self, callback):
+        if hasattr(callback, "__self__") and hasattr(callback, "__func__"):
+            ref = weakref.WeakMethod(callback)
+        else:
+            ref = lambda callback=callback: callback
+        with self._lock:
+            self._subscribers.append(ref)
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            self._subscribers = [
+                ref for ref in self._subscribers if ref() not in (None, callback)
+            ]
+
+    def _publish(self, event, row, previous):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        dead = False
+        for ref in subscribers:
+            callback = ref()
+            if callback is None:
+                dead = True
+                continue
+            try:
+                callback(event, row, previous)
+            except Exception as e:
+                logger.error(f"[ItemCatalog] subscriber failed on {event}: {e}")
+        if dead:
+            with self._lock:
+                self._subscribers = [ref for ref in self._subscribers if ref() is not None]
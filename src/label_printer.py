@@ -34,6 +34,8 @@ from kivymd.uix.button import MDFlatButton, MDIconButton, MDRaisedButton
 from kivymd.uix.label import MDLabel
 from kivymd.uix.recycleview import RecycleView
 
+from search_worker import get_search_worker
+
 logger = logging.getLogger("rigs_pos")
 
 
@@ -324,6 +326,7 @@ class LabelPrintingView(BoxLayout):
         self.full_inventory = []
         self.dual_pane_mode = False
         self.print_queue_popup = None
+        self._search = get_search_worker().channel("label_printing")
 
         self.print_queue_ref = self
 
@@ -383,6 +386,7 @@ class LabelPrintingView(BoxLayout):
     def show_inventory_for_label_printing(self, inventory_items, dual_pane_mode=False):
         self.full_inventory = inventory_items or []
         self.dual_pane_mode = bool(dual_pane_mode)
+        self._search.cancel()
         self.rv.data = self.generate_data_for_rv(
             self.full_inventory, self.dual_pane_mode
         )
@@ -636,18 +640,24 @@ class LabelPrintingView(BoxLayout):
 
     def filter_inventory(self, query="", dual_pane_mode=False):
         q = (query or "").lower()
-        filtered = (
-            self.full_inventory
-            if not q
-            else [
-                it
-                for it in self.full_inventory
-                if q in str(it[0]).lower() or q in (it[1] or "").lower()
-            ]
-        )
-        self.rv.data = self.generate_data_for_rv(
-            filtered, dual_pane_mode=dual_pane_mode
-        )
+        items = self.full_inventory
+
+        def compute():
+            filtered = (
+                items
+                if not q
+                else [
+                    it
+                    for it in items
+                    if q in str(it[0]).lower() or q in (it[1] or "").lower()
+                ]
+            )
+            return self.generate_data_for_rv(filtered, dual_pane_mode=dual_pane_mode)
+
+        self._search.submit(compute, self._set_rv_data)
+
+    def _set_rv_data(self, data):
+        self.rv.data = data
 
     def _on_search_text(self, _inst, value):
         self.filter_inventory(value, self.dual_pane_mode)
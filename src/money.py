@@ -0,0 +1,68 @@
+from decimal import Decimal, ROUND_HALF_UP
+from functools import lru_cache
+
+# Money is computed in integer cents. Floats only appear at the edges: the
+# dollar values callers pass in, and the dollar mirrors kept for display,
+# JSON and the REAL columns. A float is only trusted to round itself when it
+# is clear of a half cent; otherwise the value goes through Decimal on its
+# shortest repr, so 19.95 is 1995 cents and 1.005 rounds to 101.
+
+_HUNDRED = Decimal(100)
+
+
+def round_half_up(value):
+    """Nearest integer to a Decimal, halves away from zero."""
+    return int(value.to_integral_value(rounding=ROUND_HALF_UP))
+
+
+def _round_clear(x):
+    """``x`` rounded half up, or None when it is too close to a half to trust a float."""
+    whole = int(x)
+    frac = abs(x - whole)
+    if abs(frac - 0.5) < 1e-6:
+        return None
+    if frac > 0.5:
+        return whole + 1 if x > 0 else whole - 1
+    return whole
+
+
+def to_cents(value):
+    """Dollar amount (float, int, str or Decimal) as integer cents; None and "" are 0."""
+    if value is None or value == "":
+        return 0
+    if isinstance(value, int):
+        return value * 100
+    if isinstance(value, float):
+        cents = _round_clear(value * 100)
+        if cents is not None:
+            return cents
+    if not isinstance(value, Decimal):
+        value = Decimal(str(value).strip())
+    return round_half_up(value * _HUNDRED)
+
+
+def from_cents(cents):
+    """Integer cents as the float dollar value closest to them."""
+    return cents / 100
+
+
+@lru_cache(maxsize=64)
+def as_decimal(value):
+    """Decimal for a rate or factor; cached, since the same few come up on every scan."""
+    return Decimal(str(value))
+
+
+def scale_cents(cents, factor):
+    """``cents * factor`` rounded to a whole cent, for tax rates and percentages."""
+    if isinstance(factor, float):
+        scaled = _round_clear(cents * factor)
+        if scaled is not None:
+            return scaled
+    if not isinstance(factor, Decimal):
+        factor = as_decimal(factor)
+    return round_half_up(cents * factor)
+
+
+def sum_money(values):
+    """Exact sum of dollar amounts, returned in dollars."""
+    return from_cents(sum(to_cents(v) for v in values))
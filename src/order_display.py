@@ -0,0 +1,137 @@
+import logging
+
+from kivymd.uix.boxlayout import BoxLayout, MDBoxLayout
+from kivymd.uix.button import MDFlatButton
+from kivymd.uix.gridlayout import GridLayout
+from kivymd.uix.label import MDLabel
+
+logger = logging.getLogger("rigs_pos")
+
+
+class MarkupLabel(MDLabel):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.markup = True
+
+
+def order_line_texts(line):
+    """(item, quantity, price) display text for a LineItem, or None if it has no usable total."""
+    if not isinstance(line.total_price, (int, float)):
+        return None
+    quantity = line.quantity
+    if line.line_discount_total > 0:
+        price_times_quantity = line.unit_price * quantity
+        price_text = (
+            f"${price_times_quantity:.2f} - {line.line_discount_total:.2f}\n = ${line.total_price:.2f}"
+        )
+    else:
+        price_text = f"${line.total_price:.2f}"
+    quantity_text = f"{quantity}" if quantity > 1 else ""
+    return (f"{line.name}", quantity_text, price_text)
+
+
+class OrderLineWidget(MDFlatButton):
+    """One order line: name, quantity and price over a divider."""
+
+    def __init__(self, item_id, on_press, **kwargs):
+        super().__init__(size_hint=(1, 1), **kwargs)
+        self.item_id = item_id
+        self.texts = None
+
+        item_layout = GridLayout(orientation="lr-tb", cols=3, rows=2, size_hint=(1, 1))
+
+        item_label_container = BoxLayout(size_hint_x=None, width=550)
+        self.item_label = MarkupLabel()
+        item_label_container.add_widget(self.item_label)
+
+        price_label_container = BoxLayout(size_hint_x=None, width=150)
+        self.price_label = MarkupLabel(halign="right")
+        price_label_container.add_widget(self.price_label)
+
+        quantity_label_container = BoxLayout(size_hint_x=None, width=50)
+        self.quantity_label = MarkupLabel()
+        quantity_label_container.add_widget(self.quantity_label)
+
+        item_layout.add_widget(item_label_container)
+        item_layout.add_widget(quantity_label_container)
+        item_layout.add_widget(price_label_container)
+        for _ in range(3):
+            blue_line = MDBoxLayout(size_hint_x=1, size_hint_y=None, height=1)
+            blue_line.md_bg_color = (0.56, 0.56, 1, 1)
+            item_layout.add_widget(blue_line)
+
+        self.add_widget(item_layout)
+        self.bind(on_press=lambda button: on_press(self.item_id, button))
+
+    def set_texts(self, texts):
+        item_text, quantity_text, price_text = texts
+        self.item_label.text = f"[size=20]{item_text}[/size]"
+        self.quantity_label.text = f"[size=20]{quantity_text}[/size]"
+        self.price_label.text = f"[size=20]{price_text}[/size]"
+        self.texts = texts
+
+
+class OrderDisplay:
+    """Keeps order_layout in step with the current order, one widget per line.
+
+    ``update`` builds widgets only for lines that are new, sets label text
+    only on lines whose text changed and removes lines that are gone, so a
+    scan touches one row whatever the size of the order. Rows are re-added
+    in bulk only when the order of lines itself changes, as when a saved
+    order is loaded.
+    """
+
+    def __init__(self, layout, on_press):
+        self.layout = layout
+        self.on_press = on_press
+        self._rows = {}
+        self._shown = []
+        self.rows_built = 0
+        self.rows_updated = 0
+
+    def clear(self):
+        self.layout.clear_widgets()
+        self._rows = {}
+        self._shown = []
+
+    def update(self, items):
+        if len(self.layout.children) != len(self._shown):
+            # something cleared or filled the layout behind our back
+            self.clear()
+
+        wanted = []
+        for item_id, line in items.items():
+            texts = order_line_texts(line)
+            if texts is None:
+                break
+            row = self._rows.get(item_id)
+            if row is None:
+                row = self._rows[item_id] = OrderLineWidget(item_id, self.on_press)
+                self.rows_built += 1
+            if row.texts != texts:
+                row.set_texts(texts)
+                self.rows_updated += 1
+            wanted.append(item_id)
+
+        if wanted == self._shown:
+            return
+
+        keep = set(wanted)
+        shown = []
+        for item_id in self._shown:
+            if item_id in keep:
+                shown.append(item_id)
+            else:
+                self.layout.remove_widget(self._rows.pop(item_id))
+
+        if wanted[: len(shown)] == shown:
+            # the usual case: lines were appended and/or removed
+            for item_id in wanted[len(shown):]:
+                self.layout.add_widget(self._rows[item_id])
+        else:
+            self.layout.clear_widgets()
+            for item_id in wanted:
+                self.layout.add_widget(self._rows[item_id])
+        for item_id in set(self._rows) - keep:
+            del self._rows[item_id]
+        self._shown = wanted
@@ -1,10 +1,12 @@
 import uuid
 import json
 import os
-import math
+from datetime import datetime
 from dataclasses import dataclass, field
-from typing import Any, Dict, List, Optional
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Tuple
 
+from money import as_decimal, from_cents, round_half_up, scale_cents, to_cents
 from open_cash_drawer import open_cash_drawer
 
 import logging
@@ -54,11 +56,14 @@ class LineItem:
 
     discounts: List[Discount] = field(default_factory=list)
 
-    # computed
+    # computed; the *_cents fields are exact and the floats mirror them
     line_subtotal: float = 0.0
     line_discount_total: float = 0.0
     total_price: float = 0.0
     line_cost: float = 0.0
+    line_subtotal_cents: int = 0
+    line_discount_cents: int = 0
+    total_price_cents: int = 0
 
     def recompute(self) -> None:
         price = float(self.unit_price)
@@ -71,9 +76,11 @@ class LineItem:
 
         self.unit_cost = float(self.unit_cost) if self.unit_cost is not None else None
 
-        subtotal = price * qty
+        price_cents = to_cents(price)
+        subtotal = price_cents * qty
 
-        disc_total = 0.0
+        # exact until the single rounding to cents at the end of the line
+        disc_total = Decimal(0)
         for d in self.discounts:
             if d.type == "percent":
                 pct = float(d.value)
@@ -81,21 +88,25 @@ class LineItem:
                     pct = 0.0
                 if pct > 100.0:
                     pct = 100.0
-                disc_total += price * (pct / 100.0) * qty
+                disc_total += subtotal * as_decimal(pct) / 100
             elif d.type == "amount":
-                amt = float(d.value)
+                amt = to_cents(d.value)
                 disc_total += (amt * qty) if d.per_unit else amt
             else:
                 raise ValueError(f"Unknown discount type: {d.type!r}")
 
-        if disc_total < 0.0:
-            disc_total = 0.0
-        if disc_total > subtotal:
-            disc_total = subtotal
-
-        self.line_subtotal = float(subtotal)
-        self.line_discount_total = float(disc_total)
-        self.total_price = float(subtotal - disc_total)
+        disc_cents = round_half_up(disc_total)
+        if disc_cents < 0:
+            disc_cents = 0
+        if disc_cents > subtotal:
+            disc_cents = subtotal
+
+        self.line_subtotal_cents = subtotal
+        self.line_discount_cents = disc_cents
+        self.total_price_cents = subtotal - disc_cents
+        self.line_subtotal = from_cents(subtotal)
+        self.line_discount_total = from_cents(disc_cents)
+        self.total_price = from_cents(self.total_price_cents)
         self.line_cost = (
             float(self.unit_cost) * qty if self.unit_cost is not None else 0.0
         )
@@ -189,22 +200,106 @@ class Order:
     amount_tendered: float = 0.0
     change_given: float = 0.0
 
+    # exact totals; the float fields above mirror them
+    subtotal_cents: int = 0
+    line_item_discount_cents: int = 0
+    total_discount_cents: int = 0
+    total_cents: int = 0
+    tax_cents: int = 0
+    total_with_tax_cents: int = 0
+
+    # line item_id -> (line_subtotal_cents, line_discount_cents) as last
+    # summed into subtotal_cents / line_item_discount_cents
+    _line_sums: Dict[str, Tuple[int, int]] = field(
+        default_factory=dict, init=False, repr=False, compare=False
+    )
+
+    # With self_check on (or RIGS_ORDER_TOTALS_SELF_CHECK set) every
+    # incremental update is compared against a full recompute.
+    self_check = bool(os.environ.get("RIGS_ORDER_TOTALS_SELF_CHECK"))
+
     def recalculate_totals(self) -> float:
+        """Recompute every line and re-sum the order from scratch."""
         for item in self.items.values():
             item.recompute()
 
-        self.subtotal = sum(float(it.line_subtotal) for it in self.items.values())
-        self.line_item_discount_total = sum(float(it.line_discount_total) for it in self.items.values())
+        self._line_sums = {
+            item_id: (it.line_subtotal_cents, it.line_discount_cents)
+            for item_id, it in self.items.items()
+        }
+        self.subtotal_cents = sum(sub for sub, _ in self._line_sums.values())
+        self.line_item_discount_cents = sum(disc for _, disc in self._line_sums.values())
 
-        self.total_discount = float(self.order_level_discount) + float(self.line_item_discount_total)
-        self.total = max(self.subtotal - self.total_discount, 0.0)
+        self.refresh_totals()
+        return self.total
 
+    def put_line(self, line: LineItem) -> None:
+        self.items[line.item_id] = line
+        self.line_changed(line.item_id)
+
+    def line_changed(self, item_id: str) -> None:
+        """Recompute one line and move the order totals by its difference."""
+        line = self.items[item_id]
+        line.recompute()
+        old_sub, old_disc = self._line_sums.get(item_id, (0, 0))
+        new_sub, new_disc = line.line_subtotal_cents, line.line_discount_cents
+        self._line_sums[item_id] = (new_sub, new_disc)
+        self.subtotal_cents += new_sub - old_sub
+        self.line_item_discount_cents += new_disc - old_disc
+        self.refresh_totals()
+
+    def remove_line(self, item_id: str) -> None:
+        self.items.pop(item_id, None)
+        old_sub, old_disc = self._line_sums.pop(item_id, (0, 0))
+        self.subtotal_cents -= old_sub
+        self.line_item_discount_cents -= old_disc
+        self.refresh_totals()
+
+    def refresh_totals(self) -> float:
+        """Derive discount, total and tax from the running line sums."""
+        if self.self_check:
+            self._check_totals()
+        self.total_discount_cents = to_cents(self.order_level_discount) + self.line_item_discount_cents
+        self.total_cents = max(self.subtotal_cents - self.total_discount_cents, 0)
+
+        self.subtotal = from_cents(self.subtotal_cents)
+        self.line_item_discount_total = from_cents(self.line_item_discount_cents)
+        self.total_discount = from_cents(self.total_discount_cents)
+        self.total = from_cents(self.total_cents)
         self._update_total_with_tax()
         return self.total
 
+    def _check_totals(self) -> None:
+        subtotal = 0
+        line_discounts = 0
+        for item in self.items.values():
+            item.recompute()
+            subtotal += item.line_subtotal_cents
+            line_discounts += item.line_discount_cents
+        if (
+            self._line_sums.keys() != self.items.keys()
+            or subtotal != self.subtotal_cents
+            or line_discounts != self.line_item_discount_cents
+        ):
+            logger.error(
+                f"[Order] running totals drifted: subtotal {self.subtotal_cents} vs {subtotal} cents, "
+                f"line discounts {self.line_item_discount_cents} vs {line_discounts} cents"
+            )
+            self._line_sums = {
+                item_id: (it.line_subtotal_cents, it.line_discount_cents)
+                for item_id, it in self.items.items()
+            }
+            self.subtotal_cents = subtotal
+            self.line_item_discount_cents = line_discounts
+
+    def tax_for(self, total_cents: int) -> int:
+        return max(scale_cents(total_cents, self.tax_rate), 0)
+
     def _update_total_with_tax(self) -> None:
-        self.tax_amount = max(self.total * self.tax_rate, 0.0)
-        self.total_with_tax = self.total + self.tax_amount
+        self.tax_cents = self.tax_for(self.total_cents)
+        self.total_with_tax_cents = self.total_cents + self.tax_cents
+        self.tax_amount = from_cents(self.tax_cents)
+        self.total_with_tax = from_cents(self.total_with_tax_cents)
 
     def calculate_total_with_tax(self) -> Optional[float]:
         self._update_total_with_tax()
@@ -212,6 +307,13 @@ class Order:
 
     def clear(self) -> None:
         self.items = {}
+        self._line_sums = {}
+        self.subtotal_cents = 0
+        self.line_item_discount_cents = 0
+        self.total_discount_cents = 0
+        self.total_cents = 0
+        self.tax_cents = 0
+        self.total_with_tax_cents = 0
         self.subtotal = 0.0
         self.total = 0.0
         self.tax_amount = 0.0
@@ -283,8 +385,7 @@ class OrderManager:
 
         self.app = ref
 
-        if not os.path.exists(self.saved_orders_dir):
-            os.makedirs(self.saved_orders_dir)
+        self._import_saved_order_files()
 
         self._init = True
 
@@ -348,7 +449,7 @@ class OrderManager:
         return self.order.total_with_tax
 
     def update_tax_amount(self):
-        self.order.tax_amount = max(self.order.total * self.order.tax_rate, 0.0)
+        self.order._update_total_with_tax()
         return self.order.tax_amount
 
     def add_line_discount(self, item_id, value, percent=False, per_unit=True):
@@ -359,17 +460,17 @@ class OrderManager:
                 per_unit=bool(per_unit),
             )
             self.order.items[item_id].add_discount(d)
-            self.recalculate_order_totals()
+            self.order.line_changed(item_id)
 
     def clear_line_discounts(self, item_id):
         if item_id in self.order.items:
             self.order.items[item_id].clear_discounts()
-            self.recalculate_order_totals()
+            self.order.line_changed(item_id)
 
     def increment_last_line_discount(self, item_id, delta):
         if item_id in self.order.items:
             self.order.items[item_id].increment_last_discount(float(delta))
-            self.recalculate_order_totals()
+            self.order.line_changed(item_id)
 
     def decrement_last_line_discount(self, item_id, delta):
         self.increment_last_line_discount(item_id, -float(delta))
@@ -377,16 +478,14 @@ class OrderManager:
     def remove_item(self, item_name):
         item_to_remove = next((key for key, value in self.order.items.items() if value.name == item_name), None)
         if item_to_remove:
-            del self.order.items[item_to_remove]
-            self.recalculate_order_totals()
+            self.order.remove_line(item_to_remove)
 
     def adjust_item_quantity(self, item_id, adjustment):
         if item_id in self.order.items:
             item = self.order.items[item_id]
             new_quantity = max(int(item.quantity) + int(adjustment), 1)
             item.quantity = new_quantity
-            item.recompute()
-            self.recalculate_order_totals()
+            self.order.line_changed(item_id)
 
     def get_order_details(self):
         return self.order
@@ -394,36 +493,50 @@ class OrderManager:
     def clear_order(self):
         self.order.clear()
 
-    def save_order_to_disk(self):
-        if not os.path.exists(self.saved_orders_dir):
-            os.makedirs(self.saved_orders_dir)
+    @staticmethod
+    def _saved_item_names(order):
+        return [str(li.name) for li in order.items.values()]
 
-        order_details = self.order.to_dict()
-        order_filename = f"order_{self.order.order_id}.json"
-        filepath = os.path.join(self.saved_orders_dir, order_filename)
+    @staticmethod
+    def _saved_order_id(order):
+        return order.order_id if isinstance(order, Order) else order["order_id"]
+
+    def _import_saved_order_files(self):
+        # orders parked before the saved_orders table were one JSON file each;
+        # a file only goes once its order is safely in the table
+        if not os.path.isdir(self.saved_orders_dir):
+            return
+        for file_name in sorted(os.listdir(self.saved_orders_dir)):
+            if not (file_name.startswith("order_") and file_name.endswith(".json")):
+                continue
+            full_path = os.path.join(self.saved_orders_dir, file_name)
+            try:
+                with open(full_path, "r") as file:
+                    order = Order.from_dict(json.load(file))
+                saved_at = datetime.fromtimestamp(os.path.getmtime(full_path))
+            except Exception as e:
+                logger.warning(f"[Order Manager] Could not import saved order file {file_name}\n{e}")
+                continue
+            if self.app.db_manager.save_parked_order(
+                order.order_id, order.to_dict(), self._saved_item_names(order), saved_at
+            ):
+                os.remove(full_path)
 
-        with open(filepath, "w") as file:
-            json.dump(order_details, file)
+    # parked orders live in the saved_orders table; the *_disk names are
+    # what the popups call
+    def save_order_to_disk(self):
+        return self.app.db_manager.save_parked_order(
+            self.order.order_id, self.order.to_dict(), self._saved_item_names(self.order)
+        )
 
     def delete_order_from_disk(self, order):
-        order_id = order.order_id if isinstance(order, Order) else order["order_id"]
-        order_filename = f"order_{order_id}.json"
-        full_path = os.path.join(self.saved_orders_dir, order_filename)
-        try:
-            os.remove(full_path)
-        except Exception as e:
-            logger.info(f"[Order Manager] Expected error in delete_order_from_disk\n{e}")
+        self.app.db_manager.delete_parked_order(self._saved_order_id(order))
 
     def load_order_from_disk(self, order):
-        order_id = order.order_id if isinstance(order, Order) else order["order_id"]
-        order_filename = f"order_{order_id}.json"
-        full_path = os.path.join(self.saved_orders_dir, order_filename)
-
-        try:
-            with open(full_path, "r") as file:
-                order_data = json.load(file)
-        except Exception as e:
-            logger.warning(f"[Order Manager] load_order_from_disk\n{e}")
+        order_id = self._saved_order_id(order)
+        order_data = self.app.db_manager.get_parked_order(order_id)
+        if order_data is None:
+            logger.warning(f"[Order Manager] load_order_from_disk: no saved order {order_id}")
             return False
 
         try:
@@ -435,40 +548,24 @@ class OrderManager:
             logger.warning(e)
             return False
 
-    def list_all_saved_orders(self):
-        all_order_details = []
-        for file_name in os.listdir(self.saved_orders_dir):
-            if not (file_name.startswith("order_") and file_name.endswith(".json")):
-                continue
-
-            full_path = os.path.join(self.saved_orders_dir, file_name)
-            try:
-                with open(full_path, "r") as file:
-                    order_data = json.load(file)
-                items_payload = order_data.get("items", {}) or {}
-                item_names = []
-                for _, payload in items_payload.items():
-                    if isinstance(payload, dict):
-                        item_names.append(str(payload.get("name", "")))
-                all_order_details.append(
-                    {
-                        "order_id": order_data.get("order_id"),
-                        "items": item_names,
-                    }
-                )
-            except Exception as e:
-                logger.warning(f"[Order Manager] Error reading order file {file_name}\n{e}")
-
-        return all_order_details
+    def list_all_saved_orders(self, limit=None):
+        return self.app.db_manager.list_parked_orders(limit)
 
     def adjust_order_to_target_total(self, target_total_with_tax):
         if target_total_with_tax != "":
-            target_total_with_tax = float(target_total_with_tax)
-            adjusted_subtotal = target_total_with_tax / (1 + self.tax_rate)
-            required_order_level = self.subtotal - adjusted_subtotal
-            if required_order_level < 0 or required_order_level > self.subtotal:
+            order = self.order
+            target_cents = to_cents(float(target_total_with_tax))
+            # the largest pre-tax total whose taxed total is not over the target;
+            # tax rounds per order, so some targets are a cent out of reach
+            total_cents = round_half_up(Decimal(target_cents) / (1 + as_decimal(order.tax_rate)))
+            while total_cents > 0 and total_cents + order.tax_for(total_cents) > target_cents:
+                total_cents -= 1
+            while total_cents + 1 + order.tax_for(total_cents + 1) <= target_cents:
+                total_cents += 1
+            required_order_level = order.subtotal_cents - order.line_item_discount_cents - total_cents
+            if required_order_level < 0 or required_order_level > order.subtotal_cents:
                 return False
-            self.set_order_level_discount(required_order_level)
+            self.set_order_level_discount(from_cents(required_order_level))
             return True
 
     def _finalize_adjust_price(self):
@@ -501,29 +598,24 @@ class OrderManager:
         current_total = self.calculate_total_with_tax()
         if current_total is None or current_total <= 0:
             return []
+        current_cents = self.order.total_with_tax_cents
 
-        step = self._determine_round_down_step(current_total)
-        max_drop = max(current_total * 0.2, step)
+        step = to_cents(self._determine_round_down_step(current_total))
+        max_drop = max(scale_cents(current_cents, "0.2"), step)
         if current_total < 20:
-            max_drop = min(max_drop, 1.0)
+            max_drop = min(max_drop, 100)
 
         targets = []
-        base_target = math.floor(current_total / step) * step
-        base_target = round(base_target, 2)
-        if math.isclose(base_target, current_total):
-            base_target = round(base_target - step, 2)
+        base_target = current_cents // step * step
+        if base_target == current_cents:
+            base_target -= step
 
         while len(targets) < max_options and base_target > 0:
-            drop_amount = current_total - base_target
+            drop_amount = current_cents - base_target
             if drop_amount <= 0 or drop_amount > max_drop:
                 break
-
-            if targets and math.isclose(base_target, targets[-1]):
-                base_target = round(base_target - step, 2)
-                continue
-
-            targets.append(base_target)
-            base_target = round(base_target - step, 2)
+            targets.append(from_cents(base_target))
+            base_target -= step
 
         return targets
 
@@ -553,15 +645,18 @@ class OrderManager:
         self._finalize_adjust_price()
         return True
 
+    def _order_discount_cents(self, discount_amount, percent):
+        # a percent of the subtotal rounds once, half up, like line discounts
+        if percent:
+            cents = round_half_up(Decimal(self.order.subtotal_cents) * as_decimal(discount_amount) / 100)
+        else:
+            cents = to_cents(discount_amount)
+        return min(cents, self.order.subtotal_cents)
+
     def add_discount(self, discount_amount, percent=False):
         # order-level discount only
         discount_amount = float(discount_amount)
-        if percent:
-            add_val = self.subtotal * (discount_amount / 100.0)
-        else:
-            add_val = discount_amount
-        add_val = min(add_val, self.subtotal)
-        self.add_order_level_discount(add_val)
+        self.add_order_level_discount(from_cents(self._order_discount_cents(discount_amount, percent)))
 
     def set_payment_method(self, method):
         self.order.payment_method = method
@@ -607,7 +702,7 @@ class OrderManager:
         if item_id in self.items:
             li = self.items[item_id]
             li.quantity = int(li.quantity) + 1
-            li.recompute()
+            self.order.line_changed(item_id)
         else:
             li = LineItem(
                 item_id=item_id,
@@ -620,10 +715,7 @@ class OrderManager:
                 product_category=product_category,
                 quantity=1,
             )
-            li.recompute()
-            self.items[li.item_id] = li
-
-        self.recalculate_order_totals()
+            self.order.put_line(li)
 
     def finalize_order(self):
         self.recalculate_order_totals()
@@ -682,12 +774,14 @@ class OrderManager:
             pass
 
     def set_order_level_discount(self, amount):
-        self.order.order_level_discount = max(0.0, float(amount))
-        self.recalculate_order_totals()
+        self.order.order_level_discount = from_cents(max(0, to_cents(amount)))
+        self.order.refresh_totals()
 
     def add_order_level_discount(self, amount):
-        self.order.order_level_discount = max(0.0, float(self.order.order_level_discount) + float(amount))
-        self.recalculate_order_totals()
+        self.order.order_level_discount = from_cents(
+            max(0, to_cents(self.order.order_level_discount) + to_cents(amount))
+        )
+        self.order.refresh_totals()
 
     def discount_entire_order(self, discount_amount, percent=False):
         if discount_amount != "":
@@ -696,13 +790,9 @@ class OrderManager:
             except ValueError:
                 return
 
-            if percent:
-                add_val = self.subtotal * (discount_amount / 100.0)
-            else:
-                add_val = discount_amount
-
-            add_val = min(add_val, self.subtotal)
-            self.add_order_level_discount(add_val)
+            self.add_order_level_discount(
+                from_cents(self._order_discount_cents(discount_amount, percent))
+            )
 
             try:
                 self.app.utilities.update_display()
@@ -734,7 +824,7 @@ class OrderManager:
     def remove_order_discount(self):
         if float(self.order.order_level_discount) > 0:
             self.order.order_level_discount = 0.0
-            self.recalculate_order_totals()
+            self.order.refresh_totals()
             self.app.utilities.update_display()
             self.app.utilities.update_financial_summary()
 
@@ -771,8 +861,8 @@ class OrderManager:
 
     def on_cash_confirm(self, instance):
         amount_tendered = float(self.app.popup_manager.cash_payment_input.text)
-        total_with_tax = self.app.order_manager.calculate_total_with_tax()
-        change = amount_tendered - total_with_tax
+        self.calculate_total_with_tax()
+        change = from_cents(to_cents(amount_tendered) - self.order.total_with_tax_cents)
         if hasattr(self.app.popup_manager, "cash_popup"):
             self.app.popup_manager.cash_popup.dismiss()
         if hasattr(self.app.popup_manager, "custom_cash_popup"):
@@ -784,8 +874,8 @@ class OrderManager:
 
     def on_custom_cash_confirm(self, instance):
         amount_tendered = float(self.app.popup_manager.custom_cash_input.text)
-        total_with_tax = self.app.order_manager.calculate_total_with_tax()
-        change = amount_tendered - total_with_tax
+        self.calculate_total_with_tax()
+        change = from_cents(to_cents(amount_tendered) - self.order.total_with_tax_cents)
         if hasattr(self.app.popup_manager, "cash_popup"):
             self.app.popup_manager.cash_popup.dismiss()
         if hasattr(self.app.popup_manager, "custom_cash_popup"):
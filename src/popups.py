@@ -3346,11 +3346,13 @@ class PopupManager:
             if getattr(item, "item_id", None)
         ]
         item_ids = list(dict.fromkeys(item_ids))
-        self.app.db_manager.send_order_to_history_database(order_details)
+        if not self.app.db_manager.commit_order(order_details):
+            self.show_order_commit_error()
+            return
         self.app.order_manager.clear_order()
         self.payment_popup.dismiss()
         self.app.utilities.update_financial_summary()
-        self.app.order_layout.clear_widgets()
+        self.app.utilities.clear_order_display()
         self.app.order_manager.delete_order_from_disk(order_details)
         self.app.popup_manager.show_missing_product_category_popup(item_ids)
 
@@ -3912,6 +3914,27 @@ class PopupManager:
         )
         self.missing_product_category_warning.open()
 
+    def show_order_commit_error(self):
+        layout = BoxLayout(orientation="vertical", padding=10, spacing=10)
+        message = Label(
+            text="The sale could not be saved and is still open.\nPress Done to try again.",
+            halign="center",
+        )
+        layout.add_widget(message)
+        button = MDRaisedButton(
+            text="OK",
+            size_hint=(1, None),
+            height="48dp",
+            on_press=lambda _: self.order_commit_error_popup.dismiss(),
+        )
+        layout.add_widget(button)
+        self.order_commit_error_popup = Popup(
+            title="Order Not Saved",
+            content=layout,
+            size_hint=(0.35, 0.25),
+        )
+        self.order_commit_error_popup.open()
+
     def catch_inventory_item_empty_cost(self):
         layout = BoxLayout()
         message = "Cost can't be empty. If you don't have an actual cost please enter it as 50% of the intended sale price. eg, if you're gonna sell it for 40, put 20 for the cost"
@@ -4333,7 +4356,7 @@ class FinancialSummaryWidget(MDFlatButton):
             cropped_img.save(target_path)
 
     def clear_order(self):
-        self.app.order_layout.clear_widgets()
+        self.app.utilities.clear_order_display()
         self.app.order_manager.clear_order()
         self.app.utilities.update_financial_summary()
         self.order_mod_popup.dismiss()
@@ -4423,7 +4446,7 @@ class FinancialSummaryWidget(MDFlatButton):
         self.app.utilities.update_financial_summary()
 
     def add_saved_orders_to_clock_layout(self):
-        orders = self.app.order_manager.list_all_saved_orders()
+        orders = self.app.order_manager.list_all_saved_orders(limit=5)
         if len(orders) > 0:
             self.app.utilities.saved_order_title.text = "Saved Orders"
             self.app.utilities.saved_order_divider.md_bg_color = "blue"
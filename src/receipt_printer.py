@@ -8,6 +8,7 @@ from escpos.config import Config as _BaseConfig
 from escpos import exceptions, printer
 import yaml
 
+from money import as_decimal, from_cents, to_cents
 from order_manager import LineItem, Order
 
 
@@ -156,14 +157,18 @@ class ReceiptPrinter:
         pad = max(min_gap, width - len(left) - len(right))
         return f"{left}{' ' * pad}{right}"
 
+    def _paper_tax_cents(self, entry) -> int:
+        # per-leaf rates are fractions of a cent, so each line rounds once
+        qty = int(entry.get("quantity") or 0)
+        per_pack_tax = float(entry.get("_total_paper_tax_per_pack", 0.0) or 0.0)
+        if qty <= 0 or per_pack_tax <= 0.0:
+            return 0
+        return to_cents(as_decimal(per_pack_tax) * qty)
+
     def _calc_paper_tax_total(self, order_details) -> float:
-        total = 0.0
-        for e in self._collect_rolling_paper_tax_entries(order_details):
-            qty = int(e.get("quantity") or 0)
-            per_pack_tax = float(e.get("_total_paper_tax_per_pack", 0.0) or 0.0)
-            if qty > 0 and per_pack_tax > 0.0:
-                total += per_pack_tax * qty
-        return round(total, 2)
+        return from_cents(
+            sum(self._paper_tax_cents(e) for e in self._collect_rolling_paper_tax_entries(order_details))
+        )
 
     def _collect_rolling_paper_tax_entries(self, order_details):
         entries = []
@@ -220,7 +225,7 @@ class ReceiptPrinter:
 
         per_paper_rate = float(entries[0].get("per_paper_tax", 0.0) or 0.0)
 
-        total_tax = 0.0
+        total_tax = 0
 
         self.printer.textln()
         self.printer.set(align="left", font="a", bold=True)
@@ -236,19 +241,18 @@ class ReceiptPrinter:
 
             name = (entry.get("item_name") or "Rolling Papers").strip()
             papers = int(entry.get("paper_count") or 0)
-            per_pack_tax = float(entry.get("_total_paper_tax_per_pack", 0.0) or 0.0)
 
-            item_tax = per_pack_tax * qty
+            item_tax = self._paper_tax_cents(entry)
             total_tax += item_tax
 
             left = f"{name} x{qty} ({papers}/pack)"
-            right = f"${item_tax:.2f}"
+            right = f"${from_cents(item_tax):.2f}"
             self.printer.textln(line_left_right(left, right))
 
-        if total_tax > 0.0:
+        if total_tax > 0:
             self.printer.set(align="left", font="a", bold=True)
             self.printer.textln(
-                line_left_right("RI PAPER TAX TOTAL", f"${total_tax:.2f}")
+                line_left_right("RI PAPER TAX TOTAL", f"${from_cents(total_tax):.2f}")
             )
             self.printer.set(align="right", font="a", bold=True)
 
@@ -310,7 +314,7 @@ class ReceiptPrinter:
         total_with_tax = float(order_details.get("total_with_tax") or 0.0)
 
         paper_excise = self._calc_paper_tax_total(order_details)
-        display_subtotal = max(0.0, round(orig_subtotal - paper_excise, 2))
+        display_subtotal = from_cents(max(0, to_cents(orig_subtotal) - to_cents(paper_excise)))
 
         try:
             order_disc = float(order_details.get("total_discount", 0) or 0)
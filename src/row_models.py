@@ -0,0 +1,33 @@
+class RowModel:
+    """RecycleView data item that is not a dict.
+
+    Rows keep a reference to the source record and nothing else; the view
+    class formats it in ``refresh_view_attrs`` and finds view-wide context
+    (the owning view, its order manager) through ``rv.row_context``. Only the
+    handful of rows on screen are ever formatted.
+    """
+
+    __slots__ = ()
+
+    def get(self, key, default=None):
+        # the layout manager asks every data item for optional per-row keys
+        # (size, size_hint, viewclass); rows never override them
+        return default
+
+
+class ItemRow(RowModel):
+    """An items row as returned by get_all_items / the catalog."""
+
+    __slots__ = ("item",)
+
+    def __init__(self, item):
+        self.item = item
+
+
+class OrderRow(RowModel):
+    """An order summary row as returned by get_order_history_page."""
+
+    __slots__ = ("order",)
+
+    def __init__(self, order):
+        self.order = order
@@ -0,0 +1,333 @@
+import bisect
+import heapq
+import time
+from math import log1p
+
+# Prefixes up to this length get their own posting set; they match so many
+# tokens that unioning the sorted-token range on every keystroke would cost
+# more than the index saves.
+SHORT_PREFIX_LEN = 2
+
+_TOKEN_END = "\U0010ffff"
+
+# Fuzzy matching: bigrams of "^" + token pick candidate tokens, and a bounded
+# edit distance against the token's prefix decides. Queries shorter than
+# FUZZY_MIN_LEN only ever match exactly.
+FUZZY_MIN_LEN = 3
+
+
+def _bigrams(token):
+    padded = "^" + token
+    return {padded[i:i + 2] for i in range(len(padded) - 1)}
+
+
+def max_edits(q):
+    """Edits tolerated in a query token: none for short ones, up to two for long ones."""
+    if len(q) < FUZZY_MIN_LEN:
+        return 0
+    return 1 if len(q) < 6 else 2
+
+
+def prefix_distance(q, tok, k):
+    """Edit distance from ``q`` to the closest prefix of ``tok``, or None if over ``k``.
+
+    Adjacent transpositions count as one edit, so "rwa" is one edit from "raw".
+    """
+    tok = tok[: len(q) + k]
+    n = len(tok)
+    prev2 = None
+    prev = list(range(n + 1))
+    for i in range(1, len(q) + 1):
+        qi = q[i - 1]
+        cur = [i] + [0] * n
+        row_min = i
+        for j in range(1, n + 1):
+            v = prev[j - 1] + (qi != tok[j - 1])
+            if prev[j] + 1 < v:
+                v = prev[j] + 1
+            if cur[j - 1] + 1 < v:
+                v = cur[j - 1] + 1
+            if i > 1 and j > 1 and qi == tok[j - 2] and q[i - 2] == tok[j - 1]:
+                if prev2[j - 2] + 1 < v:
+                    v = prev2[j - 2] + 1
+            cur[j] = v
+            if v < row_min:
+                row_min = v
+        if row_min > k:
+            return None
+        prev2, prev = prev, cur
+    best = min(prev)
+    return best if best <= k else None
+
+
+def match_prefixes(tokens, q_tokens):
+    """Greedily pair each query token with the earliest unused token it prefixes."""
+    used = set()
+    matches = []
+    for q in q_tokens:
+        best_i = None
+        best_tok = None
+        for i, tok in enumerate(tokens):
+            if i in used:
+                continue
+            if tok.startswith(q):
+                if best_i is None or i < best_i or (i == best_i and len(tok) < len(best_tok)):
+                    best_i = i
+                    best_tok = tok
+        if best_i is None:
+            return None
+        used.add(best_i)
+        matches.append((best_i, best_tok))
+    return matches
+
+
+class SearchIndex:
+    """Token-prefix index over inventory search entries.
+
+    Entries are the dicts InventoryView builds (``item``, ``name``,
+    ``n_name``, ``tokens``, ``sold``) and are added and removed by key, so
+    catalog events can patch the index in place. Short prefixes map straight
+    to posting sets; longer ones resolve to a contiguous run of a sorted token
+    list. Candidates are the intersection of the query tokens' postings and
+    only they are scored, with the top ``limit`` picked by a heap.
+
+    The docs matching the previous query are kept. When the next query only
+    appends to it, as it does while someone types, the search starts from
+    that set instead of the postings. Any edit to the index drops it.
+
+    With ``fuzzy`` on, a query that matches fewer than ``fuzzy_min_results``
+    items is topped up with typo-tolerant matches, ranked after the exact
+    ones. That pass stops after ``fuzzy_budget`` seconds and returns what it
+    has, so a bad query cannot stall the caller.
+    """
+
+    def __init__(self, limit=200, fuzzy=False, fuzzy_min_results=5, fuzzy_budget=0.02):
+        self.limit = limit
+        self.fuzzy = fuzzy
+        self.fuzzy_min_results = fuzzy_min_results
+        self.fuzzy_budget = fuzzy_budget
+        self.clear()
+
+    def clear(self):
+        self._entries = {}
+        self._doc_of_key = {}
+        self._next_doc = 0
+        self._postings = {}
+        self._short = {}
+        self._tokens = []
+        self._grams = {}
+        self._forget_last()
+
+    def _forget_last(self):
+        self._last_query = None
+        self._last_matched = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._doc_of_key
+
+    def add(self, key, entry):
+        if key in self._doc_of_key:
+            self.remove(key)
+        self._forget_last()
+        doc = self._next_doc
+        self._next_doc += 1
+        self._doc_of_key[key] = doc
+        self._entries[doc] = entry
+        for tok in set(entry["tokens"]):
+            posting = self._postings.get(tok)
+            if posting is None:
+                posting = self._postings[tok] = set()
+                bisect.insort(self._tokens, tok)
+                for gram in _bigrams(tok):
+                    self._grams.setdefault(gram, set()).add(tok)
+            posting.add(doc)
+            for n in range(1, min(len(tok), SHORT_PREFIX_LEN) + 1):
+                self._short.setdefault(tok[:n], set()).add(doc)
+
+    def remove(self, key):
+        doc = self._doc_of_key.pop(key, None)
+        if doc is None:
+            return False
+        entry = self._entries.pop(doc)
+        self._forget_last()
+        for tok in set(entry["tokens"]):
+            posting = self._postings.get(tok)
+            if posting is not None:
+                posting.discard(doc)
+                if not posting:
+                    del self._postings[tok]
+                    i = bisect.bisect_left(self._tokens, tok)
+                    if i < len(self._tokens) and self._tokens[i] == tok:
+                        del self._tokens[i]
+                    for gram in _bigrams(tok):
+                        toks = self._grams.get(gram)
+                        if toks is not None:
+                            toks.discard(tok)
+                            if not toks:
+                                del self._grams[gram]
+            for n in range(1, min(len(tok), SHORT_PREFIX_LEN) + 1):
+                short = self._short.get(tok[:n])
+                if short is not None:
+                    short.discard(doc)
+                    if not short:
+                        del self._short[tok[:n]]
+        return True
+
+    def prefix_docs(self, prefix):
+        """Docs with at least one token starting with ``prefix``."""
+        if len(prefix) <= SHORT_PREFIX_LEN:
+            return self._short.get(prefix, set())
+        lo = bisect.bisect_left(self._tokens, prefix)
+        hi = bisect.bisect_left(self._tokens, prefix + _TOKEN_END, lo)
+        if hi - lo == 1:
+            return self._postings[self._tokens[lo]]
+        docs = set()
+        for tok in self._tokens[lo:hi]:
+            docs |= self._postings[tok]
+        return docs
+
+    def candidates(self, q_tokens):
+        postings = sorted((self.prefix_docs(q) for q in set(q_tokens)), key=len)
+        if not postings or not postings[0]:
+            return set()
+        result = set(postings[0])
+        for docs in postings[1:]:
+            result &= docs
+            if not result:
+                break
+        return result
+
+    def _refinable(self, query_norm):
+        # Appending to a normalized query either lengthens its last token or
+        # adds tokens; either way anything the new query matches, the old one
+        # matched too, because match_prefixes assigns tokens left to right.
+        last = self._last_query
+        return last is not None and query_norm.startswith(last)
+
+    def search(self, query_norm):
+        """Return up to ``limit`` items for a normalized, non-empty query."""
+        docs = self._strict_search(query_norm)
+        if self.fuzzy and len(docs) < min(self.fuzzy_min_results, self.limit):
+            docs += self._fuzzy_search(query_norm.split(), set(docs), self.limit - len(docs))
+        return [self._entries[doc]["item"] for doc in docs]
+
+    def _strict_search(self, query_norm):
+        q_tokens = query_norm.split()
+        if not q_tokens:
+            self._forget_last()
+            return []
+        entries = self._entries
+
+        if self._refinable(query_norm):
+            candidates = self._last_matched
+            if len(q_tokens) == 1 and len(query_norm) <= 2:
+                candidates = candidates & self.prefix_docs(q_tokens[0])
+        else:
+            candidates = self.candidates(q_tokens)
+
+        if len(q_tokens) == 1 and len(query_norm) <= 2:
+            self._last_query, self._last_matched = query_norm, candidates
+            top = heapq.nsmallest(
+                self.limit,
+                candidates,
+                key=lambda doc: (-entries[doc]["sold"], entries[doc]["name"], doc),
+            )
+            return top
+
+        scored = []
+        matched = set()
+        for doc in candidates:
+            r = entries[doc]
+            m = match_prefixes(r["tokens"], q_tokens)
+            if m is None:
+                continue
+            matched.add(doc)
+
+            quality = 0.0
+            for q, (i, tok) in zip(q_tokens, m):
+                completion = len(q) / max(1, len(tok))
+                quality += 100.0 * completion - 2.0 * i
+
+            if r["n_name"].startswith(query_norm):
+                quality += 15.0
+
+            final = quality * 1000.0 + 2500.0 * log1p(r["sold"])
+            scored.append((-final, -r["sold"], r["name"], doc))
+
+        self._last_query, self._last_matched = query_norm, matched
+        return [doc for _, _, _, doc in heapq.nsmallest(self.limit, scored)]
+
+    def _fuzzy_tokens(self, q, deadline):
+        """{token: edits} for index tokens within max_edits(q) of ``q``."""
+        k = max_edits(q)
+        lo = bisect.bisect_left(self._tokens, q)
+        hi = bisect.bisect_left(self._tokens, q + _TOKEN_END, lo)
+        found = {tok: 0 for tok in self._tokens[lo:hi]}
+        if not k:
+            return found
+
+        q_grams = _bigrams(q)
+        shared = {}
+        for gram in q_grams:
+            if time.perf_counter() > deadline:
+                break
+            for tok in self._grams.get(gram, ()):
+                shared[tok] = shared.get(tok, 0) + 1
+        # each edit breaks at most two bigrams, a transposition three
+        need = max(1, len(q_grams) - 2 * k - 1)
+        ranked = sorted(
+            (tok for tok, n in shared.items() if n >= need and tok not in found),
+            key=lambda tok: -shared[tok],
+        )
+        for tok in ranked:
+            if time.perf_counter() > deadline:
+                break
+            edits = prefix_distance(q, tok, k)
+            if edits is not None:
+                found[tok] = edits
+        return found
+
+    def _fuzzy_search(self, q_tokens, exclude, limit):
+        if limit <= 0 or not any(len(q) >= FUZZY_MIN_LEN for q in q_tokens):
+            return []
+        deadline = time.perf_counter() + self.fuzzy_budget
+        entries = self._entries
+
+        matches = []
+        candidates = None
+        for q in q_tokens:
+            toks = self._fuzzy_tokens(q, deadline)
+            docs = set()
+            for tok in toks:
+                docs |= self._postings[tok]
+            candidates = docs if candidates is None else candidates & docs
+            if not candidates:
+                return []
+            matches.append(toks)
+        candidates -= exclude
+
+        scored = []
+        for doc in candidates:
+            if time.perf_counter() > deadline:
+                break
+            r = entries[doc]
+            used = set()
+            total = 0
+            for toks in matches:
+                best = None
+                for i, tok in enumerate(r["tokens"]):
+                    edits = toks.get(tok)
+                    if i in used or edits is None:
+                        continue
+                    if best is None or edits < best[0]:
+                        best = (edits, i)
+                if best is None:
+                    break
+                used.add(best[1])
+                total += best[0]
+            else:
+                scored.append((total, -r["sold"], r["name"], doc))
+        return [doc for _, _, _, doc in heapq.nsmallest(limit, scored)]
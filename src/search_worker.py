@@ -0,0 +1,135 @@
+import threading
+import logging
+from collections import deque
+
+from kivy.clock import Clock
+
+logger = logging.getLogger("rigs_pos")
+
+
+class SearchChannel:
+    """One view's lane on the SearchWorker.
+
+    ``submit`` replaces whatever query the channel had pending, and a result
+    is only delivered if no newer query was submitted (or ``cancel`` called)
+    while it was computing. ``call`` runs index maintenance on the worker in
+    submission order, so the state a query reads is only ever touched by the
+    worker thread.
+    """
+
+    def __init__(self, worker, name):
+        self.worker = worker
+        self.name = name
+        self.generation = 0
+
+    def submit(self, compute, apply):
+        self.generation += 1
+        self.worker._submit(self, self.generation, compute, apply)
+        return self.generation
+
+    def cancel(self):
+        self.generation += 1
+        self.worker._drop(self)
+
+    def call(self, fn):
+        self.worker._call(self, fn)
+
+
+class SearchWorker:
+    """Runs inventory searches on one background thread.
+
+    Queries are computed off the Kivy main thread and only the finished
+    result is handed back through Clock.schedule_once. Each channel keeps at
+    most one pending query, so a burst of keystrokes costs one search, and a
+    result that has been overtaken by a newer query is dropped rather than
+    drawn.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._calls = deque()
+        self._pending = {}
+        self.searches_run = 0
+        self.searches_dropped = 0
+        self._thread = threading.Thread(target=self._run, name="search-worker", daemon=True)
+        self._thread.start()
+
+    def channel(self, name):
+        return SearchChannel(self, name)
+
+    def _submit(self, channel, generation, compute, apply):
+        with self._cond:
+            if self._pending.pop(channel, None) is not None:
+                self.searches_dropped += 1
+            self._pending[channel] = (generation, compute, apply)
+            self._cond.notify()
+
+    def _drop(self, channel):
+        with self._cond:
+            if self._pending.pop(channel, None) is not None:
+                self.searches_dropped += 1
+
+    def _count_dropped(self):
+        # the worker and main threads both drop searches; += is not atomic
+        with self._cond:
+            self.searches_dropped += 1
+
+    def _call(self, channel, fn):
+        with self._cond:
+            self._calls.append((channel, fn))
+            self._cond.notify()
+
+    def _next_job(self):
+        with self._cond:
+            while not self._calls and not self._pending:
+                self._cond.wait()
+            if self._calls:
+                return self._calls.popleft()
+            channel = next(iter(self._pending))
+            return channel, self._pending.pop(channel)
+
+    def _run(self):
+        while True:
+            channel, job = self._next_job()
+            if callable(job):
+                try:
+                    job()
+                except Exception as e:
+                    logger.error(f"[SearchWorker] {channel.name} update failed: {e}")
+                continue
+
+            generation, compute, apply = job
+            if generation != channel.generation:
+                self._count_dropped()
+                continue
+            try:
+                result = compute()
+            except Exception as e:
+                logger.error(f"[SearchWorker] {channel.name} search failed: {e}")
+                continue
+            self.searches_run += 1
+            if generation != channel.generation:
+                self._count_dropped()
+                continue
+            Clock.schedule_once(
+                lambda dt, c=channel, g=generation, a=apply, r=result: self._deliver(c, g, a, r)
+            )
+
+    def _deliver(self, channel, generation, apply, result):
+        # runs on the main thread; a newer query may have arrived since
+        if generation != channel.generation:
+            self._count_dropped()
+            return
+        apply(result)
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def get_search_worker():
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            _worker = SearchWorker()
+        return _worker
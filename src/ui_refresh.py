@@ -0,0 +1,85 @@
+import logging
+
+from kivy.clock import Clock
+
+logger = logging.getLogger("rigs_pos")
+
+
+class RefreshScheduler:
+    """Coalesces order panel and financial summary refreshes to one per frame.
+
+    ``mark_display`` and ``mark_summary`` only set a dirty flag and arm a
+    next-frame trigger, so however many order changes land in one frame
+    (a burst of scans, a discount followed by a quantity change) they
+    render once. Each summary render arms the mirror snapshot, which is a
+    trigger too and runs at most once per ``mirror_delay``. The counters
+    show how many requests there were against how many renders ran.
+    """
+
+    def __init__(self, render_display, render_summary, render_mirror, mirror_delay=0.1):
+        self._render_display = render_display
+        self._render_summary = render_summary
+        self._render_mirror = render_mirror
+        self._display_dirty = False
+        self._summary_dirty = False
+        self._frame_trigger = Clock.create_trigger(self.flush)
+        self._mirror_trigger = Clock.create_trigger(self._flush_mirror, mirror_delay)
+
+        self.display_requests = 0
+        self.display_renders = 0
+        self.summary_requests = 0
+        self.summary_renders = 0
+        self.mirror_requests = 0
+        self.mirror_renders = 0
+
+    def mark_display(self):
+        self.display_requests += 1
+        self._display_dirty = True
+        self._frame_trigger()
+
+    def mark_summary(self):
+        self.summary_requests += 1
+        self._summary_dirty = True
+        self._frame_trigger()
+
+    def flush(self, *_):
+        """Render whatever is dirty now; the frame trigger lands here too."""
+        if self._display_dirty:
+            self._display_dirty = False
+            self.display_renders += 1
+            try:
+                self._render_display()
+            except Exception as e:
+                logger.error(f"[RefreshScheduler] order display refresh failed: {e}")
+        if self._summary_dirty:
+            self._summary_dirty = False
+            self.summary_renders += 1
+            try:
+                self._render_summary()
+            except Exception as e:
+                logger.error(f"[RefreshScheduler] financial summary refresh failed: {e}")
+            self.mirror_requests += 1
+            self._mirror_trigger()
+
+    def _flush_mirror(self, dt):
+        self.mirror_renders += 1
+        self._render_mirror(dt)
+
+    @property
+    def renders_saved(self):
+        return (
+            self.display_requests - self.display_renders
+            + self.summary_requests - self.summary_renders
+            + self.mirror_requests - self.mirror_renders
+        )
+
+    def stats(self):
+        return {
+            "display_requests": self.display_requests,
+            "display_renders": self.display_renders,
+            "summary_requests": self.summary_requests,
+            "summary_renders": self.summary_renders,
+            "mirror_requests": self.mirror_requests,
+            "mirror_renders": self.mirror_renders,
+            "renders_saved": self.renders_saved,
+        }
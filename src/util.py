@@ -43,7 +43,6 @@ import sys
 import threading
 import time
 import uuid
-from typing import Dict
 import pwd
 import glob
 import re
@@ -59,7 +58,6 @@ from x11_power import x11_idle_ms, x11_dpms_force_off, x11_backlight_set_percent
 
 
 from datetime import datetime, timedelta
-from collections import defaultdict
 
 from kivy.clock import Clock
 from kivy.uix.behaviors import ButtonBehavior
@@ -79,12 +77,16 @@ from barcode_scanner import BarcodeScanner
 from button_handlers import ButtonHandler
 from database_manager import DatabaseManager
 from history_manager import HistoryPopup, HistoryView
-from inventory_manager import InventoryManagementRow, InventoryManagementView, InventoryView
+from inventory_manager import InventoryManagementRow, InventoryManagementView
+from barcode_cache import make_barcode_cache
+from item_catalog import RELOADED, REMOVED, row_key
 from label_printer import LabelPrinter, LabelPrintingView
 from open_cash_drawer import open_cash_drawer
+from order_display import OrderDisplay
 from order_manager import OrderManager
 from popups import FinancialSummaryWidget, PopupManager
 from receipt_printer import ReceiptPrinter
+from ui_refresh import RefreshScheduler
 
 
 def log_caller_info(depth=1):
@@ -104,43 +106,16 @@ class MarkupLabel(MDLabel):
         self.markup = True
 
 
-class BarcodeCache:
-
-    def __init__(self, rows):
-        self.main = defaultdict(lambda: {"items": []})
-        self.variant: Dict[str, str] = {}
-
-        for row in rows:
-            canon = str(row[0]).strip()
-            self.main[canon]["items"].append(row)
-
-        for canon, data in self.main.items():
-            data["is_dupe"] = len(data["items"]) > 1
-            for v in self._gen_variants(canon):
-                self.variant[v] = canon
-            for item in data["items"]:
-                if isinstance(item, dict):
-                    ean_value = item.get("ean_barcode")
-                else:
-                    ean_value = item[12] if len(item) > 12 else None
-                if ean_value:
-                    self.variant[str(ean_value).strip()] = canon
-
-    @staticmethod
-    def _gen_variants(code: str):
-        yield code
-        if len(code) > 1:
-            yield code[1:]
-        if len(code) > 4:
-            yield code[:-4]
-            yield code[1:-4]
-
-
 class Utilities:
     def __init__(self, ref):
         self.app = ref
         self.clock_in_file = ""
         self.popup_manager = PopupManager(None)
+        self.refresh = RefreshScheduler(
+            self._render_display,
+            self._render_financial_summary,
+            lambda dt: self.app.financial_summary.update_mirror_image(dt),
+        )
         self.font = "images/VarelaRound-Regular.ttf"
         self.screen_brightness = 75
         self._session_dirs = [
@@ -208,6 +183,10 @@ class Utilities:
         self.app.popup_manager = PopupManager(self.app)
 
         self.app.barcode_cache = self.initialize_barcode_cache()
+        self._inventory_cache_trigger = Clock.create_trigger(
+            lambda dt: self.update_inventory_cache()
+        )
+        self.app.db_manager.catalog.subscribe(self._on_catalog_change)
 
 
     def initialize_receipt_printer(self):
@@ -217,11 +196,11 @@ class Utilities:
             logger.error(f"\n\nFIXME\n\n{e}")
 
     def initialize_barcode_cache(self):
-        rows = self.app.db_manager.get_all_items()
-        return BarcodeCache(rows)
+        rows = self.app.db_manager.catalog.rows()
+        return make_barcode_cache(rows)
 
     def initialize_inventory_cache(self):
-        inventory = self.app.db_manager.get_all_items()
+        inventory = self.app.db_manager.catalog.rows()
         return inventory
 
 
@@ -446,51 +425,24 @@ class Utilities:
         return None
 
     def update_inventory_cache(self):
-        inventory = self.app.db_manager.get_all_items()
+        inventory = self.app.db_manager.catalog.rows()
         self.app.inventory_cache = inventory
 
-    def _refresh_barcode_cache_variants(self):
-        cache = self.app.barcode_cache
-        cache.variant = {}
-        for canon, data in cache.main.items():
-            data["is_dupe"] = len(data["items"]) > 1
-            for v in cache._gen_variants(canon):
-                cache.variant[v] = canon
-            for item in data["items"]:
-                if isinstance(item, dict):
-                    ean_value = item.get("ean_barcode")
-                else:
-                    ean_value = item[12] if len(item) > 12 else None
-                if ean_value:
-                    cache.variant[str(ean_value).strip()] = canon
+    def _on_catalog_change(self, event, row, previous):
+        if event == RELOADED:
+            self.app.barcode_cache = self.initialize_barcode_cache()
+            self.update_inventory_cache()
+            return
+        if event == REMOVED:
+            self.app.barcode_cache.remove(row_key(previous))
+        else:
+            self.app.barcode_cache.upsert(row)
+        # rows() rebuilds the catalog's snapshot, so a burst of edits waits
+        # for the next frame and pays for one copy
+        self._inventory_cache_trigger()
 
     def update_barcode_cache(self, item_details):
-        cache = self.app.barcode_cache
-        raw_barcode = item_details["barcode"]
-        barcode = str(raw_barcode).strip()
-        item_id = str(item_details.get("item_id", "")).strip()
-
-        if item_id:
-            for canon in list(cache.main.keys()):
-                items = cache.main[canon]["items"]
-                kept_items = []
-                for item in items:
-                    if isinstance(item, dict):
-                        existing_id = item.get("item_id")
-                    else:
-                        existing_id = item[6] if len(item) > 6 else None
-                    if str(existing_id).strip() != item_id:
-                        kept_items.append(item)
-                if kept_items:
-                    cache.main[canon]["items"] = kept_items
-                else:
-                    del cache.main[canon]
-
-        canonical = barcode
-        bucket = cache.main[canonical]
-        bucket["items"].append(item_details)
-        self._refresh_barcode_cache_variants()
-
+        self.app.barcode_cache.upsert(item_details)
 
     def store_user_details(self, name, pin, admin):
         user_details = {"name": name, "pin": pin, "admin": admin}
@@ -851,86 +803,18 @@ class Utilities:
                     logger.warn(e)
 
     def update_display(self):
-        self.app.order_layout.clear_widgets()
-
-        for item_id, item_info in self.app.order_manager.items.items():
-            name = item_info.name
-            unit_price = item_info.unit_price
-            quantity = item_info.quantity
-            barcode = item_info.barcode
-            is_custom = item_info.is_custom
-            discounts = item_info.discounts
-            line_subtotal = item_info.line_subtotal
-            line_discount_total = item_info.line_discount_total
-            total_price = item_info.total_price
-            price_times_quantity = unit_price * quantity
-
-            if isinstance(total_price, (int, float)):
-                if quantity > 1:
-                    if line_discount_total > 0:
-                        item_display_text = f"{name}"
-                        price_display_text = f"${price_times_quantity:.2f} - {line_discount_total:.2f}\n = ${total_price:.2f}"
-                        quantity_display_text = f"{quantity}"
-                    else:
-                        item_display_text = f"{name}"
-                        price_display_text = f"${total_price:.2f}"
-                        quantity_display_text = f"{quantity}"
-                else:
-                    if line_discount_total > 0:
-                        item_display_text = f"{name}"
-                        price_display_text = f"${price_times_quantity:.2f} - {line_discount_total:.2f}\n = ${total_price:.2f}"
-                        quantity_display_text = ""
-                    else:
-                        item_display_text = f"{name}"
-                        price_display_text = f"${total_price:.2f}"
-                        quantity_display_text = ""
-            else:
-                return
-            blue_line = MDBoxLayout(size_hint_x=1, size_hint_y=None, height=1)
-            blue_line.md_bg_color = (0.56, 0.56, 1, 1)
-            blue_line2 = MDBoxLayout(size_hint_x=1, size_hint_y=None, height=1)
-            blue_line2.md_bg_color = (0.56, 0.56, 1, 1)
-            blue_line3 = MDBoxLayout(size_hint_x=1, size_hint_y=None, height=1)
-            blue_line3.md_bg_color = (0.56, 0.56, 1, 1)
-            item_layout = GridLayout(
-                orientation="lr-tb", cols=3, rows=2, size_hint=(1, 1)
-            )
-            item_label_container = BoxLayout(size_hint_x=None, width=550)
-            item_label = MarkupLabel(text=f"[size=20]{item_display_text}[/size]")
-            item_label_container.add_widget(item_label)
-
-            spacer = MarkupLabel(size_hint_x=1)
-            # item_layout.add_widget(spacer)
-            price_label_container = BoxLayout(size_hint_x=None, width=150)
-            price_label = MarkupLabel(
-                text=f"[size=20]{price_display_text}[/size]", halign="right"
-            )
-            price_label_container.add_widget(price_label)
+        self.refresh.mark_display()
 
-            quantity_label_container = BoxLayout(size_hint_x=None, width=50)
-            quantity_label = MarkupLabel(
-                text=f"[size=20]{quantity_display_text}[/size]"
-            )
-            quantity_label_container.add_widget(quantity_label)
-
-            item_layout.add_widget(item_label_container)
-            item_layout.add_widget(quantity_label_container)
-            item_layout.add_widget(price_label_container)
-            item_layout.add_widget(blue_line)
-            item_layout.add_widget(blue_line2)
-            item_layout.add_widget(blue_line3)
-
-            item_button = MDFlatButton(size_hint=(1, 1))
-            item_button.add_widget(item_layout)
-            item_button.bind(
-                on_press=lambda x, item_button=item_button, item_id=item_id: self.app.popup_manager.show_item_details_popup(
-                    item_id, item_button
-                )
-            )
+    def _render_display(self):
+        self.order_display.update(self.app.order_manager.items)
 
-            self.app.order_layout.add_widget(item_button)
+    def clear_order_display(self):
+        self.order_display.clear()
 
     def update_financial_summary(self):
+        self.refresh.mark_summary()
+
+    def _render_financial_summary(self):
         subtotal = self.app.order_manager.subtotal
         total_with_tax = self.app.order_manager.calculate_total_with_tax()
         tax = self.app.order_manager.tax_amount
@@ -939,7 +823,6 @@ class Utilities:
         self.app.financial_summary_widget.update_summary(
             subtotal, tax, total_with_tax, discount
         )
-        Clock.schedule_once(self.app.financial_summary.update_mirror_image, 0.1)
 
     def manual_override(self, instance):
 
@@ -985,6 +868,12 @@ class Utilities:
         self.top_area_layout.add_widget(self.center_container)
 
         self.app.order_layout = self._build_order_grid()
+        self.order_display = OrderDisplay(
+            self.app.order_layout,
+            lambda item_id, item_button: self.app.popup_manager.show_item_details_popup(
+                item_id, item_button
+            ),
+        )
         self._populate_right_area(right_area_layout)
         self.top_area_layout.add_widget(right_area_layout)
 
@@ -1826,9 +1715,6 @@ class Utilities:
             False,
             "",
         )
-        self.update_inventory_cache()
-        iv = InventoryView(self.app.order_manager)
-        iv.refresh_from_app_cache()
         self.app.inventory_manager.refresh_inventory()
         if getattr(self.app.label_manager, "dual_pane_mode", False):
             self.app.inventory_manager.refresh_label_inventory_for_dual_pane_mode()